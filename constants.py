@@ -7,22 +7,283 @@ DELETE = "delete"
 INSERT = "insert"
 BEGIN = "begin"
 COMMIT = "commit"
+TABLES = "tables"
+SIMPLE = "simple"
+COMPOSITE = "composite"
+RANGE = "range"
+UPDATE_SETS = "update_sets"
+PROJECTION = "projection"
+CONSTANTS = "constants"
+JOIN = "join"
+
+# dataframe column constant
+QUERY = "query"
+SAMPLE = "sample"
+TYPE = "type"
+COUNT = "count"
+WEIGHT = "weight"
+TIMESTAMP = "timestamp"
+
+"""
+Classifies a raw query log entry in a single pass:
+    * query: the sql statement after the log prefix (e.g. "statement: ")
+    * type: the leading statement keyword
+    * where: set only if the statement has a WHERE predicate
+"""
+QUERY_PATTERN = r"^[^:]*:\s*(?P<query>(?P<type>select|update|delete|insert)\b(?P<where>.*?\bwhere\b)?.*)$"
+
+# extractor constant
+FAST_PATH = "fast"
+PARSER_PATH = "parser"
+FAILED = "failed"
+
+"""
+Tokens of the fast extractor: literals (strings, numbers and parameters), names (quoted or not) and symbols.
+A query containing anything else is left to sql_metadata.
+"""
+TOKEN_PATTERN = r"""\s*(?:(?P<literal>'(?:[^']|'')*'|\d+(?:\.\d+)?|\$\d+|\?)|(?P<name>"[^"]+"|[A-Za-z_][\w$]*)|(?P<symbol><>|!=|<=|>=|[=<>(),.*+\-/%]))"""
+
+"""
+Operators making a predicate a range predicate rather than an equality predicate,
+{0} is replaced by the column name. Both "column < value" and "value > column" are matched.
+"""
+RANGE_PREDICATE_PATTERN = (r'(?i)(?<![\w"])"?{0}"?\s*(?:<=|>=|<>|!=|<|>|(?:NOT\s+)?(?:BETWEEN|I?LIKE)\b)'
+                           r'|(?:<=|>=|<|>)\s*(?:[\w"]+\.)?"?{0}"?(?![\w"])')
+
+"""
+Equality predicates comparing a column with a literal (string, number, boolean or parameter),
+{column} = {value} with the literal kept as written.
+"""
+CONSTANT_PREDICATE_PATTERN = (r"""(?i)(?<![\w."])(?P<column>(?:[A-Za-z_]\w*\.)?[A-Za-z_]\w*)\s*=\s*"""
+                              r"""(?P<value>'(?:[^']|'')*'|-?\d+(?:\.\d+)?|\$\d+|true|false)(?![\w.'])""")
+
+"""
+Equality predicates between two qualified columns, i.e. join predicates written in the WHERE clause.
+"""
+JOIN_PREDICATE_PATTERN = r"""(?<![\w."])(\w+)\.(\w+)\s*=\s*(\w+)\.(\w+)(?![\w."])"""
+
+"""
+Tokens delimiting the top-level AND conjuncts of a WHERE predicate: literals and quoted names are skipped,
+parentheses nest, and a clause keyword (or the parenthesis closing a subquery) ends the predicate.
+"""
+CONJUNCT_PATTERN = (r"""(?i)'(?:[^']|'')*'|"[^"]*"|[()]"""
+                    r"""|\b(?P<keyword>AND|ORDER|GROUP|LIMIT|OFFSET|FOR|HAVING|RETURNING|WINDOW|UNION|INTERSECT|EXCEPT)\b""")
+
+"""
+Keywords the fast extractor understands inside a WHERE predicate, keywords ending the predicate
+and keywords it understands inside the ORDER BY / GROUP BY clauses.
+Any other keyword listed in RESERVED_KEYWORDS makes the fast extractor give up.
+"""
+PREDICATE_KEYWORDS = {"AND", "OR", "NOT", "IN", "IS", "NULL", "LIKE", "ILIKE", "BETWEEN", "TRUE", "FALSE"}
+CLAUSE_KEYWORDS = {"ORDER", "GROUP", "LIMIT", "OFFSET", "FOR"}
+ORDER_KEYWORDS = {"BY", "ASC", "DESC", "NULLS", "FIRST", "LAST"}
+RESERVED_KEYWORDS = {"SELECT", "FROM", "WHERE", "SET", "AS", "JOIN", "INNER", "LEFT", "RIGHT", "FULL", "CROSS",
+                     "NATURAL", "ON", "USING", "UNION", "INTERSECT", "EXCEPT", "WITH", "EXISTS", "ANY", "ALL", "SOME",
+                     "CASE", "WHEN", "THEN", "ELSE", "END", "CAST", "DISTINCT", "SIMILAR", "ESCAPE", "COLLATE",
+                     "HAVING", "RETURNING", "WINDOW", "OVER", "LATERAL", "ONLY", "VALUES", "DEFAULT", "ARRAY",
+                     "INTERVAL", "CURRENT_DATE", "CURRENT_TIME", "CURRENT_TIMESTAMP"} | CLAUSE_KEYWORDS
 
 # cutoff constant
 
 """
-If a column is updated more than UPDATE_CUTOFF.
-a candidate index is no longer considered if 
-    * a composite index (multi-column index) is referenced less than COMPOSITE_REFERENCE_CUTOFF_HIGH
-    * a simple index (single-column index) is referenced less than SIMPLE_REFERENCE_CUT_OFF_HIGH
+A simple index (single-column index) is only considered
+if it is referenced more than SIMPLE_REFERENCE_CUT_OFF_HIGH.
 """
-UPDATE_CUTOFF = 0.05
-COMPOSITE_REFERENCE_CUTOFF_HIGH = 0.2
 SIMPLE_REFERENCE_CUT_OFF_HIGH = 0.2
 
+"""
+A join key column is considered as a candidate index (single-column index)
+if it is referenced in join predicates more than JOIN_REFERENCE_CUTOFF,
+so that nested loop joins can look it up and merge joins can read it in order.
+"""
+JOIN_REFERENCE_CUTOFF = 0.1
+
 """
 If a column (or columns) is used more than REFERENCE_CUTOFF_LOW 
 it will be considered as a candidate index.
 """
 REFERENCE_CUTOFF_LOW = 0.1
 
+"""
+Every index of a table has to be maintained by
+    * every insert into the table
+    * every delete from the table (once vacuumed)
+    * every update of the table that cannot be HOT, i.e. that sets an indexed column of the table
+The write cost of a candidate index is the weighted fraction of queries maintaining it,
+plus the updates that are no longer HOT because of it, times the number of other indices of the table.
+A candidate index is no longer considered if its write cost is more than its percent usage.
+"""
+INSERT_COST_WEIGHT = 0.25
+DELETE_COST_WEIGHT = 0.1
+UPDATE_COST_WEIGHT = 1.0
+
+"""
+An existing index that is not recommended is removed if it was never scanned
+and is at least UNUSED_INDEX_SIZE_CUTOFF bytes, even if it is made up of recommended indices
+(or could not be compared with them, e.g. an expression or partial index).
+"""
+UNUSED_INDEX_SIZE_CUTOFF = 8 * 1024 * 1024
+
+
+# ingestion constant
+
+"""
+Number of csv rows read at a time when streaming the workload.
+The same number of rows is used to locate the query log column.
+"""
+CSV_CHUNKSIZE = 100000
+
+# parse cache constant
+
+"""
+Parsed templates are kept in a sqlite file across runs.
+At most PARSE_CACHE_SIZE templates are kept, the least recently used ones are evicted first.
+Bump PARSE_CACHE_FORMAT whenever the content of a parsed template changes,
+entries of another format (or of another sql_metadata version) are discarded.
+"""
+PARSE_CACHE_PATH = "parse_cache.sqlite"
+PARSE_CACHE_SIZE = 100000
+PARSE_CACHE_FORMAT = 7
+
+# what-if constant
+
+"""
+A candidate index is evaluated on (at most) the WHATIF_TEMPLATES most frequent templates filtering on its leading column,
+by comparing the estimated cost of a sample query of every template with and without a hypothetical index.
+The candidate is no longer considered if it reduces the total cost (weighted by occurrence)
+by less than WHATIF_COST_REDUCTION_CUTOFF.
+"""
+WHATIF_TEMPLATES = 10
+WHATIF_COST_REDUCTION_CUTOFF = 0.05
+
+# online constant
+
+"""
+Bump CHECKPOINT_FORMAT whenever the content of the online checkpoint changes,
+a checkpoint of another format is discarded and the log is read again from the start.
+"""
+CHECKPOINT_FORMAT = 6
+
+# optimizer constant
+
+"""
+The size of a candidate index is estimated as
+    number of rows * (sum of the avg_width of its columns, included ones too, + INDEX_TUPLE_OVERHEAD) / INDEX_FILL_FACTOR
+Its value is its read benefit (percent usage, scaled by the what-if cost reduction if known)
+minus WRITE_COST_WEIGHT times its write cost (see INSERT_COST_WEIGHT).
+"""
+INDEX_TUPLE_OVERHEAD = 12
+INDEX_FILL_FACTOR = 0.9
+WRITE_COST_WEIGHT = 1.0
+
+"""
+A candidate index becomes a covering index (CREATE INDEX ... INCLUDE (...)) for the columns the queries using it
+read besides its key columns (projection, ORDER BY / GROUP BY and the other WHERE columns), so that these queries
+can be answered by an index-only scan. The columns of a query are included if
+    * the query is more than INCLUDE_REFERENCE_CUTOFF of the workload, and selects no "*"
+    * the included columns are at most INCLUDE_WIDTH_CUTOFF bytes wide altogether (avg_width from pg_stats)
+    * none of the included columns is updated by more than INCLUDE_UPDATE_CUTOFF of the workload
+"""
+INCLUDE_REFERENCE_CUTOFF = 0.05
+INCLUDE_WIDTH_CUTOFF = 32
+INCLUDE_UPDATE_CUTOFF = 0.01
+
+
+"""
+A candidate index becomes a partial index (CREATE INDEX ... WHERE column = value) for the columns that the queries
+using it always compare with the same few constants, i.e. at most PARTIAL_MAX_VALUES distinct literals
+(parameters never count as constants) over at least PARTIAL_MIN_QUERIES queries.
+"""
+PARTIAL_MAX_VALUES = 3
+PARTIAL_MIN_QUERIES = 100
+
+"""
+The name of a covering (or partial) index ends with _include (or _where_ and its predicate columns) and a hash of
+its INCLUDE and WHERE clauses, so that new included columns or a new predicate get a new index
+(CREATE INDEX IF NOT EXISTS would keep the old one). A covering or partial index named by this tool
+(GENERATED_INDEX_PATTERN, hash included, so that an index named by hand is never mistaken for one)
+that is not recommended anymore is dropped.
+Names are kept shorter than MAX_IDENTIFIER_LENGTH bytes, the longest name postgres does not truncate.
+"""
+GENERATED_INDEX_PATTERN = r"^idx_\w+_(?:where(?:_\w+)?|include)_[0-9a-f]{8}$"
+MAX_IDENTIFIER_LENGTH = 64
+
+"""
+Apply mode runs the actions on the DB with CREATE INDEX CONCURRENTLY / DROP INDEX CONCURRENTLY, so that production
+writes are never blocked. Builds on different tables run in parallel, every build with APPLY_MAINTENANCE_WORK_MEM,
+and the progress of the builds (pg_stat_progress_create_index) is reported every APPLY_PROGRESS_INTERVAL seconds.
+"""
+APPLY_MAINTENANCE_WORK_MEM = "256MB"
+APPLY_PROGRESS_INTERVAL = 5
+
+"""
+Replay mode measures the workload before and after the actions are applied:
+REPLAY_QUERIES logged queries (literals included) are sampled uniformly from the workload with REPLAY_SEED,
+and every client replays all of them, each query in its own transaction that is rolled back,
+with a statement timeout of REPLAY_STATEMENT_TIMEOUT milliseconds.
+A built index is flagged as a regression if the plan of a template whose median latency grew
+by more than REPLAY_REGRESSION_CUTOFF, and by more than REPLAY_REGRESSION_MIN_DELTA milliseconds (noise), uses it.
+"""
+REPLAY_QUERIES = 1000
+REPLAY_SEED = 15799
+REPLAY_STATEMENT_TIMEOUT = 10000
+REPLAY_REGRESSION_CUTOFF = 0.1
+REPLAY_REGRESSION_MIN_DELTA = 0.5
+REPLAY_PATH = "replay.json"
+
+"""
+Every run writes the metrics of its stages (wall time, CPU time, peak memory, rows processed and failed queries)
+to METRICS_PATH, next to actions.sql. With --profile, a cProfile dump of the run (worker processes excluded)
+is written to PROFILE_PATH, e.g. for python -m pstats or snakeviz.
+"""
+METRICS_PATH = "metrics.json"
+PROFILE_PATH = "actions.prof"
+
+"""
+The benchmark generates synthetic epinions-style query logs (csvlog layout, see filter_csv) of BENCHMARK_LINES lines,
+comma separated for several sizes, and measures every stage on each of them.
+Templates are drawn from a Zipf distribution of exponent BENCHMARK_SKEW (0 is uniform), BENCHMARK_UPDATE_RATIO of
+the queries being writes. Logs are written BENCHMARK_BLOCK lines at a time with BENCHMARK_SEED, and kept in
+BENCHMARK_DIRECTORY so that a size is only generated once.
+filter_csv (the whole log in memory) is only measured next to the streaming read_workload up to
+BENCHMARK_FILTER_MAX_LINES lines, larger logs would not fit in memory.
+"""
+BENCHMARK_LINES = "10000"
+BENCHMARK_SKEW = 1.0
+BENCHMARK_UPDATE_RATIO = 0.2
+BENCHMARK_BLOCK = 100000
+BENCHMARK_SEED = 15799
+BENCHMARK_FILTER_MAX_LINES = 1000000
+BENCHMARK_DIRECTORY = "benchmark"
+BENCHMARK_PATH = "benchmark.json"
+BENCHMARK_READ_TEMPLATES = [
+    "SELECT * FROM useracct WHERE u_id = {a}",
+    "SELECT * FROM item WHERE i_id = {a}",
+    "SELECT * FROM review r, item i WHERE i.i_id = r.i_id and r.i_id = {a} ORDER BY rating DESC, r.creation_date DESC LIMIT 10",
+    "SELECT * FROM review r, useracct u WHERE u.u_id = r.u_id AND r.u_id = {a} ORDER BY rating DESC, r.creation_date DESC LIMIT 10",
+    "SELECT avg(rating) FROM review r WHERE r.i_id = {a}",
+    "SELECT avg(rating) FROM review r, trust t WHERE r.u_id = t.target_u_id AND r.i_id = {a} AND t.source_u_id = {b}",
+    "SELECT * FROM trust t, review r WHERE t.target_u_id = r.u_id AND t.source_u_id = {a} AND r.i_id = {b}",
+    "SELECT * FROM review WHERE i_id = {a} AND rating > {b} ORDER BY creation_date DESC LIMIT 10",
+]
+BENCHMARK_WRITE_TEMPLATES = [
+    "UPDATE useracct SET name = 'name{a}' WHERE u_id = {b}",
+    "UPDATE item SET title = 'title{a}' WHERE i_id = {b}",
+    "UPDATE review SET rating = {a}, creation_date = now() WHERE i_id = {b} AND u_id = {a}",
+    "UPDATE trust SET trust = {a}, creation_date = now() WHERE source_u_id = {a} AND target_u_id = {b}",
+    "INSERT INTO review (a_id, u_id, i_id, rating, rank) VALUES ({a}, {b}, {a}, 3, 1)",
+    "DELETE FROM trust WHERE source_u_id = {a} AND target_u_id = {b}",
+]
+
+"""
+Recency: with a half-life, every query weighs 2 ** (-age / half-life), its age being measured (in seconds) from the
+log timestamp (TIMESTAMP_COLUMN, the time zone is ignored) of the last query read, so that candidate selection
+reflects the current workload. Without a half-life every query weighs 1.
+Phases: with a window, the log is cut into windows of that many seconds, and a window starts a new phase if the
+total variation distance between its template mix and the mix of the current phase is above PHASE_CHANGE_CUTOFF.
+Windows of fewer than PHASE_MIN_QUERIES queries never start a phase. Indices recommended for some phases only
+are reported.
+"""
+TIMESTAMP_COLUMN = 0
+PHASE_CHANGE_CUTOFF = 0.5
+PHASE_MIN_QUERIES = 100
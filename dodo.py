@@ -1,6 +1,48 @@
 import constants as K
 import time
 import os
+import collections
+import concurrent.futures
+import cProfile
+import csv
+import functools
+import hashlib
+import importlib.metadata
+import io
+import json
+import math
+import multiprocessing
+import numpy as np
+import pandas as pd
+import queue
+import re
+import resource
+import sqlite3
+
+# still raises ModuleNotFoundError error
+# even when the modules are explicitly installed during setup
+try:
+    import psycopg2
+except Exception:
+    os.system("pip install psycopg2-binary")
+    import psycopg2
+
+try:
+    from sql_metadata import Parser, QueryType
+except Exception:
+    os.system("pip install sql-metadata")
+    from sql_metadata import Parser, QueryType
+
+# cached templates are only valid for the sql_metadata version (and cache format) that parsed them
+parse_cache_version = "{}-{}".format(importlib.metadata.version("sql-metadata"), K.PARSE_CACHE_FORMAT)
+token_pattern = re.compile(K.TOKEN_PATTERN)
+where_pattern = re.compile(r"(?i)\bwhere\b")
+constant_predicate_pattern = re.compile(K.CONSTANT_PREDICATE_PATTERN)
+join_predicate_pattern = re.compile(K.JOIN_PREDICATE_PATTERN)
+conjunct_pattern = re.compile(K.CONJUNCT_PATTERN)
+generated_index_pattern = re.compile(K.GENERATED_INDEX_PATTERN)
+or_not_pattern = re.compile(r"(?i)\b(?:or|not)\b|\(")
+
 
 def task_project1_setup():
 
@@ -24,435 +66,2914 @@ def task_project1_setup():
     }
 
 
-def task_project1():
-    import collections
-    import pandas as pd
-    import re
+def establish_connection(database="project1db", user="project1user", password="project1pass"):
+    """
+    Establish connection to the DB using psycopg2
+    @param database: DB name
+    @param user: username
+    @param password: password
+    @return:
+        conn: connection
+        cur: cursor
+    """
+    conn = psycopg2.connect(f'dbname={database} user={user} password={password} host=localhost')
+    cur = conn.cursor()
+    return conn, cur
+
+
+def close_connection(conn, cur):
+    """
+    Close connection to DB
+    @param conn: connection to DB
+    @param cur: cursor from psycopg2
+    @return: nothing
+    """
+    cur.close()
+    conn.close()
+
+
+def open_connection_pool(size):
+    """
+    Open a small pool of connections to the DB, see establish_connection
+    @param size: number of connections
+    @return: queue of (connection, cursor) tuples
+    """
+    pool = queue.Queue()
+    for _ in range(size):
+        pool.put(establish_connection())
+    return pool
+
+
+def close_connection_pool(pool):
+    """
+    Close every connection of a pool
+    @param pool: queue from open_connection_pool
+    @return: nothing
+    """
+    while not pool.empty():
+        close_connection(*pool.get())
+
+
+def run_on_connection_pool(pool, func, items):
+    """
+    Call func(conn, cur, item) for every item in parallel threads, each thread holding a connection of the pool
+    @param pool: queue from open_connection_pool
+    @param func: function to call
+    @param items: list of arguments
+    @return: list of results, in the order of items
+    """
+    def run(item):
+        conn, cur = pool.get()
+        try:
+            return func(conn, cur, item)
+        finally:
+            pool.put((conn, cur))
+
+    with concurrent.futures.ThreadPoolExecutor(pool.qsize()) as executor:
+        return list(executor.map(run, items))
+
+
+def get_current_indices(cur):
+    """
+    Retrieve the non-unique indices from the DB catalog, along with their usage and size
+    @param cur: cursor from psycopg2
+    @return: a list of (table_dot_column, index name, number of index scans, size in bytes) tuples,
+        where table_dot_column lists the key columns like a candidate index (in index order, joined with "+"),
+        or is None if the index is on expressions or partial
+    @note: a primary key is considered unique in postgres, therefore, primary keys are also ignored
+    """
+    cur.execute(
+        "SELECT t.relname, i.relname, "
+        "       ARRAY(SELECT a.attname FROM unnest(x.indkey::smallint[]) WITH ORDINALITY AS k(attnum, ord) "
+        "             JOIN pg_attribute a ON a.attrelid = x.indrelid AND a.attnum = k.attnum "
+        "             WHERE k.ord <= x.indnkeyatts ORDER BY k.ord), "
+        "       x.indexprs IS NOT NULL OR x.indpred IS NOT NULL, "
+        "       COALESCE(s.idx_scan, 0), pg_relation_size(x.indexrelid) "
+        "FROM pg_index x "
+        "JOIN pg_class t ON t.oid = x.indrelid "
+        "JOIN pg_class i ON i.oid = x.indexrelid "
+        "JOIN pg_namespace n ON n.oid = t.relnamespace "
+        "LEFT JOIN pg_stat_user_indexes s ON s.indexrelid = x.indexrelid "
+        "WHERE n.nspname = 'public' AND NOT x.indisunique AND NOT x.indisprimary")
+    current_indices = []
+    for table, index, columns, has_expressions, num_scans, size in cur:
+        table_dot_column = None
+        if not has_expressions:
+            table_dot_column = "+".join(map(lambda x: ".".join((table, x)), columns))
+        current_indices.append((table_dot_column, index, num_scans, size))
+    return current_indices
+
+
+def find_query_column(workload_csv, col=13, nrows=K.CSV_CHUNKSIZE):
+    """
+    Locate the query log column using the first rows of the csv file only
+    @param workload_csv: workload (csv) path or file object
+    @param col: default query log column (tries every column if it does not contain queries)
+    @param nrows: number of rows inspected
+    @return: index of the query log column
+    """
+    df = pd.read_csv(workload_csv, header=None, dtype=str, nrows=nrows)
+    if col in df and df[col].str.contains(K.STATEMENT, na=False).any():
+        return col
+
+    # default column does not contain queries, check all other columns
+    print("Default col {} does not contain queries, checking other columns".format(col))
+    for c in df:
+        if df[c].str.contains(K.STATEMENT, na=False).any():
+            return c
+
+    # no column contains queries, raise KeyError
+    raise KeyError
+
+
+def classify_queries(all_queries, timestamps=None):
+    """
+    Keep the select/delete/update/insert statements of a query log column, strip the log prefix
+    and tag every statement with its type and whether it has a WHERE predicate, all in one regex pass
+    @param all_queries: pandas dataframe of raw query log entries as strings
+    @param timestamps: pandas series of the log timestamps as strings, aligned with all_queries (optional)
+    @return: pandas dataframe of clean sql queries (K.QUERY), statement type (K.TYPE) and WHERE flag (K.WHERE),
+        along with the log timestamps in seconds (K.TIMESTAMP, NaN if unknown) if given
+    """
+    classified = all_queries.dropna().str.extract(K.QUERY_PATTERN, flags=re.IGNORECASE | re.DOTALL)
+    classified = classified.dropna(subset=[K.QUERY])
+    classified[K.TYPE] = classified[K.TYPE].str.lower().astype(
+        pd.CategoricalDtype([K.SELECT, K.UPDATE, K.DELETE, K.INSERT]))
+    classified[K.WHERE] = classified[K.WHERE].notna()
+    if timestamps is not None:
+        # e.g. "2022-02-01 10:00:00.000 EST", the time zone is dropped
+        timestamps = pd.to_datetime(timestamps[classified.index].str.replace(r"\s+[A-Za-z]+$", "", regex=True),
+                                    errors="coerce", format="ISO8601")
+        classified[K.TIMESTAMP] = (timestamps - pd.Timestamp(0)).dt.total_seconds()
+    return classified
+
+
+def get_column_selectivity(cur):
+    """
+    Estimate the selectivity of an equality predicate on every column from the catalog statistics
+    @param cur: cursor from psycopg2
+    @return: dictionary (k: table_name.column_name, v: estimated fraction of rows matching a single value)
+    """
+    cur.execute("SELECT s.tablename, s.attname, s.n_distinct, s.null_frac, c.reltuples FROM pg_stats s "
+                "JOIN pg_namespace n ON n.nspname = s.schemaname "
+                "JOIN pg_class c ON c.relnamespace = n.oid AND c.relname = s.tablename "
+                "WHERE s.schemaname = 'public'")
+    selectivity = {}
+    for table, column, n_distinct, null_frac, reltuples in cur:
+        # a negative n_distinct is the opposite of the fraction of distinct rows
+        num_distinct = n_distinct if n_distinct >= 0 else -n_distinct * max(reltuples, 0)
+        if num_distinct > 0:
+            selectivity[".".join((table, column))] = (1 - null_frac) / num_distinct
+    return selectivity
+
+
+def ordered_index(candidate_index, column_order=None):
+    """
+    Get the key columns of a candidate index in the order the index is built with, see get_current_indices
+    @param candidate_index: candidate index, see generate_build_index_statements
+    @param column_order: dictionary from order_index_columns (columns are kept in order if not given)
+    @return: table_name.column_name of the key columns, joined with "+"
+    """
+    columns = candidate_index.split("+")
+    if column_order is not None:
+        columns.sort(key=column_order.__getitem__)
+    return "+".join(columns)
+
+
+def order_index_columns(candidate_indices, counter_simple, counter_range, selectivity):
+    """
+    Decide the column order of the candidate indices:
+    columns mostly used in equality predicates come before columns mostly used in range predicates,
+    and more selective columns come first otherwise.
+    @param candidate_indices: a list of candidate indices, see generate_build_index_statements
+    @param counter_simple: counter dictionary of simple column reference
+    @param counter_range: counter dictionary of range column reference
+    @param selectivity: dictionary from get_column_selectivity (columns without statistics come last)
+    @return: dictionary (k: table_name.column_name, v: sort key)
+    """
+    column_order = {}
+    for candidate_index in candidate_indices:
+        for column in candidate_index.split("+"):
+            is_range = counter_range[column] * 2 > counter_simple[column]
+            column_order[column] = (is_range, selectivity.get(column, 1.0), column)
+    return column_order
+
 
-    # still raises ModuleNotFoundError error
-    # even when the modules are explicitly installed during setup
+def get_table_columns(cur):
+    """
+    Retrieve the columns of every table from the DB catalog
+    @param cur: cursor from psycopg2
+    @return: dictionary (k: table_name, v: set of column names)
+    """
+    cur.execute("SELECT table_name, column_name FROM information_schema.columns WHERE table_schema = 'public'")
+    table_columns = collections.defaultdict(set)
+    for table, column in cur:
+        table_columns[table].add(column)
+    return table_columns
+
+
+def get_table_sizes(cur):
+    """
+    Retrieve the number of rows of every table and the average width of every column from the DB catalog
+    @param cur: cursor from psycopg2
+    @return:
+        dictionary (k: table_name, v: estimated number of rows)
+        dictionary (k: table_name.column_name, v: average width in bytes)
+    """
+    cur.execute("SELECT c.relname, c.reltuples, s.attname, s.avg_width FROM pg_class c "
+                "JOIN pg_namespace n ON n.oid = c.relnamespace "
+                "LEFT JOIN pg_stats s ON s.schemaname = n.nspname AND s.tablename = c.relname "
+                "WHERE n.nspname = 'public' AND c.relkind = 'r'")
+    table_rows = {}
+    column_width = {}
+    for table, reltuples, column, avg_width in cur:
+        # reltuples is negative if the table was never analyzed
+        table_rows[table] = max(reltuples, 0)
+        if column is not None:
+            column_width[".".join((table, column))] = avg_width
+    return table_rows, column_width
+
+
+def estimate_write_costs(candidate_indices, counters, num_queries):
+    """
+    Estimate the write cost of every candidate index, assuming all the candidate indices are built.
+    See K.INSERT_COST_WEIGHT for the write model.
+    @param candidate_indices: a list of candidate indices, see generate_build_index_statements
+    @param counters: dictionary of counter dictionaries, see count_templates
+    @param num_queries: number of sql queries in the workload
+    @return: dictionary (k: candidate index, v: write cost)
+    """
+    indexed_columns = collections.defaultdict(set)
+    num_indices = collections.Counter()
+    column_num_indices = collections.Counter()
+    for candidate_index in candidate_indices:
+        for table in set(column.split(".")[0] for column in candidate_index.split("+")):
+            num_indices[table] += 1
+        for column in candidate_index.split("+"):
+            indexed_columns[column.split(".")[0]].add(column)
+            column_num_indices[column] += 1
+
+    # updates setting an indexed column cannot be HOT
+    update_sets = []
+    non_hot_updates = collections.Counter()
+    for update_set, occurance in counters[K.UPDATE_SETS].items():
+        table = update_set.split(".")[0]
+        updated_indexed_columns = indexed_columns[table].intersection(update_set.split("+"))
+        if updated_indexed_columns:
+            update_sets.append((table, updated_indexed_columns, occurance))
+            non_hot_updates[table] += occurance
+
+    write_costs = {}
+    for candidate_index in candidate_indices:
+        # updates that would be HOT without this candidate index, they maintain every other index of the table
+        own_columns = set(c for c in candidate_index.split("+") if column_num_indices[c] == 1)
+        writes = 0
+        for table in set(column.split(".")[0] for column in candidate_index.split("+")):
+            induced_updates = sum(occurance for t, columns, occurance in update_sets
+                                  if t == table and columns.issubset(own_columns))
+            writes += K.INSERT_COST_WEIGHT * counters[K.INSERT][table] + \
+                K.DELETE_COST_WEIGHT * counters[K.DELETE][table] + \
+                K.UPDATE_COST_WEIGHT * (non_hot_updates[table] + induced_updates * (num_indices[table] - 1))
+        write_costs[candidate_index] = writes / num_queries
+    return write_costs
+
+
+def choose_include_columns(candidate_indices, counter_projection, counter_update, num_queries, column_width):
+    """
+    Choose the columns to include in every candidate index, so that the queries using it
+    can be answered by an index-only scan, see K.INCLUDE_REFERENCE_CUTOFF
+    @param candidate_indices: a list of candidate indices, see generate_build_index_statements
+    @param counter_projection: counter dictionary from find_projected_cols
+    @param counter_update: counter dictionary of the columns where updates take place
+    @param num_queries: number of sql queries in the workload
+    @param column_width: dictionary from get_table_sizes (columns of unknown width are never included)
+    @return: dictionary (k: candidate index, v: sorted list of table_name.column_name to include),
+        candidate indices without included columns are left out
+    """
+    include_columns = {}
+    for candidate_index in candidate_indices:
+        key_columns = set(candidate_index.split("+"))
+        tables = set(column.split(".")[0] for column in key_columns)
+        included = set()
+        # the queries whose WHERE columns start with the key columns, most frequent first
+        for entry, occurance in sorted(counter_projection.items(), key=lambda x: (-x[1], x[0])):
+            if occurance / num_queries <= K.INCLUDE_REFERENCE_CUTOFF:
+                break
+            where_columns, projection = entry.split("|")
+            where_columns = set(where_columns.split("+"))
+            if projection == "*" or not key_columns.issubset(where_columns):
+                continue
+            needed = (where_columns | set(projection.split("+")) if projection else where_columns) - key_columns
+            if any(column.split(".")[0] not in tables or column not in column_width or
+                   counter_update[column] / num_queries > K.INCLUDE_UPDATE_CUTOFF for column in needed):
+                continue
+            if sum(column_width[column] for column in included | needed) > K.INCLUDE_WIDTH_CUTOFF:
+                continue
+            included |= needed
+        if len(tables) == 1 and included:
+            include_columns[candidate_index] = sorted(included)
+    return include_columns
+
+
+def choose_partial_predicates(candidate_indices, counter_composite, counter_constants):
+    """
+    Choose the predicate of every candidate index, for the columns (key columns or not) the queries using it
+    always compare with the same few constants, see K.PARTIAL_MAX_VALUES
+    @param candidate_indices: a list of candidate indices, see generate_build_index_statements
+    @param counter_composite: counter dictionary of composite column reference
+    @param counter_constants: counter dictionary from find_constant_cols
+    @return: dictionary (k: candidate index, v: sorted list of (table_name.column_name, sorted list of literals)),
+        candidate indices without predicate are left out
+    """
+    partial_predicates = {}
+    for candidate_index in candidate_indices:
+        key_columns = set(candidate_index.split("+"))
+        # the queries whose WHERE columns contain the key columns
+        num_queries = sum(occurance for composite_index, occurance in counter_composite.items()
+                          if key_columns.issubset(composite_index.split("+")))
+        if num_queries < K.PARTIAL_MIN_QUERIES:
+            continue
+        column_values = collections.defaultdict(collections.Counter)
+        for entry, occurance in counter_constants.items():
+            composite_index, column, value = entry.split("|", 2)
+            if key_columns.issubset(composite_index.split("+")):
+                column_values[column][value] += occurance
+        # weights of decayed queries are not integers
+        predicates = [(column, sorted(values)) for column, values in sorted(column_values.items())
+                      if len(values) <= K.PARTIAL_MAX_VALUES and math.isclose(sum(values.values()), num_queries)]
+        if predicates:
+            partial_predicates[candidate_index] = predicates
+    return partial_predicates
+
+
+def select_indices(candidate_indices, benefits, write_costs, table_rows, column_width, disk_budget,
+                   max_indices_per_table, include_columns=None):
+    """
+    Choose the candidate indices of highest total value (benefit minus write cost)
+    under a disk budget and a maximum number of indices per table.
+    The knapsack is solved greedily by value per byte, and replaced by the single most valuable candidate
+    if that one is worth more on its own.
+    @param candidate_indices: a list of candidate indices, see generate_build_index_statements
+    @param benefits: dictionary (k: candidate index, v: read benefit)
+    @param write_costs: dictionary (k: candidate index, v: write cost)
+    @param table_rows: dictionary from get_table_sizes
+    @param column_width: dictionary from get_table_sizes
+    @param disk_budget: maximum total size in bytes (no limit if not positive)
+    @param max_indices_per_table: maximum number of indices per table (no limit if not positive)
+    @param include_columns: dictionary from choose_include_columns (no included columns if not given)
+    @return:
+        a list of chosen candidate indices
+        dictionary (k: candidate index, v: (estimated size in bytes, benefit, write cost)) of every candidate
+    """
+    estimates = {}
+    for candidate_index in candidate_indices:
+        columns = candidate_index.split("+") + (include_columns or {}).get(candidate_index, [])
+        table = columns[0].split(".")[0]
+        width = sum(column_width.get(column, 0) for column in columns) + K.INDEX_TUPLE_OVERHEAD
+        size = table_rows.get(table, 0) * width / K.INDEX_FILL_FACTOR
+        estimates[candidate_index] = (size, benefits[candidate_index], write_costs[candidate_index])
+
+    def value(candidate_index):
+        _, benefit, write_cost = estimates[candidate_index]
+        return benefit - K.WRITE_COST_WEIGHT * write_cost
+
+    def fits(candidate_index, total_size):
+        return disk_budget <= 0 or total_size + estimates[candidate_index][0] <= disk_budget
+
+    worthwhile = [c for c in candidate_indices if value(c) > 0]
+    worthwhile.sort(key=lambda x: (-value(x) / max(estimates[x][0], 1), -value(x), x))
+
+    chosen = []
+    total_size = 0
+    indices_per_table = collections.Counter()
+    for candidate_index in worthwhile:
+        table = candidate_index.split(".")[0]
+        if not fits(candidate_index, total_size):
+            continue
+        if 0 < max_indices_per_table <= indices_per_table[table]:
+            continue
+        chosen.append(candidate_index)
+        total_size += estimates[candidate_index][0]
+        indices_per_table[table] += 1
+
+    best_single = max((c for c in worthwhile if fits(c, 0)), key=value, default=None)
+    if best_single is not None and value(best_single) > sum(map(value, chosen)):
+        chosen = [best_single]
+    return chosen, estimates
+
+
+def filter_csv(workload_csv, col=13, timestamp_col=None):
+    """
+    Read query logs from the csv file and get clean sql queries as strings
+    @param workload_csv: workload (csv) path
+    @param col: query log column (tries every column if fails to retrieve queries from default column
+    @param timestamp_col: log timestamp column, read only if given (e.g. K.TIMESTAMP_COLUMN)
+    @return: pandas dataframe of classified sql queries, see classify_queries
+    """
+    col = find_query_column(workload_csv, col)
+    usecols = [col] if timestamp_col is None else [col, timestamp_col]
+    df = pd.read_csv(workload_csv, header=None, usecols=usecols, dtype=str)
+    return classify_queries(df[col], None if timestamp_col is None else df[timestamp_col])
+
+
+def stream_csv(workload_csv, col=13, chunksize=K.CSV_CHUNKSIZE, timestamp_col=None):
+    """
+    Read query logs from the csv file in bounded chunks, so that memory usage does not depend on the log size
+    @param workload_csv: workload (csv) path
+    @param col: query log column (tries every column of the first chunk if it does not contain queries)
+    @param chunksize: number of csv rows per chunk
+    @param timestamp_col: log timestamp column, read only if given (e.g. K.TIMESTAMP_COLUMN)
+    @return: generator of pandas dataframes of classified sql queries, one per chunk
+    """
+    col = find_query_column(workload_csv, col, chunksize)
+    usecols = [col] if timestamp_col is None else [col, timestamp_col]
+    for chunk in pd.read_csv(workload_csv, header=None, usecols=usecols, dtype=str, chunksize=chunksize):
+        yield classify_queries(chunk[col], None if timestamp_col is None else chunk[timestamp_col])
+
+
+def tail_csv(workload_csv, checkpoint, col=13, chunksize=K.CSV_CHUNKSIZE, timestamp_col=None):
+    """
+    Read the query log records appended since the checkpoint offset in bounded chunks.
+    A trailing record that is still being written is left for the next run.
+    @param workload_csv: workload (csv) path
+    @param checkpoint: online tuning state from load_checkpoint, its offset is advanced past every chunk read
+    @param col: query log column (tries every column of the first records read if it does not contain queries)
+    @param chunksize: number of csv records per chunk
+    @param timestamp_col: log timestamp column, read only if given (e.g. K.TIMESTAMP_COLUMN)
+    @return: generator of pandas dataframes of classified sql queries, one per chunk
+    """
+    query_col = None
+
+    def read_records(records):
+        nonlocal query_col
+        # the query column is located on complete records only, the log may end with a partial one
+        if query_col is None:
+            try:
+                query_col = find_query_column(io.BytesIO(b"".join(records)), col, chunksize)
+            except KeyError:
+                # no statement in these records yet
+                no_queries = pd.Series([], dtype=str)
+                return classify_queries(no_queries, None if timestamp_col is None else no_queries)
+        usecols = [query_col] if timestamp_col is None else [query_col, timestamp_col]
+        df = pd.read_csv(io.BytesIO(b"".join(records)), header=None, usecols=usecols, dtype=str)
+        return classify_queries(df[query_col], None if timestamp_col is None else df[timestamp_col])
+
+    with open(workload_csv, "rb") as f:
+        f.seek(checkpoint["offset"])
+        records = []
+        record = []
+        num_quotes = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            record.append(line)
+            # a record spans several lines if a quoted field contains a newline
+            num_quotes += line.count(b'"')
+            if num_quotes % 2:
+                continue
+            records.extend(record)
+            checkpoint["offset"] += sum(map(len, record))
+            record = []
+            num_quotes = 0
+            if len(records) >= chunksize:
+                chunk = read_records(records)
+                records = []
+                yield chunk
+        if records:
+            yield read_records(records)
+
+
+def load_checkpoint(path, workload_csv):
+    """
+    Load the online tuning state of a query log.
+    The state starts over if there is none yet, or if another log (or a rotated one) is read.
+    @param path: checkpoint (json) path
+    @param workload_csv: workload (csv) path
+    @return: dictionary of the log offset already read, the counters of the queries read so far
+        (along with their weight and the timestamp of the last of them) and the actions generated last
+    """
+    stat = os.stat(workload_csv)
+    checkpoint = None
+    if os.path.exists(path):
+        with open(path) as f:
+            checkpoint = json.load(f)
+    if checkpoint is None or checkpoint.get("format") != K.CHECKPOINT_FORMAT or \
+            checkpoint["workload_csv"] != os.path.abspath(workload_csv) or \
+            checkpoint["inode"] != stat.st_ino or checkpoint["offset"] > stat.st_size:
+        checkpoint = {
+            "format": K.CHECKPOINT_FORMAT,
+            "workload_csv": os.path.abspath(workload_csv),
+            "inode": stat.st_ino,
+            "offset": 0,
+            "num_queries": 0,
+            "workload_weight": 0,
+            "timestamp": None,
+            "workload_info": {},
+            "counters": {},
+            "actions": None,
+        }
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    """
+    Save the online tuning state, see load_checkpoint
+    @param path: checkpoint (json) path
+    @param checkpoint: online tuning state
+    @return: nothing
+    """
+    # replace atomically so that an interrupted run keeps the previous checkpoint
+    with open(path + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(path + ".tmp", path)
+
+
+def filter_queries(all_queries, keyword):
+    """
+    Filter queries by statement type, or by the presence of a WHERE predicate if keyword is K.WHERE
+    @param all_queries: pandas dataframe of classified sql queries
+    @param keyword: keyword to be filtered against
+    @return:
+        number of target queries
+        pandas dataframe of target queries
+    """
+    if keyword == K.WHERE:
+        target_queries = all_queries[all_queries[K.WHERE]]
+    else:
+        target_queries = all_queries[all_queries[K.TYPE] == keyword]
+    return len(target_queries), target_queries
+
+
+def group_templates(all_templates):
+    """
+    Merge the rows of identical templates, adding up their number of occurrence and weight
+    @param all_templates: pandas dataframe of templates, see fingerprint_queries
+    @return: pandas dataframe of distinct templates
+    """
+    return all_templates.groupby(K.QUERY, sort=False).agg(**{
+        K.TYPE: (K.TYPE, "first"),
+        K.WHERE: (K.WHERE, "first"),
+        K.SAMPLE: (K.SAMPLE, "first"),
+        K.COUNT: (K.COUNT, "sum"),
+        K.WEIGHT: (K.WEIGHT, "sum"),
+    }).reset_index()
+
+
+def fingerprint_queries(all_queries, templates=None, weights=None):
+    """
+    Normalize sql queries into templates by stripping literals and parameter values,
+    so that queries differing only in constants share the same template.
+
+        SELECT * FROM review WHERE u_id = 42 AND name IN ('a', 'b')
+        SELECT * FROM review WHERE u_id = 0 AND name IN (0)
+
+        INSERT INTO trust VALUES (1, 2), (3, 4)
+        INSERT INTO trust VALUES (0, 0)
+
+    The templates are still valid sql and can be parsed directly.
+    @param all_queries: pandas dataframe of classified sql queries
+    @param templates: result of normalize_queries on the queries (normalizes them if not given)
+    @param weights: pandas series of the query weights, see K.TIMESTAMP_COLUMN (every query weighs 1 if not given)
+    @return: pandas dataframe of distinct templates (K.QUERY) along with their statement type (K.TYPE),
+        WHERE flag (K.WHERE), one of their queries (K.SAMPLE), number of occurrence (K.COUNT)
+        and weight (K.WEIGHT)
+    """
+    if templates is None:
+        templates = normalize_queries(all_queries[K.QUERY])
+    return group_templates(all_queries.assign(**{K.QUERY: templates, K.SAMPLE: all_queries[K.QUERY], K.COUNT: 1,
+                                                 K.WEIGHT: 1 if weights is None else weights}))
+
+
+def normalize_queries(queries):
+    """
+    Strip the literals and parameter values of sql queries, see fingerprint_queries
+    @param queries: pandas series of sql queries as strings
+    @return: pandas series of templates
+    """
+    templates = queries.str.replace(r"'(?:[^']|'')*'", "'?'", regex=True)
+    templates = templates.str.replace(r"\$\d+|\b\d+(?:\.\d+)?\b", "0", regex=True)
+    templates = templates.str.replace(r"(?i)\bIN\s*\((?:\s*(?:0|'\?')\s*,?)+\)", "IN (0)", regex=True)
+    templates = templates.str.replace(r"(?i)(\bVALUES\s*\((?:[^()']|'\?')*\))(?:\s*,\s*\((?:[^()']|'\?')*\))+", r"\1",
+                                      regex=True)
+    return templates.str.replace(r"\s+", " ", regex=True).str.strip()
+
+
+def find_constant_predicates(all_queries, templates, weights=None):
+    """
+    Get the literals the WHERE columns are compared with in the top-level AND conjuncts of the predicate,
+    see K.CONSTANT_PREDICATE_PATTERN
+    @param all_queries: pandas dataframe of classified sql queries
+    @param templates: result of normalize_queries on the queries
+    @param weights: pandas series of the query weights (every query weighs 1 if not given)
+    @return: dictionary (k: (template, column name as written), v: counter dictionary of the literals,
+        weighted by the queries comparing the column with them, or None if the column is compared with
+        more than K.PARTIAL_MAX_VALUES literals or with a parameter)
+    """
+    has_where = all_queries[K.WHERE].to_numpy(dtype=bool)
+    query_weights = [1] * int(has_where.sum()) if weights is None else weights[has_where].tolist()
+    predicates = []
+    for template, query, weight in zip(templates[has_where], all_queries[K.QUERY][has_where], query_weights):
+        where = where_pattern.search(query)
+        if where is None:
+            continue
+        # only a top-level AND conjunct implies the index predicate, not one under OR / NOT (or in parentheses)
+        if or_not_pattern.search(query, where.end()) is None:
+            for column, value in constant_predicate_pattern.findall(query, where.end()):
+                predicates.append((template, column, value, weight))
+            continue
+        for conjunct in where_conjuncts(query):
+            m = constant_predicate_pattern.fullmatch(conjunct)
+            if m is not None:
+                predicates.append((template, m.group("column"), m.group("value"), weight))
+    if not predicates:
+        return {}
+    predicates = pd.DataFrame(predicates, columns=[K.QUERY, "column", "value", K.WEIGHT])
+    predicates["value"] = predicates["value"].where(~predicates["value"].str.match(r"(?i)true|false"),
+                                                    predicates["value"].str.upper())
+    predicates["parameter"] = predicates["value"].str.startswith("$")
+
+    constants = {}
+    groups = predicates.groupby([K.QUERY, "column"], sort=False)
+    is_constant = (groups["value"].nunique() <= K.PARTIAL_MAX_VALUES) & ~groups["parameter"].any()
+    for (template, column), constant in is_constant.items():
+        constants[(template, column)] = collections.Counter() if constant else None
+    counts = predicates.groupby([K.QUERY, "column", "value"], sort=False)[K.WEIGHT].sum()
+    for (template, column, value), occurance in counts.items():
+        if constants[(template, column)] is not None:
+            constants[(template, column)][value] += occurance
+    return constants
+
+
+def merge_constant_predicates(constants, chunk_constants):
+    """
+    Add up the literals of find_constant_predicates, in place
+    @param constants: dictionary from find_constant_predicates to add to
+    @param chunk_constants: dictionary from find_constant_predicates
+    """
+    for key, values in chunk_constants.items():
+        if key in constants and constants[key] is None:
+            continue
+        if values is None:
+            constants[key] = None
+            continue
+        constants.setdefault(key, collections.Counter()).update(values)
+        if len(constants[key]) > K.PARTIAL_MAX_VALUES:
+            constants[key] = None
+
+
+def where_conjuncts(query):
+    """
+    Split the WHERE predicate of a sql query into its top-level AND conjuncts, see K.CONJUNCT_PATTERN.
+    The AND of a BETWEEN is split as well, and a conjunct in parentheses is kept whole.
+    @param query: sql query as string
+    @return: list of the conjuncts as strings, empty if the query has no WHERE predicate
+    """
+    where = where_pattern.search(query)
+    if where is None:
+        return []
+    conjuncts = []
+    start = where.end()
+    end = len(query)
+    depth = 0
+    for m in conjunct_pattern.finditer(query, start):
+        if m.group() == "(":
+            depth += 1
+        elif m.group() == ")":
+            depth -= 1
+            if depth < 0:
+                end = m.start()
+                break
+        elif m.group("keyword") and depth == 0:
+            if m.group("keyword").upper() != "AND":
+                end = m.start()
+                break
+            conjuncts.append(query[start:m.start()].strip())
+            start = m.end()
+    conjuncts.append(query[start:end].strip())
+    return [conjunct for conjunct in conjuncts if conjunct]
+
+
+def parser_extract_metadata(query):
+    """
+    Parse a sql query with sql_metadata and keep what the counting stages need
+    @param query: sql query as string
+    @return: dictionary of referenced tables (K.TABLES), WHERE columns (K.WHERE), UPDATE columns (K.UPDATE),
+        join columns (K.JOIN) and, for a SELECT query, the columns read besides the WHERE columns (K.PROJECTION),
+        None if the query could not be parsed
+    """
+    parsed_q = Parser(query)
+    # sql_meta data sometimes fail to process strings containing quotation marks
     try:
-        import psycopg2
+        columns_dict = parsed_q.columns_dict or {}
+        projection_columns = None
+        if parsed_q.query_type == QueryType.SELECT:
+            projection_columns = []
+            for clause in ("select", "group_by", "order_by"):
+                for column in columns_dict.get(clause, []):
+                    if column not in projection_columns:
+                        projection_columns.append(column)
+        tables = list(parsed_q.tables)
+        where_columns = list(columns_dict[K.WHERE]) if K.WHERE in columns_dict else None
+        join_columns = list(columns_dict[K.JOIN]) if K.JOIN in columns_dict else []
+        # column = column across two tables in the WHERE clause is a join predicate rather than a filter,
+        # unless the column is filtered on in the rest of the predicate as well
+        aliases = parsed_q.tables_aliases
+        filters = " AND ".join(conjunct for conjunct in where_conjuncts(query)
+                               if not join_predicate_pattern.fullmatch(conjunct))
+        for qualifier1, column1, qualifier2, column2 in join_predicate_pattern.findall(query):
+            table1 = aliases.get(qualifier1, qualifier1)
+            table2 = aliases.get(qualifier2, qualifier2)
+            if table1 == table2 or table1 not in tables or table2 not in tables:
+                continue
+            for table, name in ((table1, column1), (table2, column2)):
+                column = ".".join((table, name))
+                if column not in join_columns:
+                    join_columns.append(column)
+                if where_columns is None or column not in where_columns:
+                    continue
+                # the column either qualified with its table (or an alias of it) or unqualified
+                qualifiers = [table] + [alias for alias, aliased in aliases.items() if aliased == table]
+                filter_pattern = r'(?<![\w."])(?:(?:{})\.)?"?{}"?(?![\w"])'.format(
+                    "|".join(map(re.escape, qualifiers)), re.escape(name))
+                if not re.search(filter_pattern, filters):
+                    where_columns.remove(column)
+        # plain lists, so that the result can be sent across processes and stored as json,
+        # a WHERE of join predicates only has no column (rather than no WHERE entry)
+        return {
+            K.TABLES: tables,
+            K.WHERE: where_columns,
+            K.UPDATE: list(columns_dict[K.UPDATE]) if K.UPDATE in columns_dict else None,
+            K.PROJECTION: projection_columns,
+            K.JOIN: join_columns or None,
+        }
     except Exception:
-        os.system("pip install psycopg2-binary")
-        import psycopg2
+        return None
+
+
+def tokenize_query(query):
+    """
+    Split a sql query into tokens, see K.TOKEN_PATTERN
+    @param query: sql query as string
+    @return: a list of (kind, value) tuples (quoted names are unquoted and of kind "quoted"),
+        None if the query contains an unknown token
+    """
+    query = query.strip().rstrip(";")
+    tokens = []
+    pos = 0
+    while pos < len(query):
+        m = token_pattern.match(query, pos)
+        if m is None:
+            if query[pos:].strip():
+                return None
+            break
+        pos = m.end()
+        kind = m.lastgroup
+        value = m.group(kind)
+        if kind == "name" and value.startswith('"'):
+            kind, value = "quoted", value[1:-1]
+        tokens.append((kind, value))
+    return tokens
+
+
+def fast_extract_metadata(query):
+    """
+    Extract the same information as parser_extract_metadata without building a sql_metadata.Parser.
+    Only the common single-table shapes are handled:
+
+        SELECT ... FROM table [[AS] alias] [WHERE ...] [ORDER BY / GROUP BY / LIMIT ...]
+        UPDATE table [[AS] alias] SET column = ..., column = ... [WHERE ...]
+        DELETE FROM table [[AS] alias] [WHERE ...]
+        INSERT INTO table [(column, ...)] VALUES (...)
+
+    @param query: sql query as string
+    @return: same as parser_extract_metadata, None if the query has another shape
+    """
+    tokens = tokenize_query(query)
+    if not tokens:
+        return None
+
+    def keyword(i):
+        return tokens[i][1].upper() if i < len(tokens) and tokens[i][0] == "name" else None
+
+    def identifier(i):
+        # (possibly dotted) name starting at i, along with the position right after it
+        parts = []
+        while i < len(tokens) and tokens[i][0] in ("name", "quoted") and keyword(i) not in K.RESERVED_KEYWORDS:
+            parts.append(tokens[i][1])
+            i += 1
+            if i < len(tokens) and tokens[i] == ("symbol", "."):
+                i += 1
+                continue
+            break
+        return ".".join(parts) if parts else None, i
+
+    def column_names(i, end, skip_keywords):
+        # columns read between i and end, function names and aliases (AS or implicit) are skipped,
+        # a "*" that is neither a multiplication nor in count(*) stands for the whole row
+        columns = []
+        after_operand = False
+        depth = 0
+        while i < end:
+            kind, value = tokens[i]
+            if (kind, value) == ("symbol", "*") and depth == 0 and not after_operand:
+                columns.append("*")
+                after_operand = True
+                i += 1
+            elif keyword(i) in skip_keywords:
+                after_operand = False
+                i += 1
+            elif keyword(i) == "AS":
+                i += 2
+            elif kind in ("name", "quoted"):
+                if tokens[i + 1:i + 3] == [("symbol", "."), ("symbol", "*")]:
+                    columns.append(value + ".*")
+                    i += 3
+                    continue
+                column, i = identifier(i)
+                if column is None:
+                    return None
+                if not after_operand and not (i < end and tokens[i] == ("symbol", "(")):
+                    columns.append(column)
+                after_operand = not (i < end and tokens[i] == ("symbol", "("))
+            else:
+                depth += {"(": 1, ")": -1}.get(value, 0) if kind == "symbol" else 0
+                after_operand = kind == "literal" or value == ")"
+                i += 1
+        return columns
+
+    statement = keyword(0)
+    i = 1
+    projection = None
+    if statement == "SELECT":
+        # a subquery anywhere is left to sql_metadata
+        depth = 0
+        while i < len(tokens) and not (depth == 0 and keyword(i) == "FROM"):
+            if keyword(i) in K.RESERVED_KEYWORDS - {"DISTINCT", "AS"}:
+                return None
+            depth += {"(": 1, ")": -1}.get(tokens[i][1], 0) if tokens[i][0] == "symbol" else 0
+            i += 1
+        projection = column_names(1, i, {"DISTINCT"})
+        if projection is None:
+            return None
+        i += 1
+    elif statement == "DELETE":
+        if keyword(1) != "FROM":
+            return None
+        i = 2
+    elif statement == "INSERT":
+        if keyword(1) != "INTO":
+            return None
+        table, i = identifier(2)
+        # only plain column lists and values, INSERT ... SELECT and ON CONFLICT are left to sql_metadata
+        if table is None or any(keyword(j) in K.RESERVED_KEYWORDS - {"VALUES", "DEFAULT"}
+                                for j in range(i, len(tokens))):
+            return None
+        return {
+            K.TABLES: [table],
+            K.WHERE: None,
+            K.UPDATE: None,
+            K.PROJECTION: None,
+            K.JOIN: None,
+        }
+    elif statement != "UPDATE":
+        return None
+
+    table, i = identifier(i)
+    if table is None:
+        return None
+    alias = None
+    if keyword(i) == "AS":
+        i += 1
+        alias, i = identifier(i)
+        if alias is None or "." in alias:
+            return None
+    elif i < len(tokens) and tokens[i][0] in ("name", "quoted") and keyword(i) not in K.RESERVED_KEYWORDS:
+        alias, i = identifier(i)
+        if "." in alias:
+            return None
+
+    update_columns = None
+    if statement == "UPDATE":
+        if keyword(i) != "SET":
+            return None
+        i += 1
+        update_columns = []
+        while True:
+            column, i = identifier(i)
+            if column is None or "." in column or i >= len(tokens) or tokens[i] != ("symbol", "="):
+                return None
+            if column not in update_columns:
+                update_columns.append(column)
+            i += 1
+            # only literals, columns and arithmetic are assigned on the fast path
+            while i < len(tokens) and tokens[i] != ("symbol", ",") and keyword(i) != "WHERE":
+                if tokens[i][1] in ("(", ")") or keyword(i) in K.RESERVED_KEYWORDS:
+                    return None
+                i += 1
+            if i < len(tokens) and tokens[i] == ("symbol", ","):
+                i += 1
+                continue
+            break
+
+    where_columns = None
+    if keyword(i) == "WHERE":
+        i += 1
+        where_columns = []
+        while i < len(tokens) and keyword(i) not in K.CLAUSE_KEYWORDS:
+            kind, value = tokens[i]
+            if kind == "name" and value.upper() in K.PREDICATE_KEYWORDS:
+                i += 1
+                continue
+            if kind in ("literal", "symbol"):
+                if value == ".":
+                    return None
+                i += 1
+                continue
+            column, i = identifier(i)
+            # functions, casts, typed literals and unknown keywords are left to sql_metadata
+            if column is None or (i < len(tokens) and (tokens[i] == ("symbol", "(") or
+                                                       tokens[i][0] in ("literal", "quoted") or
+                                                       keyword(i) not in K.PREDICATE_KEYWORDS | K.CLAUSE_KEYWORDS | {None})):
+                return None
+            if "." in column:
+                qualifier, column = column.rsplit(".", 1)
+                if qualifier != alias and qualifier != table:
+                    return None
+                column = ".".join((table, column))
+            if column not in where_columns:
+                where_columns.append(column)
+        # sql_metadata leaves the WHERE entry out if the predicate has no column
+        where_columns = where_columns or None
+    elif i < len(tokens) and not (statement == "SELECT" and keyword(i) in K.CLAUSE_KEYWORDS):
+        return None
+
+    if statement == "SELECT":
+        # the GROUP BY / ORDER BY columns are read as well, LIMIT, OFFSET and FOR have none
+        end = next((j for j in range(i, len(tokens)) if keyword(j) in {"LIMIT", "OFFSET", "FOR"}), len(tokens))
+        clause_columns = column_names(i, end, K.ORDER_KEYWORDS | {"ORDER", "GROUP"})
+        if clause_columns is None:
+            return None
+        projection_columns = []
+        for column in projection + clause_columns:
+            if "." in column:
+                qualifier, column = column.rsplit(".", 1)
+                if qualifier != alias and qualifier != table:
+                    return None
+                column = ".".join((table, column))
+            if column not in projection_columns:
+                projection_columns.append(column)
+        projection = projection_columns
+
+    return {
+        K.TABLES: [table],
+        K.WHERE: where_columns,
+        K.UPDATE: update_columns,
+        K.PROJECTION: projection,
+        K.JOIN: None,
+    }
+
+
+def find_range_predicates(query, columns):
+    """
+    Find the columns compared with a range (rather than equality) predicate, see K.RANGE_PREDICATE_PATTERN
+    @param query: sql query as string
+    @param columns: WHERE columns of the query, as extracted
+    @return: a list of the columns used in at least one range predicate
+    """
+    range_columns = []
+    for column in columns:
+        name = re.escape(column.rsplit(".", 1)[-1])
+        if re.search(K.RANGE_PREDICATE_PATTERN.format(name), query):
+            range_columns.append(column)
+    return range_columns
+
+
+def extract_metadata(query):
+    """
+    Extract what the counting stages need from a sql query,
+    using the fast extractor and falling back to sql_metadata for the shapes it does not handle
+    @param query: sql query as string
+    @return:
+        same as parser_extract_metadata, along with the WHERE columns used in range predicates (K.RANGE)
+        extraction path (K.FAST_PATH, K.PARSER_PATH or K.FAILED)
+    """
+    metadata = fast_extract_metadata(query)
+    path = K.FAST_PATH
+    if metadata is None:
+        metadata = parser_extract_metadata(query)
+        path = K.PARSER_PATH if metadata is not None else K.FAILED
+    if metadata is not None:
+        metadata[K.RANGE] = find_range_predicates(query, metadata[K.WHERE] or [])
+    return metadata, path
+
 
+def extract_all_metadata(queries):
+    """
+    Extract what the counting stages need from a list of sql queries
+    @param queries: list of sql queries as strings
+    @return:
+        dictionary (k: query, v: metadata from extract_metadata)
+        counter dictionary (k: extraction path, v: number of queries)
+    """
+    metadata = {}
+    extraction_paths = collections.Counter()
+    for q in queries:
+        metadata[q], path = extract_metadata(q)
+        extraction_paths[path] += 1
+    return metadata, extraction_paths
+
+
+def benchmark_extractor(queries):
+    """
+    Compare the fast extractor against sql_metadata on the same queries
+    @param queries: list of sql queries as strings
+    @return:
+        throughput of the fast extractor (queries per second)
+        throughput of sql_metadata (queries per second)
+        percentage of the queries handled by the fast extractor that sql_metadata extracts identically
+    """
+    start_time = time.perf_counter()
+    fast = [fast_extract_metadata(q) for q in queries]
+    fast_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    slow = [parser_extract_metadata(q) for q in queries]
+    slow_time = time.perf_counter() - start_time
+
+    handled = [(f, s) for f, s in zip(fast, slow) if f is not None]
+    agreement = sum(f == s for f, s in handled) / len(handled) * 100 if handled else 100.0
+    return len(queries) / max(fast_time, 1e-9), len(queries) / max(slow_time, 1e-9), agreement
+
+
+def qualify_columns(parsed_q, columns, table_columns=None):
+    """
+    Qualify the columns of a parsed query with the name of the table owning them.
+    A column is left out if its table cannot be told, i.e. if it is not qualified and the query references
+    several tables, unless exactly one of them has a column of that name in the DB catalog.
+    @param parsed_q: result of extract_metadata
+    @param columns: list of column names as extracted
+    @param table_columns: dictionary from get_table_columns (unqualified columns of joins are left out if not given)
+    @return: list of table_name.column_name
+    """
+    tables = parsed_q[K.TABLES]
+    qualified_columns = []
+    for column in columns:
+        if "." in column:
+            qualified_columns.append(column)
+            continue
+        owners = tables if len(tables) == 1 else [t for t in tables if column in (table_columns or {}).get(t, ())]
+        if len(owners) == 1:
+            qualified_columns.append(".".join((owners[0], column)))
+    return qualified_columns
+
+
+def group_by_table(columns):
+    """
+    Group qualified columns by table
+    @param columns: list of table_name.column_name
+    @return: dictionary (k: table name, v: sorted list of table_name.column_name)
+    """
+    table_to_columns = collections.defaultdict(list)
+    for column in sorted(set(columns)):
+        table_to_columns[column.rsplit(".", 1)[0]].append(column)
+    return table_to_columns
+
+
+def predicate_columns(parsed_q, table_columns=None):
+    """
+    Get the columns referenced in the WHERE predicate of a parsed query, qualified with the table name
+    @param parsed_q: result of extract_metadata
+    @param table_columns: dictionary from get_table_columns, see qualify_columns
+    @return: sorted list of table_name.column_name
+    @raise: Exception if the query could not be parsed or has no WHERE predicate
+    """
+    columns = qualify_columns(parsed_q, parsed_q[K.WHERE], table_columns)
+    columns.sort()
+    return columns
+
+
+def find_frequent_cols(queries, weights=None, metadata=None, table_columns=None):
+    """
+    Get the columns that are referenced in the WHERE predicate
+    @param queries: pandas series of sql queries as strings
+    @param weights: counter dictionary of query occurrence (every query counts once if not given)
+    @param metadata: dictionary of already parsed queries, see extract_all_metadata (parses queries if not given)
+    @param table_columns: dictionary from get_table_columns, see qualify_columns
+    @return:
+        counter dictionary of simple column reference
+        counter dictionary of composite column reference, one entry per table of the query
+        number of failed queries
+    """
+    # keeps columns reference of the same table together as a separate entry
+    counter_composite_columns = collections.Counter()
+    # entries are always single column
+    counter_simple_columns = collections.Counter()
+    # record number of queries that could not be processed
+    num_failed_queries = 0
+    for q in queries:
+        weight = 1 if weights is None else weights[q]
+        parsed_q = metadata[q] if metadata is not None else extract_metadata(q)[0]
+        try:
+            columns = predicate_columns(parsed_q, table_columns)
+            for table_columns_referenced in group_by_table(columns).values():
+                counter_composite_columns["+".join(table_columns_referenced)] += weight
+            for col in columns:
+                counter_simple_columns[col] += weight
+        except Exception:
+            num_failed_queries += weight
+    return counter_simple_columns, counter_composite_columns, num_failed_queries
+
+
+def find_join_cols(queries, weights=None, metadata=None, table_columns=None):
+    """
+    Get the columns that are referenced in join predicates (ON, USING or WHERE column = column)
+    @param queries: pandas series of sql queries as strings
+    @param weights: counter dictionary of query occurrence (every query counts once if not given)
+    @param metadata: dictionary of already parsed queries, see extract_all_metadata (parses queries if not given)
+    @param table_columns: dictionary from get_table_columns, an unqualified join column (USING) belongs to
+        every table of the query having it (to every table of the query if not given)
+    @return: counter dictionary of join column reference
+    """
+    counter = collections.Counter()
+    for q in queries:
+        weight = 1 if weights is None else weights[q]
+        parsed_q = metadata[q] if metadata is not None else extract_metadata(q)[0]
+        try:
+            columns = set()
+            for column in parsed_q[K.JOIN] or []:
+                if "." in column:
+                    columns.add(column)
+                    continue
+                for table in parsed_q[K.TABLES]:
+                    if table_columns is None or column in table_columns.get(table, ()):
+                        columns.add(".".join((table, column)))
+            for column in columns:
+                counter[column] += weight
+        except Exception:
+            continue
+    return counter
+
+
+def find_range_cols(queries, weights=None, metadata=None, table_columns=None):
+    """
+    Get the columns that are referenced in a range predicate of the WHERE clause
+    @param queries: pandas series of sql queries as strings
+    @param weights: counter dictionary of query occurrence (every query counts once if not given)
+    @param metadata: dictionary of already parsed queries, see extract_all_metadata (parses queries if not given)
+    @param table_columns: dictionary from get_table_columns, see qualify_columns
+    @return: counter dictionary of range column reference
+    """
+    counter = collections.Counter()
+    for q in queries:
+        weight = 1 if weights is None else weights[q]
+        parsed_q = metadata[q] if metadata is not None else extract_metadata(q)[0]
+        try:
+            for column in qualify_columns(parsed_q, parsed_q[K.RANGE], table_columns):
+                counter[column] += weight
+        except Exception:
+            continue
+    return counter
+
+
+def find_projected_cols(queries, weights=None, metadata=None, table_columns=None):
+    """
+    Get the columns read by the queries besides their WHERE columns, for every set of WHERE columns of a table
+    @param queries: pandas series of select queries as strings
+    @param weights: counter dictionary of query occurrence (every query counts once if not given)
+    @param metadata: dictionary of already parsed queries, see extract_all_metadata (parses queries if not given)
+    @param table_columns: dictionary from get_table_columns, see qualify_columns
+    @return: counter dictionary (k: composite column reference and projected columns of the same table joined
+        with "|", projected columns being joined with "+" like a composite index, or "*" if the whole row is read)
+    """
+    counter = collections.Counter()
+    for q in queries:
+        weight = 1 if weights is None else weights[q]
+        parsed_q = metadata[q] if metadata is not None else extract_metadata(q)[0]
+        try:
+            columns = predicate_columns(parsed_q, table_columns)
+            read_columns = parsed_q[K.PROJECTION] + (parsed_q[K.JOIN] or [])
+            projection = qualify_columns(parsed_q, read_columns, table_columns)
+            # a column of unknown table could be read from any table
+            whole_row = len(projection) < len(read_columns) or "*" in projection
+            for table, table_columns_referenced in group_by_table(columns).items():
+                table_projection = set(c for c in projection if c.rsplit(".", 1)[0] == table)
+                if whole_row or ".".join((table, "*")) in table_projection:
+                    table_projection = "*"
+                else:
+                    table_projection = "+".join(sorted(table_projection))
+                counter["|".join(("+".join(table_columns_referenced), table_projection))] += weight
+        except Exception:
+            continue
+    return counter
+
+
+def find_constant_cols(constants, metadata, table_columns=None):
+    """
+    Get the literals the WHERE columns are compared with, for every set of WHERE columns of a table
+    @param constants: dictionary from find_constant_predicates
+    @param metadata: dictionary of parsed templates, see parse_templates
+    @param table_columns: dictionary from get_table_columns, see qualify_columns
+    @return: counter dictionary (k: composite column reference, table_name.column_name and literal joined with "|",
+        v: number of queries comparing the column with the literal)
+    """
+    counter = collections.Counter()
+    for (template, column), values in constants.items():
+        try:
+            columns = predicate_columns(metadata[template], table_columns)
+            name = column.rsplit(".", 1)[-1]
+            matches = [c for c in columns if c.rsplit(".", 1)[-1].lower() == name.lower()]
+            if values is None or len(matches) != 1:
+                continue
+            table_columns_referenced = group_by_table(columns)[matches[0].rsplit(".", 1)[0]]
+            for value, occurance in values.items():
+                counter["|".join(("+".join(table_columns_referenced), matches[0], value))] += occurance
+        except Exception:
+            continue
+    return counter
+
+
+def find_update_target(queries, weights=None, metadata=None):
+    """
+    Get the columns where the updates take place
+    @param queries: pandas series of sql queries as strings
+    @param weights: counter dictionary of query occurrence (every query counts once if not given)
+    @param metadata: dictionary of already parsed queries, see extract_all_metadata (parses queries if not given)
+    @return:
+        counter dictionary of the columns where updates take place
+        counter dictionary of the sets of columns updated together (joined with "+" like a composite index)
+        number of failed queries
+    """
+    counter = collections.Counter()
+    counter_sets = collections.Counter()
+    num_failed_queries = 0
+    for q in queries:
+        weight = 1 if weights is None else weights[q]
+        parsed_q = metadata[q] if metadata is not None else extract_metadata(q)[0]
+        try:
+            table = parsed_q[K.TABLES][0]
+            columns = sorted(set(map(lambda x: table + "." + x, parsed_q[K.UPDATE])))
+            if not columns:
+                raise ValueError
+            for column in columns:
+                counter[column] += weight
+            counter_sets["+".join(columns)] += weight
+        except Exception:
+            num_failed_queries += weight
+    return counter, counter_sets, num_failed_queries
+
+
+def find_write_tables(queries, weights=None, metadata=None):
+    """
+    Get the tables written by insert or delete queries
+    @param queries: pandas series of sql queries as strings
+    @param weights: counter dictionary of query occurrence (every query counts once if not given)
+    @param metadata: dictionary of already parsed queries, see extract_all_metadata (parses queries if not given)
+    @return:
+        counter dictionary of the tables written
+        number of failed queries
+    """
+    counter = collections.Counter()
+    num_failed_queries = 0
+    for q in queries:
+        weight = 1 if weights is None else weights[q]
+        parsed_q = metadata[q] if metadata is not None else extract_metadata(q)[0]
+        try:
+            counter[parsed_q[K.TABLES][0]] += weight
+        except Exception:
+            num_failed_queries += weight
+    return counter, num_failed_queries
+
+
+def count_workload_info(all_queries):
+    """
+    Count the queries of each kind in a workload
+    @param all_queries: pandas dataframe of classified sql queries
+    @return: counter dictionary (k: statement type or K.WHERE, v: number of queries)
+    """
+    counter = collections.Counter(all_queries[K.TYPE].value_counts().to_dict())
+    counter[K.WHERE] = int(all_queries[K.WHERE].sum())
+    return counter
+
+
+def create_worker_pool(workers):
+    """
+    Create a process pool for parsing
+    @param workers: number of worker processes
+    @return: process pool, or None if parsing should run in the current process
+    """
+    if workers <= 1:
+        return None
+    # forked workers inherit the compiled patterns instead of importing this module again
+    return concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork"))
+
+
+def parallel_extract_metadata(pool, workers, queries):
+    """
+    Parse shards of the queries in worker processes and merge the partial results.
+    Shards are merged in order, so the result does not depend on which worker finishes first.
+    @param pool: process pool from create_worker_pool (parses in the current process if None)
+    @param workers: number of worker processes of the pool
+    @param queries: list of sql queries as strings
+    @return: same as extract_all_metadata
+    """
+    queries = list(queries)
+    if pool is None or len(queries) <= 1:
+        return extract_all_metadata(queries)
+
+    num_shards = min(workers, len(queries))
+    futures = []
+    for i in range(num_shards):
+        # round robin keeps the number of templates (i.e. parsing work) balanced across shards
+        shard = queries[i::num_shards]
+        futures.append(pool.submit(extract_all_metadata, shard))
+
+    metadata = {}
+    extraction_paths = collections.Counter()
+    for future in futures:
+        partial_metadata, partial_paths = future.result()
+        metadata.update(partial_metadata)
+        extraction_paths.update(partial_paths)
+    return metadata, extraction_paths
+
+
+def open_parse_cache(path):
+    """
+    Open the persistent parse cache and discard entries of another sql_metadata version or cache format
+    @param path: sqlite file path (the cache is disabled if empty)
+    @return: sqlite connection, or None if the cache is disabled
+    """
+    if not path:
+        return None
+    cache = sqlite3.connect(path)
+    cache.execute("CREATE TABLE IF NOT EXISTS parse_cache "
+                  "(key TEXT PRIMARY KEY, version TEXT, metadata TEXT, last_used REAL)")
+    cache.execute("DELETE FROM parse_cache WHERE version != ?", (parse_cache_version,))
+    cache.commit()
+    return cache
+
+
+def template_key(template):
+    """
+    Key of a template in the parse cache
+    @param template: template as string
+    @return: hash of the template
+    """
+    return hashlib.sha1(template.encode()).hexdigest()
+
+
+def load_parse_cache(cache, templates):
+    """
+    Look up parsed templates in the cache and mark them as recently used
+    @param cache: sqlite connection from open_parse_cache (nothing is found if None)
+    @param templates: list of templates as strings
+    @return: dictionary of cached templates, see extract_all_metadata
+    """
+    metadata = {}
+    if cache is None:
+        return metadata
+    key_to_template = {template_key(t): t for t in templates}
+    keys = list(key_to_template)
+    # stay below the sqlite limit of host parameters
+    for i in range(0, len(keys), 500):
+        batch = keys[i:i + 500]
+        rows = cache.execute("SELECT key, metadata FROM parse_cache WHERE key IN ({})".format(
+            ", ".join("?" * len(batch))), batch).fetchall()
+        for key, value in rows:
+            metadata[key_to_template[key]] = json.loads(value)
+    now = time.time()
+    cache.executemany("UPDATE parse_cache SET last_used = ? WHERE key = ?",
+                      [(now, template_key(t)) for t in metadata])
+    cache.commit()
+    return metadata
+
+
+def store_parse_cache(cache, metadata, size=K.PARSE_CACHE_SIZE):
+    """
+    Add parsed templates to the cache and evict the least recently used ones beyond size
+    @param cache: sqlite connection from open_parse_cache (nothing is stored if None)
+    @param metadata: dictionary of parsed templates, see extract_all_metadata
+    @param size: maximum number of cached templates
+    @return: nothing
+    """
+    if cache is None:
+        return
+    now = time.time()
+    cache.executemany("INSERT OR REPLACE INTO parse_cache VALUES (?, ?, ?, ?)",
+                      [(template_key(t), parse_cache_version, json.dumps(m), now) for t, m in metadata.items()])
+    cache.execute("DELETE FROM parse_cache WHERE key NOT IN "
+                  "(SELECT key FROM parse_cache ORDER BY last_used DESC LIMIT ?)", (size,))
+    cache.commit()
+
+
+def dump_workload_info(num_queries, num_templates, num_parsed_templates, workload_info):
+    """
+    Helper method to print formated workload information
+    @param num_queries: number of sql queries in a workload
+    @param num_templates: number of distinct query templates in a workload
+    @param num_parsed_templates: number of templates parsed in this run (i.e. not found in the parse cache)
+    @param workload_info: counter dictionary from count_workload_info
+    @return: nothing
+    """
+    num_queries_with_predicates = workload_info[K.WHERE]
+    num_delete = workload_info[K.DELETE]
+    num_update = workload_info[K.UPDATE]
+    num_insert = workload_info[K.INSERT]
+    num_select = workload_info[K.SELECT]
+
+    print("=" * 120)
+    print("\n")
+    print("{: >50}".format("Dump workload information..."))
+    print("\n")
+    print("-" * 120)
+    print("\t{:<80}{:<10}".format("Description", "metric"))
+    print("-" * 120)
+    print("\t{:<80}{:<10}".format("num queries", str(num_queries)))
+    print("\t{:<80}{:<10}".format("num templates", str(num_templates)))
+    print("\t{:<80}{:<10}".format("num parsed templates", str(num_parsed_templates)))
+    print("\t{:<80}{:<10.3f}%".format("queries with predicate", num_queries_with_predicates / num_queries * 100))
+    print("\t{:<80}{:<10.3f}%".format("delete", num_delete / num_queries * 100))
+    print("\t{:<80}{:<10.3f}%".format("update", num_update / num_queries * 100))
+    print("\t{:<80}{:<10.3f}%".format("insert", num_insert / num_queries * 100))
+    print("\t{:<80}{:<10.3f}%".format("select", num_select / num_queries * 100))
+    print("-" * 120)
+
+
+def dump_extractor_info(extraction_paths, benchmark):
+    """
+    Helper method to print formated extractor information
+    @param extraction_paths: counter dictionary (k: extraction path, v: number of templates)
+    @param benchmark: result of benchmark_extractor
+    @return: nothing
+    """
+    num_templates = max(sum(extraction_paths.values()), 1)
+    fast_throughput, parser_throughput, agreement = benchmark
+
+    print("=" * 120)
+    print("\n")
+    print("{: >50}".format("Dump extractor information..."))
+    print("\n")
+    print("-" * 120)
+    print("\t{:<80}{:<10}".format("Description", "metric"))
+    print("-" * 120)
+    for path in (K.FAST_PATH, K.PARSER_PATH, K.FAILED):
+        print("\t{:<80}{:<10.3f}%".format(path + " path", extraction_paths[path] / num_templates * 100))
+    print("\t{:<80}{:<10.1f}".format("fast extractor throughput (queries/s)", fast_throughput))
+    print("\t{:<80}{:<10.1f}".format("sql_metadata throughput (queries/s)", parser_throughput))
+    print("\t{:<80}{:<10.3f}%".format("fast extractor agreement with sql_metadata", agreement))
+    print("-" * 120)
+
+
+def dump_selection_info(chosen_indices, index_estimates):
+    """
+    Helper method to print formated index selection information
+    @param chosen_indices: a list of chosen candidate indices, see select_indices
+    @param index_estimates: dictionary of candidate estimates, see select_indices
+    @return: nothing
+    """
+    print("=" * 120)
+    print("\n")
+    print("{: >50}".format("Dump index selection..."))
+    print("\n")
+    print("-" * 120)
+    print("\t{:<60}{:<10}{:<16}{:<12}{:<12}".format("Index", "Chosen", "Size (MB)", "Benefit", "Write cost"))
+    print("-" * 120)
+    for candidate_index, (size, benefit, write_cost) in index_estimates.items():
+        print("\t{:<60}{:<10}{:<16.3f}{:<12.3f}{:<12.3f}".format(
+            candidate_index, "yes" if candidate_index in chosen_indices else "no", size / 1024 / 1024, benefit,
+            write_cost))
+    print("-" * 120)
+    print("\t{:<60}{:<10}{:<16.3f}{:<12.3f}{:<12.3f}".format(
+        "total", len(chosen_indices), sum(index_estimates[c][0] for c in chosen_indices) / 1024 / 1024,
+        sum(index_estimates[c][1] for c in chosen_indices), sum(index_estimates[c][2] for c in chosen_indices)))
+    print("-" * 120)
+
+
+def dump_phase_info(phase_info):
+    """
+    Helper method to print formated workload phase information
+    @param phase_info: list of phase dictionaries, see tune_indices
+    @return: nothing
+    """
+    print("=" * 120)
+    print("\n")
+    print("{: >50}".format("Dump workload phases..."))
+    print("\n")
+    print("-" * 120)
+    print("\t{:<8}{:<22}{:<22}{:<12}{:<50}".format("Phase", "Start", "End", "Queries", "Phase-only indices"))
+    print("-" * 120)
+    for i, phase in enumerate(phase_info):
+        print("\t{:<8}{:<22}{:<22}{:<12}{:<50}".format(i, phase["start"], phase["end"], phase["queries"],
+                                                      ", ".join(phase["phase_only"]) or "-"))
+    print("-" * 120)
+
+
+def dump_predicate_info(counter, description):
+    """
+    Helper method to print formated counter information
+    @param counter: counter dictionary (k: column name, v: number of occurrence)
+    @param description: description of the counter dictionary
+    @return: nothing
+    """
+    print("=" * 120)
+    print("\n")
+    print("{: >50}".format("Dump column information..."))
+    print("{: >50}".format(description))
+    print("\n")
+    print("-" * 120)
+    print("\t{:<80}{:<10}".format("Column", "Count"))
+    print("-" * 120)
+    for index, count in counter:
+        print("\t{:<80}{:<10}".format(index, str(count)))
+    print("-" * 120)
+
+
+def print_statements(statements, description):
+    """
+    Helper method to print out build index build_statements
+    @param statements: a list of (type, sql statement) tuples, both are of string type
+    @param description: description of the build_statements
+    @return: nothing
+    """
+    print("=" * 120)
+    print("\n")
+    print("{: >50}".format("Dump statements..."))
+    print("{: >50}".format(description))
+    print("\n")
+    print("-" * 120)
+    print("\t{:<30}{:<100}".format("Type", "Statement"))
+    print("-" * 120)
+    for type, statement in statements:
+        print("\t{:<30}{:<100}".format(type, statement))
+    print("-" * 120)
+
+
+def generate_drop_index_statements(candidate_indices):
+    """
+    Generate drop index build_statements from a list of candidate indices.
+    Candidate indices should be the index name from the current database.
+    @param candidate_indices: a list of current indices
+    @return: a list of drop build_statements
+    """
+    statements = []
+    for index in candidate_indices:
+        statements.append("DROP INDEX IF EXISTS {}".format(index))
+    return statements
+
+
+def definition_hash(definition):
+    """
+    Hash part of an index definition (its INCLUDE and WHERE clauses) for the index name,
+    see K.GENERATED_INDEX_PATTERN
+    @param definition: part of the index definition as string
+    @return: 8 hexadecimal digits
+    """
+    return hashlib.md5(definition.encode()).hexdigest()[:8]
+
+
+def generate_build_index_statements(candidate_indices, column_order=None, include_columns=None,
+                                    partial_predicates=None):
+    """
+    Generate build index build_statements from a list of candidate indices.
+    Candidate indices should be in the following format:
+
+        Single-column index:
+            table_name.column_name
+
+        Multi-column index (note that table_name should be the same):
+            table_name.column_name1+table_name.column_name2
+
+    @param candidate_indices: a list of candidate indices
+    @param column_order: dictionary from order_index_columns (columns are kept in order if not given)
+    @param include_columns: dictionary from choose_include_columns (no included columns if not given)
+    @param partial_predicates: dictionary from choose_partial_predicates (no predicate if not given)
+    @return: a list of sql build_statements as strings
+    """
+    # (k: (table name, key columns, WHERE clause, predicate columns), v: list of included columns)
+    indices = {}
+    for candidate_index in candidate_indices:
+        simple_index_list = candidate_index.split("+")
+        predicates = (partial_predicates or {}).get(candidate_index, [])
+        # a column compared with a single constant is left out of the key,
+        # no index is built if every key column is (see tune_indices)
+        constant_columns = set(column for column, values in predicates if len(values) == 1)
+        simple_index_list = [x for x in simple_index_list if x not in constant_columns]
+        if not simple_index_list:
+            continue
+        if column_order is not None:
+            simple_index_list.sort(key=lambda x: column_order[x])
+        table_referenced = None
+        columns_referenced = []
+        # iterate over each column inside of a multi-column index
+        for simple_index in simple_index_list:
+            table, column = simple_index.split(".")
+
+            # cannot build a multi-column index that spans across different tables
+            if table_referenced != table and table_referenced is not None:
+                print("\t\t\nERROR: TRYING TO BUILD MULTI-COLUMN INDEX ACROSS DIFFERENT TABLES!")
+                print("\t\tSELECTING ARBITRARILY!\n")
+                break
+            table_referenced = table
+            columns_referenced.append(column)
+
+        # table has to be specified
+        if table_referenced is None:
+            print("\t\t\nERROR: TABLE IS NOT SPECIFIED, INDEX IS NOT BUILT!\n")
+            continue
+        where = ""
+        if predicates:
+            where = " WHERE {}".format(" AND ".join(
+                "{} = {}".format(column.split(".")[1], values[0]) if len(values) == 1 else
+                "{} IN ({})".format(column.split(".")[1], ", ".join(values)) for column, values in predicates))
+        # candidate indices may end up on the same key and predicate once their constant columns are left out,
+        # a single index then includes the columns of all of them
+        predicate_names = tuple(column.split(".")[1] for column, _ in predicates)
+        included = indices.setdefault((table_referenced, tuple(columns_referenced), where, predicate_names), [])
+        for column in (include_columns or {}).get(candidate_index, []):
+            column = column.split(".")[1]
+            if column not in included and column not in columns_referenced:
+                included.append(column)
+
+    statements = []
+    for (table, columns, where, predicate_names), included in indices.items():
+        clauses = (" INCLUDE ({})".format(", ".join(included)) if included else "") + where
+        index_name = "_".join(("idx", table) + columns)
+        # a partial or covering index gets its own name, an existing index on the same columns is neither,
+        # and another name whenever its INCLUDE columns or predicate change
+        if clauses:
+            where_name = "_".join(("where",) + predicate_names)
+            suffix = "_".join(([where_name] if where else []) + (["include"] if included else []) +
+                              [definition_hash(clauses)])
+            if len(index_name) + 1 + len(suffix) >= K.MAX_IDENTIFIER_LENGTH:
+                # postgres would truncate the name, hash included, the predicate columns are left out,
+                # and the key columns are hashed as well since the name may not list all of them anymore
+                suffix = "_".join((["where"] if where else []) + (["include"] if included else []) +
+                                  [definition_hash("({}){}".format(", ".join(columns), clauses))])
+                index_name = index_name[:K.MAX_IDENTIFIER_LENGTH - len(suffix) - 2]
+            index_name = "_".join((index_name, suffix))
+        command = "CREATE INDEX IF NOT EXISTS {} ON {} USING btree ({}){}".format(
+            index_name, table, ", ".join(columns), clauses)
+        statements.append(("Simple" if len(columns) == 1 else "Composite", command))
+    return statements
+
+
+def explain_cost(cur, query):
+    """
+    Get the estimated cost of a sql query without running it
+    @param cur: cursor from psycopg2
+    @param query: sql query as string
+    @return: total cost of the plan, None if the query could not be planned
+    """
+    # a savepoint keeps the transaction (and a temporary index created in it) usable if planning fails
+    cur.execute("SAVEPOINT whatif_explain")
     try:
-        from sql_metadata import Parser
+        cur.execute("EXPLAIN (FORMAT JSON) " + query)
+        plan = cur.fetchone()[0]
     except Exception:
-        os.system("pip install sql-metadata")
-        from sql_metadata import Parser
+        cur.execute("ROLLBACK TO SAVEPOINT whatif_explain")
+        return None
+    plan = json.loads(plan) if isinstance(plan, str) else plan
+    return plan[0]["Plan"]["Total Cost"]
 
-    def establish_connection(database="project1db", user="project1user", password="project1pass"):
-        """
-        Establish connection to the DB using psycopg2
-        @param database: DB name
-        @param user: username
-        @param password: password
-        @return:
-            conn: connection
-            cur: cursor
-        """
-        conn = psycopg2.connect(f'dbname={database} user={user} password={password} host=localhost')
-        cur = conn.cursor()
-        return conn, cur
 
-    def close_connection(conn, cur):
-        """
-        Close connection to DB
-        @param conn: connection to DB
-        @param cur: cursor from psycopg2
-        @return: nothing
-        """
-        cur.close()
-        conn.close()
+def has_hypopg(conn, cur):
+    """
+    Check whether hypothetical indices (hypopg extension) are available
+    @param conn: connection to DB
+    @param cur: cursor from psycopg2
+    @return: True if hypopg can be used
+    """
+    try:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS hypopg")
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        return False
 
-    def get_unique_index(cur):
-        """
-        Retrieve unique indices from the DB
-        @param cur: cursor from psycopg2
-        @return: a list of current indices
-        @note: a primary key is considered unique in postgres, therefore, primary keys are also ignored
-        """
-        existing_indices = []
-        cur.execute(
-            "SELECT tablename, indexname, indexdef FROM pg_indexes WHERE schemaname='public' AND NOT indexdef LIKE '%UNIQUE%'")
-        for table, index, indexdef in cur:
-            m = re.match(r'CREATE INDEX .+? ON .+? USING .+? \((?P<column>.+?)\)', indexdef)
-            if m is None:
-                print("\t\t\nERROR: PATTERN MATCH FAILED, EXISITING INDEX {} NOT PARSED!".format(index))
-                continue
-            """
-            Assume the pattern match 'column' group contains 
-                
-                    column1, column2, column3
-                    
-            if the table has multi-column index.
-            
-            This also works if the table only has single-column index.
-            """
-            columns = m.group('column').split(",")
-            table_dot_column_list = list(map(lambda x: ".".join((table, x.strip())), columns))
-            table_dot_column_list.sort()
-            existing_indices.append(("+".join(table_dot_column_list), index))
-        return existing_indices
-
-    def filter_csv(workload_csv, col=13):
-        """
-        Read query logs from the csv file and get clean sql queries as strings
-        @param workload_csv: workload (csv) path
-        @param col: query log column (tries every column if fails to retrieve queries from default column
-        @return: pandas dataframe of clean sql queries as strings
-        """
 
-        # read workload csv using the default column only
-        df = pd.read_csv(workload_csv, header=None, usecols=[col])
-        all_queries = df[col]
-
-        # default column does not contain queries, check all other columns
-        if not all_queries.str.contains(K.STATEMENT).any():
-            all_queries = None
-            print("Default col {} does not contain queries, checking other columns".format(col))
-            df = pd.read_csv(workload_csv, header=None, dtype=str)
-            for c in df:
-                content = df[c]
-                if content.str.contains(K.STATEMENT).any():
-                    all_queries = content
-                    break
-            if all_queries is None:
-                # no column contains queries, raise KeyError
-                raise KeyError
-
-        all_queries = pd.concat((
-            all_queries[all_queries.str.contains(K.SELECT, case=False)],
-            all_queries[all_queries.str.contains(K.DELETE, case=False)],
-            all_queries[all_queries.str.contains(K.UPDATE, case=False)],
-            all_queries[all_queries.str.contains(K.INSERT, case=False)],
-        ))
-
-
-        # obtain pure sql queries
-        clean_queries = all_queries.apply(lambda x: x.split(":")[1])
-
-        return clean_queries
-
-    def filter_queries(all_queries, keyword):
-        """
-        Filter queries by keyword
-        @param all_queries: pandas dataframe of clean sql queries as strings
-        @param keyword: keyword to be filtered against
-        @return:
-            number of target queries
-            pandas dataframe of target queries
-        """
-        target_queries = all_queries[all_queries.str.contains(keyword, case=False)]
-        return len(target_queries), target_queries
+def evaluate_candidates(candidates, templates, metadata, current_indices, column_order, size,
+                        table_columns=None):
+    """
+    Estimate how much every candidate index reduces the cost of the templates filtering
+    (or joining) on its leading column.
+    Every candidate is created as a hypothetical index (hypopg) if available,
+    or as a real index inside a transaction that is rolled back otherwise.
+    Candidates that already exist (in the same column order) are not evaluated.
+    @param candidates: a list of candidate indices, see generate_build_index_statements
+    @param templates: pandas dataframe of templates, see fingerprint_queries
+    @param metadata: dictionary of parsed templates, see parse_templates
+    @param current_indices: a list of current indices, see get_current_indices
+    @param column_order: dictionary from order_index_columns
+    @param size: number of connections used in parallel
+    @param table_columns: dictionary from get_table_columns, see qualify_columns
+    @return: dictionary (k: candidate index, v: cost reduction between 0 and 1, None if unknown)
+    """
+    existing_indices = set(table_dot_column for table_dot_column, _, _, _ in current_indices)
+    candidates = [c for c in candidates if ordered_index(c, column_order) not in existing_indices]
 
-    def find_frequent_cols(queries):
-        """
-        Get the columns that are referenced in the WHERE predicate
-        @param queries: pandas dataframe of sql queries as strings
-        @return:
-            counter dictionary of simple column reference (sorted descendingly)
-            counter dictionary of composite column reference (sorted descendingly)
-            number of failed queries
-        """
-        # keeps columns reference together as a separate entry
-        counter_composite_columns = collections.Counter()
-        # entries are always single column
-        counter_simple_columns = collections.Counter()
-        # record number of queries that could not be processed
-        num_failed_queries = 0
-        for q in queries:
-            parsed_q = Parser(q)
-            # sql_meta data sometimes fail to process strings containing quotation marks
+    # the most frequent templates first
+    _, templates_with_predicate = filter_queries(templates, K.WHERE)
+    templates_with_predicate = templates_with_predicate.sort_values(K.WEIGHT, ascending=False)
+    template_columns = []
+    for template, sample, count in zip(templates_with_predicate[K.QUERY], templates_with_predicate[K.SAMPLE],
+                                       templates_with_predicate[K.WEIGHT].tolist()):
+        try:
+            parsed_q = metadata[template]
+            columns = set(predicate_columns(parsed_q, table_columns))
+            columns.update(find_join_cols([template], None, {template: parsed_q}, table_columns))
+            template_columns.append((template, sample, count, columns))
+        except Exception:
+            continue
+
+    candidate_to_templates = {}
+    for candidate in candidates:
+        # the leading column of the index, in the order it is built with
+        leading_column = min(candidate.split("+"), key=column_order.__getitem__)
+        candidate_to_templates[candidate] = [(t, s, c) for t, s, c, columns in template_columns
+                                             if leading_column in columns][:K.WHATIF_TEMPLATES]
+
+    pool = open_connection_pool(size)
+    conn, cur = pool.get()
+    use_hypopg = has_hypopg(conn, cur)
+    pool.put((conn, cur))
+
+    def sample_cost(cur, template):
+        # the sample query keeps the real literals, the template is tried if the sample cannot be planned
+        query, sample, _ = template
+        cost = explain_cost(cur, sample)
+        return explain_cost(cur, query) if cost is None else cost
+
+    def cost_before(conn, cur, template):
+        cost = sample_cost(cur, template)
+        conn.rollback()
+        return cost
+
+    all_templates = sorted(set(t for ts in candidate_to_templates.values() for t in ts))
+    before = dict(zip(all_templates, run_on_connection_pool(pool, cost_before, all_templates)))
+
+    def cost_reduction(conn, cur, candidate):
+        _, statement = generate_build_index_statements([candidate], column_order)[0]
+        total_before = 0
+        total_after = 0
+        try:
+            if use_hypopg:
+                cur.execute("SELECT * FROM hypopg_create_index(%s)", (statement,))
+            else:
+                cur.execute(statement)
+            for template in candidate_to_templates[candidate]:
+                cost = sample_cost(cur, template) if before[template] is not None else None
+                if cost is not None:
+                    total_before += template[2] * before[template]
+                    total_after += template[2] * cost
+        except Exception:
+            total_before = 0
+        finally:
+            # also discards the temporary index if hypopg is not available
+            conn.rollback()
+            if use_hypopg:
+                cur.execute("SELECT hypopg_reset()")
+                conn.rollback()
+        return (total_before - total_after) / total_before if total_before > 0 else None
+
+    reductions = run_on_connection_pool(pool, cost_reduction, candidates)
+    close_connection_pool(pool)
+    return dict(zip(candidates, reductions))
+
+
+def index_and_table(statement):
+    """
+    Get the index and table names of a build statement
+    @param statement: sql statement from generate_build_index_statements
+    @return: index name, table name
+    """
+    return re.search(r"IF NOT EXISTS (\S+) ON (\S+)", statement).groups()
+
+
+def drop_invalid_indices(cur, index_names):
+    """
+    Drop the invalid indices left by failed concurrent builds, among the given ones only
+    (an invalid index may also be a concurrent build still running elsewhere)
+    @param cur: cursor from psycopg2 of a connection in autocommit mode
+    @param index_names: list of index names
+    @return: list of the dropped index names
+    """
+    cur.execute("SELECT i.relname FROM pg_index x "
+                "JOIN pg_class i ON i.oid = x.indexrelid "
+                "JOIN pg_namespace n ON n.oid = i.relnamespace "
+                "WHERE n.nspname = 'public' AND NOT x.indisvalid AND i.relname = ANY(%s)", (list(index_names),))
+    invalid_indices = [index for index, in cur.fetchall()]
+    for index in invalid_indices:
+        cur.execute("DROP INDEX CONCURRENTLY IF EXISTS {}".format(index))
+    return invalid_indices
+
+
+def report_build_progress(cur):
+    """
+    Print the progress of the index builds running on the DB
+    @param cur: cursor from psycopg2 of a connection in autocommit mode
+    @return: nothing
+    """
+    cur.execute("SELECT p.index_relid::regclass, p.relid::regclass, p.phase, "
+                "       p.blocks_done, p.blocks_total, p.tuples_done, p.tuples_total "
+                "FROM pg_stat_progress_create_index p")
+    for index, table, phase, blocks_done, blocks_total, tuples_done, tuples_total in cur.fetchall():
+        print("\t{:<50}{:<50}{}".format("{} ON {}".format(index, table), phase,
+                                        "{}/{} blocks, {}/{} tuples".format(blocks_done, blocks_total,
+                                                                            tuples_done, tuples_total)))
+
+
+def apply_actions(build_statements, drop_statements, size, maintenance_work_mem):
+    """
+    Run the build and drop statements on the DB without blocking writes, see K.APPLY_MAINTENANCE_WORK_MEM.
+    The builds of a table run one after another (concurrent builds on the same table wait for each other),
+    the builds of different tables in parallel.
+    A failed build leaves an invalid index behind, which is dropped,
+    and the drop statements are skipped, since they may drop an index replaced by a failed build.
+    @param build_statements: list of (type, statement) tuples from generate_build_index_statements
+    @param drop_statements: list of statements from generate_drop_index_statements
+    @param size: number of connections used in parallel
+    @param maintenance_work_mem: maintenance_work_mem of every build, e.g. "256MB"
+    @return: list of (statement, error message or None if it succeeded) tuples, skipped statements left out
+    """
+    table_to_statements = collections.defaultdict(list)
+    for _, statement in build_statements:
+        index, table = index_and_table(statement)
+        statement = statement.replace("CREATE INDEX IF NOT EXISTS", "CREATE INDEX CONCURRENTLY IF NOT EXISTS", 1)
+        table_to_statements[table].append((index, statement))
+
+    pool = open_connection_pool(size + 1)
+    connections = [pool.get() for _ in range(size + 1)]
+    # concurrent builds and drops cannot run inside a transaction block
+    for conn, _ in connections:
+        conn.autocommit = True
+    for connection in connections[1:]:
+        pool.put(connection)
+    conn, cur = connections[0]
+
+    # an invalid index of the same name would make CREATE INDEX IF NOT EXISTS skip the build
+    drop_invalid_indices(cur, [index for statements in table_to_statements.values() for index, _ in statements])
+
+    def build(conn, cur, statements):
+        results = []
+        cur.execute("SET maintenance_work_mem = %s", (maintenance_work_mem,))
+        for index, statement in statements:
             try:
-                columns = parsed_q.columns_dict[K.WHERE]
-                table = parsed_q.tables[0]
-                columns = list(map(lambda x: x if "." in x else ".".join((table, x)), columns))
-                columns.sort()
-                counter_composite_columns["+".join(columns)] += 1
-                for col in columns:
-                    counter_simple_columns[col] += 1
-            except Exception:
-                num_failed_queries += 1
-        return counter_simple_columns.most_common(), counter_composite_columns.most_common(), num_failed_queries
+                cur.execute(statement)
+                results.append((statement, None))
+            except Exception as e:
+                results.append((statement, str(e).strip()))
+                drop_invalid_indices(cur, [index])
+        return results
 
-    def find_update_target(queries):
-        """
-        Get the columns where the updates take place
-        @param queries: pandas dataframe of sql queries as strings
-        @return:
-            counter dictionary of the columns where updates take place
-            number of failed queries
-        """
-        counter = collections.Counter()
-        num_failed_queries = 0
-        for q in queries:
-            parsed_q = Parser(q)
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        future = executor.submit(run_on_connection_pool, pool, build, list(table_to_statements.values()))
+        while True:
+            try:
+                results = [result for results in future.result(timeout=K.APPLY_PROGRESS_INTERVAL)
+                           for result in results]
+                break
+            except concurrent.futures.TimeoutError:
+                report_build_progress(cur)
+
+    if all(error is None for _, error in results):
+        for statement in drop_statements:
+            statement = statement.replace("DROP INDEX IF EXISTS", "DROP INDEX CONCURRENTLY IF EXISTS", 1)
             try:
-                column = parsed_q.columns_dict[K.UPDATE][0]
-                table = parsed_q.tables[0]
-                column = table + "." + column
-                counter[column] += 1
+                cur.execute(statement)
+                results.append((statement, None))
+            except Exception as e:
+                results.append((statement, str(e).strip()))
+
+    pool.put((conn, cur))
+    close_connection_pool(pool)
+    return results
+
+
+def replay_workload(queries, clients):
+    """
+    Replay sql queries against the DB, every client replaying all of them (starting at a different one),
+    every query in a transaction that is rolled back, see K.REPLAY_QUERIES
+    @param queries: list of sql queries as strings
+    @param clients: number of concurrent clients
+    @return:
+        list of (query, latency in seconds or None if it failed) tuples
+        total replay time in seconds
+    """
+    pool = open_connection_pool(clients)
+
+    def replay(conn, cur, offset):
+        cur.execute("SET statement_timeout = %s", (K.REPLAY_STATEMENT_TIMEOUT,))
+        conn.commit()
+        latencies = []
+        for query in queries[offset:] + queries[:offset]:
+            start_time = time.perf_counter()
+            try:
+                cur.execute(query)
+                if cur.description is not None:
+                    cur.fetchall()
+                latencies.append((query, time.perf_counter() - start_time))
             except Exception:
-                num_failed_queries += 1
-        return counter.most_common(), num_failed_queries
+                latencies.append((query, None))
+            finally:
+                conn.rollback()
+        return latencies
 
-    def dump_workload_info(all_queries):
-        """
-        Helper method to print formated workload information
-        @param all_queries: pandas dataframe of all sql queries in a workload
-        @return: nothing
-        """
-        num_queries = len(all_queries)
-        num_queries_with_predicates, queries_with_predicate = filter_queries(all_queries, K.WHERE)
-        num_delete, _ = filter_queries(all_queries, K.DELETE)
-        num_update, _ = filter_queries(all_queries, K.UPDATE)
-        num_insert, _ = filter_queries(all_queries, K.INSERT)
-        num_select, _ = filter_queries(all_queries, K.SELECT)
+    start_time = time.perf_counter()
+    results = run_on_connection_pool(pool, replay, [i * len(queries) // clients for i in range(clients)])
+    elapsed = time.perf_counter() - start_time
+    close_connection_pool(pool)
+    return [latency for latencies in results for latency in latencies], elapsed
 
-        print("=" * 120)
-        print("\n")
-        print("{: >50}".format("Dump workload information..."))
-        print("\n")
-        print("-" * 120)
-        print("\t{:<80}{:<10}".format("Description", "metric"))
-        print("-" * 120)
-        print("\t{:<80}{:<10}".format("num queries", str(num_queries)))
-        print("\t{:<80}{:<10.3f}%".format("queries with predicate", num_queries_with_predicates / num_queries * 100))
-        print("\t{:<80}{:<10.3f}%".format("delete", num_delete / num_queries * 100))
-        print("\t{:<80}{:<10.3f}%".format("update", num_update / num_queries * 100))
-        print("\t{:<80}{:<10.3f}%".format("insert", num_insert / num_queries * 100))
-        print("\t{:<80}{:<10.3f}%".format("select", num_select / num_queries * 100))
-        print("-" * 120)
 
-    def dump_predicate_info(counter, description):
-        """
-        Helper method to print formated counter information
-        @param counter: counter dictionary (k: column name, v: number of occurrence)
-        @param description: description of the counter dictionary
-        @return: nothing
-        """
-        print("=" * 120)
-        print("\n")
-        print("{: >50}".format("Dump column information..."))
-        print("{: >50}".format(description))
-        print("\n")
-        print("-" * 120)
-        print("\t{:<80}{:<10}".format("Column", "Count"))
-        print("-" * 120)
-        for index, count in counter:
-            print("\t{:<80}{:<10}".format(index, str(count)))
-        print("-" * 120)
+def summarize_replay(latencies, elapsed):
+    """
+    Summarize a replay
+    @param latencies: list of (query, latency) tuples from replay_workload
+    @param elapsed: total replay time from replay_workload
+    @return: dictionary of the p50/p95/p99 latency (ms), throughput (queries/s) and number of failed queries
+    """
+    succeeded = pd.Series([latency for _, latency in latencies if latency is not None], dtype=float) * 1000
+    p50, p95, p99 = succeeded.quantile([0.5, 0.95, 0.99]).fillna(0).tolist()
+    return {
+        "p50": p50,
+        "p95": p95,
+        "p99": p99,
+        "throughput": len(succeeded) / max(elapsed, 1e-9),
+        "failed": len(latencies) - len(succeeded),
+    }
 
-    def print_statements(statements, description):
-        """
-        Helper method to print out build index build_statements
-        @param statements: a list of (type, sql statement) tuples, both are of string type
-        @param description: description of the build_statements
-        @return: nothing
-        """
+
+def plan_indices(conn, cur, query):
+    """
+    Get the indices the plan of a sql query uses, without running it
+    @param conn: connection to DB
+    @param cur: cursor from psycopg2
+    @param query: sql query as string
+    @return: set of index names, None if the query could not be planned
+    """
+    try:
+        cur.execute("EXPLAIN (FORMAT JSON) " + query)
+        plan = cur.fetchone()[0]
+    except Exception:
+        return None
+    finally:
+        conn.rollback()
+    plan = json.loads(plan) if isinstance(plan, str) else plan
+    indices = set()
+    nodes = [plan[0]["Plan"]]
+    while nodes:
+        node = nodes.pop()
+        if "Index Name" in node:
+            indices.add(node["Index Name"])
+        nodes.extend(node.get("Plans", []))
+    return indices
+
+
+def find_regressions(before, after, build_statements):
+    """
+    Compare the median latency of every template before and after the actions are applied,
+    and flag the built indices the plans of the templates that got slower use, see K.REPLAY_REGRESSION_CUTOFF
+    @param before: list of (query, latency) tuples from replay_workload
+    @param after: list of (query, latency) tuples from replay_workload
+    @param build_statements: list of (type, statement) tuples from generate_build_index_statements
+    @return: dictionary (k: index name, v: list of (template, median latency before, after) in ms)
+    """
+    def median_latencies(latencies):
+        latencies = pd.DataFrame(latencies, columns=[K.QUERY, "latency"]).dropna()
+        latencies[K.SAMPLE] = latencies[K.QUERY]
+        latencies[K.QUERY] = normalize_queries(latencies[K.QUERY])
+        groups = latencies.groupby(K.QUERY)
+        return (groups["latency"].median() * 1000).to_dict(), groups[K.SAMPLE].first().to_dict()
+
+    before, _ = median_latencies(before)
+    after, samples = median_latencies(after)
+    built_indices = set(index_and_table(statement)[0] for _, statement in build_statements)
+
+    regressions = collections.defaultdict(list)
+    conn, cur = establish_connection()
+    for template, latency in sorted(after.items()):
+        if template not in before or latency <= before[template] * (1 + K.REPLAY_REGRESSION_CUTOFF) or \
+                latency - before[template] <= K.REPLAY_REGRESSION_MIN_DELTA:
+            continue
+        # the plan of a logged query of the template, now that the indices are built
+        for index in sorted((plan_indices(conn, cur, samples[template]) or set()) & built_indices):
+            regressions[index].append((template, before[template], latency))
+    close_connection(conn, cur)
+    return regressions
+
+
+def dump_replay_info(summary_before, summary_after, regressions):
+    """
+    Helper method to print formated replay information
+    @param summary_before: dictionary from summarize_replay, before the actions are applied
+    @param summary_after: dictionary from summarize_replay, after the actions are applied
+    @param regressions: dictionary from find_regressions
+    @return: nothing
+    """
+    print("=" * 120)
+    print("\n")
+    print("{: >50}".format("Dump replay information..."))
+    print("\n")
+    print("-" * 120)
+    print("\t{:<60}{:<20}{:<20}".format("Metric", "Before", "After"))
+    print("-" * 120)
+    for metric, unit in (("p50", "ms"), ("p95", "ms"), ("p99", "ms"), ("throughput", "queries/s"),
+                         ("failed", "queries")):
+        print("\t{:<60}{:<20.3f}{:<20.3f}".format("{} ({})".format(metric, unit), summary_before[metric],
+                                                  summary_after[metric]))
+    print("-" * 120)
+    for index, templates in regressions.items():
+        print("\t\tREGRESSION: {}".format(index))
+        for template, latency_before, latency_after in templates:
+            print("\t\t{:.3f} ms -> {:.3f} ms\t{}".format(latency_before, latency_after, template))
+
+
+def read_workload(chunks, sample_size=0, half_life=0, window=0):
+    """
+    Fingerprint a workload chunk by chunk
+    @param chunks: iterable of pandas dataframes of classified sql queries
+    @param sample_size: number of queries to sample uniformly from the workload, see K.REPLAY_QUERIES
+    @param half_life: half-life (s) of the query weights, every query weighs 1 if 0, see K.TIMESTAMP_COLUMN
+    @param window: window length (s) of the number of occurrence of the templates over time, none if 0
+    @return:
+        number of queries
+        counter dictionary from count_workload_info
+        pandas dataframe of templates, see fingerprint_queries
+        dictionary of the literals of the WHERE columns, see find_constant_predicates
+        list of sampled sql queries as strings, in random order
+        pandas series of the number of occurrence of the templates (index: window number, template),
+            None if there is no window (or timestamp)
+        timestamp (s) of the last query, the weights are relative to it (None if there is no timestamp)
+    """
+    num_queries = 0
+    workload_info = collections.Counter()
+    templates = None
+    constants = {}
+    window_counts = None
+    last_timestamp = None
+    # every query gets a random key, the queries of the smallest keys are the sample
+    rng = np.random.default_rng(K.REPLAY_SEED)
+    sample = pd.DataFrame({K.QUERY: pd.Series([], dtype=str), "key": pd.Series([], dtype=float)})
+    for all_queries in chunks:
+        num_queries += len(all_queries)
+        if sample_size > 0:
+            chunk_sample = pd.DataFrame({K.QUERY: all_queries[K.QUERY].to_numpy(),
+                                         "key": rng.random(len(all_queries))})
+            sample = pd.concat((sample, chunk_sample), ignore_index=True).nsmallest(sample_size, "key")
+        workload_info.update(count_workload_info(all_queries))
+        normalized = normalize_queries(all_queries[K.QUERY])
+
+        weights = None
+        if K.TIMESTAMP in all_queries and all_queries[K.TIMESTAMP].notna().any():
+            # a query without timestamp happened when the previous one did
+            timestamps = all_queries[K.TIMESTAMP].ffill().bfill()
+            if half_life > 0:
+                chunk_timestamp = timestamps.max()
+                if last_timestamp is None or chunk_timestamp > last_timestamp:
+                    if last_timestamp is not None:
+                        # age the weights of the previous chunks
+                        decay = 2 ** ((last_timestamp - chunk_timestamp) / half_life)
+                        templates[K.WEIGHT] *= decay
+                        for values in constants.values():
+                            for value in values or {}:
+                                values[value] *= decay
+                    last_timestamp = chunk_timestamp
+                weights = 2 ** ((timestamps - last_timestamp).clip(upper=0) / half_life)
+            else:
+                last_timestamp = max(timestamps.max(), last_timestamp or -math.inf)
+            if window > 0:
+                chunk_counts = normalized.groupby([(timestamps // window).astype(int), normalized]).size()
+                window_counts = chunk_counts if window_counts is None else window_counts.add(chunk_counts,
+                                                                                             fill_value=0)
+
+        merge_constant_predicates(constants, find_constant_predicates(all_queries, normalized, weights))
+        chunk_templates = fingerprint_queries(all_queries, normalized, weights)
+        if templates is None:
+            templates = chunk_templates
+        else:
+            templates = group_templates(pd.concat((templates, chunk_templates), ignore_index=True))
+
+    # nothing to read (e.g. no new log lines in online mode)
+    if templates is None:
+        templates = fingerprint_queries(classify_queries(pd.Series([], dtype=str)))
+    if window_counts is not None:
+        window_counts = window_counts.astype(int).rename_axis(["window", K.QUERY])
+    return num_queries, workload_info, templates, constants, sample[K.QUERY].tolist(), window_counts, \
+        last_timestamp
+
+
+def parse_templates(templates, parse_cache, workers):
+    """
+    Parse the templates the counting stages need, templates never seen by a previous run only
+    @param templates: pandas dataframe of templates, see fingerprint_queries
+    @param parse_cache: parse cache path, see open_parse_cache
+    @param workers: number of worker processes
+    @return:
+        dictionary of parsed templates, see extract_all_metadata
+        counter dictionary of the extraction paths of the templates parsed in this run
+    """
+    # every template but the select queries without predicate or join
+    templates_to_parse = set(templates[K.QUERY][templates[K.WHERE] | (templates[K.TYPE] != K.SELECT) |
+                                                templates[K.QUERY].str.contains(r"(?i)\bjoin\b", regex=True)])
+
+    cache = open_parse_cache(parse_cache)
+    metadata = load_parse_cache(cache, templates_to_parse)
+    new_templates = sorted(templates_to_parse.difference(metadata))
+
+    pool = create_worker_pool(workers)
+    new_metadata, extraction_paths = parallel_extract_metadata(pool, workers, new_templates)
+    if pool is not None:
+        pool.shutdown()
+
+    store_parse_cache(cache, new_metadata)
+    if cache is not None:
+        cache.close()
+    metadata.update(new_metadata)
+    return metadata, extraction_paths
+
+
+def count_templates(templates, metadata, constants, table_columns=None):
+    """
+    Run the counting stages over the templates, every template weighted by the weight of its queries (K.WEIGHT)
+    @param templates: pandas dataframe of templates, see fingerprint_queries
+    @param metadata: dictionary of parsed templates, see parse_templates
+    @param constants: dictionary of the literals of the WHERE columns, see find_constant_predicates
+    @param table_columns: dictionary from get_table_columns, see qualify_columns
+    @return: dictionary of counter dictionaries of
+        simple column reference (K.SIMPLE)
+        composite column reference (K.COMPOSITE)
+        range column reference (K.RANGE)
+        join column reference (K.JOIN)
+        projected columns of the select queries (K.PROJECTION)
+        literals the WHERE columns are compared with (K.CONSTANTS)
+        the columns where updates take place (K.UPDATE)
+        the sets of columns updated together (K.UPDATE_SETS)
+        the tables inserted into (K.INSERT) and deleted from (K.DELETE)
+        counter dictionary (k: counting stage, v: number of failed queries)
+    """
+    weights = dict(zip(templates[K.QUERY], templates[K.WEIGHT].tolist()))
+    counters = {}
+    failures = collections.Counter()
+
+    _, templates_with_predicate = filter_queries(templates, K.WHERE)
+    counters[K.SIMPLE], counters[K.COMPOSITE], failures["find_frequent_cols"] = find_frequent_cols(
+        templates_with_predicate[K.QUERY], weights, metadata, table_columns)
+    counters[K.RANGE] = find_range_cols(templates_with_predicate[K.QUERY], weights, metadata, table_columns)
+    select_templates = templates_with_predicate[templates_with_predicate[K.TYPE] == K.SELECT]
+    counters[K.PROJECTION] = find_projected_cols(select_templates[K.QUERY], weights, metadata, table_columns)
+    counters[K.CONSTANTS] = find_constant_cols(constants, metadata, table_columns)
+    parsed_templates = templates[templates[K.QUERY].isin(metadata)]
+    counters[K.JOIN] = find_join_cols(parsed_templates[K.QUERY], weights, metadata, table_columns)
+
+    _, update_templates = filter_queries(templates, K.UPDATE)
+    counters[K.UPDATE], counters[K.UPDATE_SETS], failures["find_update_target"] = find_update_target(
+        update_templates[K.QUERY], weights, metadata)
+
+    _, insert_templates = filter_queries(templates, K.INSERT)
+    counters[K.INSERT], failures["find_write_tables"] = find_write_tables(insert_templates[K.QUERY], weights,
+                                                                          metadata)
+    _, delete_templates = filter_queries(templates, K.DELETE)
+    counters[K.DELETE], num_failed_queries = find_write_tables(delete_templates[K.QUERY], weights, metadata)
+    failures["find_write_tables"] += num_failed_queries
+    return counters, failures
+
+
+def find_candidates(counters, num_queries):
+    """
+    Find the candidate indices from the column references of the workload
+    @param counters: dictionary of counter dictionaries, see count_templates
+    @param num_queries: number of sql queries in the workload
+    @return:
+        dictionary (k: candidate index, v: percent usage)
+        dictionary (k: table_name.column_name, v: set of the candidate indices containing the column)
+    """
+    candidate_indices_to_percent_usage = {}
+    simple_to_composite_index = collections.defaultdict(set)
+
+    """
+    Iterate over all referenced composite columns (can be simple) in the predicates.
+    Add the multi-column index to the candidate_indices_to_percent_usage along with the percent usage 
+    if the composite columns are referenced more than the threshold (K.REFERENCE_CUTOFF_LOW).
+    Add the record to simple_to_composite_index for all simple column index in the multi-column index.
+    """
+    for composite_index, occurance in counters[K.COMPOSITE].most_common():
+        percent_usage = occurance / num_queries
+        if percent_usage >= K.REFERENCE_CUTOFF_LOW:
+            candidate_indices_to_percent_usage[composite_index] = percent_usage
+            for simple_index in composite_index.split("+"):
+                simple_to_composite_index[simple_index].add(composite_index)
+        else:
+            break
+
+    """
+    Iterate over all referenced simple columns in the predicates.
+    Add the simple index to the candidate_indices_to_percent_usage along with the percent usage 
+    if the simple columns are referenced more than the threshold (K.SIMPLE_REFERENCE_CUT_OFF_HIGH) 
+    and if the simple column has not been added as part of the multi-column index.
+    Add the record to simple_to_composite_index.
+    """
+    for simple_index, occurance in counters[K.SIMPLE].most_common():
+        percent_usage = occurance / num_queries
+        if percent_usage >= K.SIMPLE_REFERENCE_CUT_OFF_HIGH:
+            if simple_index not in candidate_indices_to_percent_usage:
+                candidate_indices_to_percent_usage[simple_index] = percent_usage
+                simple_to_composite_index[simple_index].add(simple_index)
+        else:
+            break
+
+    """
+    Iterate over all referenced columns in the join predicates.
+    Add the single-column index to the candidate_indices_to_percent_usage along with the percent usage 
+    if the join columns are referenced more than the threshold (K.JOIN_REFERENCE_CUTOFF) 
+    and if the join column has not been added already.
+    """
+    for join_index, occurance in counters[K.JOIN].most_common():
+        percent_usage = occurance / num_queries
+        if percent_usage >= K.JOIN_REFERENCE_CUTOFF:
+            if join_index not in candidate_indices_to_percent_usage:
+                candidate_indices_to_percent_usage[join_index] = percent_usage
+                simple_to_composite_index[join_index].add(join_index)
+        else:
+            break
+    return candidate_indices_to_percent_usage, simple_to_composite_index
+
+
+def prune_candidates(candidate_indices_to_percent_usage, simple_to_composite_index, counters, num_queries):
+    """
+    Remove the candidate indices that cost more to maintain than they are used, in place
+    @param candidate_indices_to_percent_usage: dictionary from find_candidates
+    @param simple_to_composite_index: dictionary from find_candidates
+    @param counters: dictionary of counter dictionaries, see count_templates
+    @param num_queries: number of sql queries in the workload
+    @return: nothing
+    """
+    """
+    Iterate over the candidate indices, least valuable first.
+    Remove the candidate index whose write cost (see K.INSERT_COST_WEIGHT) exceeds its percent usage the most,
+    then estimate the write costs again, since fewer indices make more updates HOT.
+    """
+    while candidate_indices_to_percent_usage:
+        write_costs = estimate_write_costs(list(candidate_indices_to_percent_usage), counters, num_queries)
+        candidate_index = min(candidate_indices_to_percent_usage, key=lambda x: (
+            candidate_indices_to_percent_usage[x] - write_costs[x], x))
+        if candidate_indices_to_percent_usage[candidate_index] >= write_costs[candidate_index]:
+            break
+        del candidate_indices_to_percent_usage[candidate_index]
+        for simple_index in candidate_index.split("+"):
+            simple_to_composite_index[simple_index].discard(candidate_index)
+
+
+def detect_phases(window_counts):
+    """
+    Cut the windows of a workload into phases of similar template mix, see K.PHASE_CHANGE_CUTOFF
+    @param window_counts: pandas series of the number of occurrence of the templates over time, see read_workload
+    @return: list of (first window number, last window number, pandas series of the number of occurrence
+        of the templates during the phase) tuples, in order
+    """
+    if window_counts is None or window_counts.empty:
+        return []
+    counts = window_counts.unstack(fill_value=0).sort_index()
+    phases = []
+    first, last, phase_counts = None, None, None
+    for window, window_count in zip(counts.index, counts.to_numpy(dtype=float)):
+        total = window_count.sum()
+        if phase_counts is not None and total >= K.PHASE_MIN_QUERIES:
+            # total variation distance between the template mixes of the window and of the current phase
+            distance = np.abs(window_count / total - phase_counts / phase_counts.sum()).sum() / 2
+            if distance > K.PHASE_CHANGE_CUTOFF:
+                phases.append((first, last, pd.Series(phase_counts, index=counts.columns)))
+                phase_counts = None
+        if phase_counts is None:
+            first, phase_counts = window, window_count.copy()
+        else:
+            phase_counts += window_count
+        last = window
+    phases.append((first, last, pd.Series(phase_counts, index=counts.columns)))
+    return phases
+
+
+def find_phase_candidates(phases, templates, metadata, constants, table_columns=None):
+    """
+    Find the candidate indices of every phase on its own, see find_candidates and prune_candidates
+    @param phases: list of phases, see detect_phases
+    @param templates: pandas dataframe of templates, see fingerprint_queries
+    @param metadata: dictionary of parsed templates, see parse_templates
+    @param constants: dictionary of the literals of the WHERE columns, see find_constant_predicates
+    @param table_columns: dictionary from get_table_columns, see qualify_columns
+    @return: list of sets of candidate indices, one per phase
+    """
+    phase_candidates = []
+    for _, _, phase_counts in phases:
+        phase_counts = phase_counts[phase_counts > 0]
+        phase_templates = templates[templates[K.QUERY].isin(phase_counts.index)]
+        phase_templates = phase_templates.assign(**{
+            K.COUNT: phase_templates[K.QUERY].map(phase_counts).astype(int),
+            K.WEIGHT: phase_templates[K.QUERY].map(phase_counts).astype(int),
+        })
+        num_queries = int(phase_counts.sum())
+        counters, _ = count_templates(phase_templates, metadata, constants, table_columns)
+        candidate_indices_to_percent_usage, simple_to_composite_index = find_candidates(counters, num_queries)
+        prune_candidates(candidate_indices_to_percent_usage, simple_to_composite_index, counters, num_queries)
+        phase_candidates.append(set(candidate_indices_to_percent_usage))
+    return phase_candidates
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident set size of the process (Linux only, the peak is never reset elsewhere)
+    @return: nothing
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss():
+    """
+    Get the peak resident set size of the process, since the last reset_peak_rss
+    @return: peak resident set size in bytes
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure_stage(stages, stage, func, *args):
+    """
+    Call a stage of the pipeline and record its wall time, CPU time and peak memory
+    @param stages: list of stage dictionaries, the stage is appended to it
+    @param stage: stage name
+    @param func: the stage
+    @param args: arguments of the stage
+    @return: result of the stage
+    """
+    reset_peak_rss()
+    start_time, start_cpu = time.perf_counter(), time.process_time()
+    result = func(*args)
+    stages.append({
+        "stage": stage,
+        "seconds": time.perf_counter() - start_time,
+        "cpu_seconds": time.process_time() - start_cpu,
+        "peak_rss": peak_rss(),
+    })
+    return result
+
+
+def count_stage(stages, rows, queries, failures=0):
+    """
+    Record what the last measured stage processed, see measure_stage
+    @param stages: list of stage dictionaries
+    @param rows: number of rows (log lines, templates or candidates) processed
+    @param queries: number of sql queries the rows represent
+    @param failures: number of sql queries that could not be processed
+    @return: nothing
+    """
+    stages[-1].update(rows=rows, queries=queries, failures=failures,
+                      throughput=queries / max(stages[-1]["seconds"], 1e-9))
+
+
+def benchmark_stages(workload_csv, chunksize, workers, filter_all=False):
+    """
+    Run the stages of the pipeline on a workload one after another, and measure each of them.
+    The stages needing a DB connection (what-if evaluation, index selection, current indices) are left out.
+    @param workload_csv: workload (csv) path
+    @param chunksize: number of csv rows per chunk
+    @param workers: number of worker processes parsing templates
+    @param filter_all: also measure filter_csv, which reads the whole log at once, for comparison with read_workload
+    @return: list of dictionaries of the stage name, wall time (s), CPU time (s), peak resident set size (bytes),
+        number of rows processed, number of queries they represent, number of failed queries
+        and throughput (queries/s), see measure_stage and count_stage
+    """
+    results = []
+    measure = functools.partial(measure_stage, results)
+    count = functools.partial(count_stage, results)
+
+    if filter_all:
+        all_queries = measure("filter_csv", filter_csv, workload_csv)
+        count(len(all_queries), len(all_queries))
+        del all_queries
+
+    num_queries, _, templates, constants, _, _, _ = measure("read_workload", lambda: read_workload(
+        stream_csv(workload_csv, chunksize=chunksize)))
+    count(num_queries, num_queries)
+
+    metadata, _ = measure("parse_templates", parse_templates, templates, "", workers)
+    count(len(metadata), int(templates[K.COUNT][templates[K.QUERY].isin(metadata)].sum()))
+
+    weights = dict(zip(templates[K.QUERY], templates[K.COUNT].tolist()))
+    _, templates_with_predicate = filter_queries(templates, K.WHERE)
+    _, _, num_failed_queries = measure("find_frequent_cols", find_frequent_cols, templates_with_predicate[K.QUERY],
+                                       weights, metadata)
+    count(len(templates_with_predicate), int(templates_with_predicate[K.COUNT].sum()), num_failed_queries)
+
+    _, update_templates = filter_queries(templates, K.UPDATE)
+    _, _, num_failed_queries = measure("find_update_target", find_update_target, update_templates[K.QUERY],
+                                       weights, metadata)
+    count(len(update_templates), int(update_templates[K.COUNT].sum()), num_failed_queries)
+
+    counters, failures = measure("count_templates", count_templates, templates, metadata, constants)
+    count(len(templates), num_queries, sum(failures.values()))
+
+    def select_candidates():
+        candidate_indices_to_percent_usage, simple_to_composite_index = find_candidates(counters, num_queries)
+        prune_candidates(candidate_indices_to_percent_usage, simple_to_composite_index, counters, num_queries)
+        return candidate_indices_to_percent_usage
+
+    candidate_indices = measure("candidate selection", select_candidates)
+    count(len(candidate_indices), num_queries)
+    return results
+
+
+def generate_workload_csv(path, num_lines, skew, update_ratio, seed=K.BENCHMARK_SEED):
+    """
+    Write a synthetic epinions-style query log, in the csvlog layout filter_csv expects (query in column 13)
+    @param path: workload (csv) path
+    @param num_lines: number of query log lines, a BEGIN / COMMIT pair is logged for every tenth write
+    @param skew: exponent of the Zipf distribution of the templates, 0 is uniform
+    @param update_ratio: fraction of the queries that are writes (UPDATE, INSERT, DELETE)
+    @param seed: random seed, the same parameters always give the same log
+    @return: nothing
+    """
+    rng = np.random.default_rng(seed)
+    templates = K.BENCHMARK_READ_TEMPLATES + K.BENCHMARK_WRITE_TEMPLATES
+    weights = []
+    for group, ratio in ((K.BENCHMARK_READ_TEMPLATES, 1 - update_ratio), (K.BENCHMARK_WRITE_TEMPLATES, update_ratio)):
+        zipf = 1 / np.arange(1, len(group) + 1) ** skew
+        weights.extend(ratio * zipf / zipf.sum())
+    num_reads = len(K.BENCHMARK_READ_TEMPLATES)
+    start = np.datetime64("2022-02-01T10:00:00.000")
+
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        line = 0
+        while line < num_lines:
+            size = min(K.BENCHMARK_BLOCK, num_lines - line)
+            choices = rng.choice(len(templates), size=size, p=weights)
+            values = rng.integers(1, 100000, size=(size, 2))
+            timestamps = np.datetime_as_string(start + np.arange(line, line + size) * np.timedelta64(10, "ms"))
+            rows = []
+            for i in range(size):
+                timestamp = timestamps[i].replace("T", " ") + " EST"
+                session = str(line + i)
+                prefix = [timestamp, "project1user", "project1db", "15799", "[local]", "s", session, "idle",
+                          timestamp, "3/" + session, "0", "LOG", "00000"]
+                query = templates[choices[i]].format(a=values[i, 0], b=values[i, 1])
+                transaction = choices[i] >= num_reads and i % 10 == 0
+                if transaction:
+                    rows.append(prefix + ["statement: BEGIN"] + [""] * 9)
+                rows.append(prefix + ["statement: " + query] + [""] * 9)
+                if transaction:
+                    rows.append(prefix + ["statement: COMMIT"] + [""] * 9)
+            writer.writerows(rows)
+            line += size
+
+
+def run_benchmark(lines, skew, update_ratio, chunksize, workers, output, directory):
+    """
+    Generate a workload for every size and measure the stages of the pipeline on it, see benchmark_stages.
+    Every size runs in a fresh process, so that the peak memory of a size does not hide the next one.
+    @param lines: comma separated numbers of query log lines
+    @param skew: template skew, see generate_workload_csv
+    @param update_ratio: fraction of writes, see generate_workload_csv
+    @param chunksize: number of csv rows per chunk
+    @param workers: number of worker processes parsing templates
+    @param output: path of the json results
+    @param directory: directory of the generated workloads, reused across runs
+    @return: nothing
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    results = []
+    for num_lines in (int(x) for x in lines.split(",")):
+        path = os.path.join(directory, "workload_{}_{}_{}_{}.csv".format(num_lines, skew, update_ratio,
+                                                                        K.BENCHMARK_SEED))
+        if not os.path.exists(path):
+            print("Generating {} lines in {}".format(num_lines, path))
+            generate_workload_csv(path + ".tmp", num_lines, skew, update_ratio)
+            os.replace(path + ".tmp", path)
+
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("fork")) as executor:
+            stages = executor.submit(benchmark_stages, path, chunksize, workers,
+                                     num_lines <= K.BENCHMARK_FILTER_MAX_LINES).result()
+
+        print("{} lines ({:.1f} MB)".format(num_lines, os.path.getsize(path) / 2 ** 20))
+        print("\t{:<20}{:>10}{:>10}{:>12}{:>14}{:>12}".format(
+            "stage", "wall (s)", "cpu (s)", "rows", "queries/s", "peak MB"))
+        for stage in stages:
+            print("\t{:<20}{:>10.3f}{:>10.3f}{:>12}{:>14.0f}{:>12.1f}".format(
+                stage["stage"], stage["seconds"], stage["cpu_seconds"], stage["rows"], stage["throughput"],
+                stage["peak_rss"] / 2 ** 20))
+        results.append({"lines": num_lines, "bytes": os.path.getsize(path), "skew": skew,
+                        "update_ratio": update_ratio, "chunksize": chunksize, "workers": workers,
+                        "stages": stages})
+
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def tune_indices(workload_csv, chunksize, workers, parse_cache, whatif, disk_budget, max_indices_per_table,
+                 checkpoint_path, apply, maintenance_work_mem, replay, half_life, window, verbose):
+    """
+    Recommend (and apply) the index actions for a workload, see generate_actions
+    @return: dictionary of the run metrics, i.e. every stage measured by measure_stage and the failed queries
+    """
+    if verbose:
+        start_time = time.time()
+    stages = []
+    measure = functools.partial(measure_stage, stages)
+    count = functools.partial(count_stage, stages)
+
+    # the log timestamps are only read for the recency weights and the phases
+    timestamp_col = K.TIMESTAMP_COLUMN if half_life > 0 or window > 0 else None
+    if checkpoint_path:
+        # online mode only reads the log lines appended since the last run
+        checkpoint = load_checkpoint(checkpoint_path, workload_csv)
+        chunks = tail_csv(workload_csv, checkpoint, chunksize=chunksize if chunksize > 0 else K.CSV_CHUNKSIZE,
+                          timestamp_col=timestamp_col)
+    # a non-positive chunksize reads the whole workload at once
+    elif chunksize > 0:
+        chunks = stream_csv(workload_csv, chunksize=chunksize, timestamp_col=timestamp_col)
+    else:
+        chunks = [filter_csv(workload_csv, timestamp_col=timestamp_col)]
+
+    num_queries, workload_info, templates, constants, sample, window_counts, last_timestamp = measure(
+        "read_workload", read_workload, chunks, K.REPLAY_QUERIES if replay > 0 else 0, half_life, window)
+    count(num_queries, num_queries)
+    num_run_queries = num_queries
+    # the number of queries, unless they are weighted by recency
+    workload_weight = templates[K.WEIGHT].sum().item()
+
+    metadata, extraction_paths = measure("parse_templates", parse_templates, templates, parse_cache, workers)
+    parsed_templates = templates[templates[K.QUERY].isin(metadata)]
+    failed_templates = templates[templates[K.QUERY].isin([q for q, parsed_q in metadata.items() if parsed_q is None])]
+    count(sum(extraction_paths.values()), int(parsed_templates[K.COUNT].sum()), int(failed_templates[K.COUNT].sum()))
+
+    conn, cur = establish_connection()
+    table_columns = measure("get_table_columns", get_table_columns, cur)
+    count(sum(map(len, table_columns.values())), 0)
+
+    counters, failures = measure("count_templates", count_templates, templates, metadata, constants,
+                                 table_columns)
+    count(len(templates), num_queries, sum(failures.values()))
+
+    if checkpoint_path:
+        # add up the counters of the log lines read by previous runs, aged since the last of them
+        decay = 1
+        if half_life > 0 and last_timestamp is not None and checkpoint["timestamp"] is not None:
+            decay = 2 ** (min(checkpoint["timestamp"] - last_timestamp, 0) / half_life)
+        num_queries += checkpoint["num_queries"]
+        workload_weight += checkpoint["workload_weight"] * decay
+        workload_info.update(checkpoint["workload_info"])
+        for name, counter in counters.items():
+            counter.update({k: v * decay for k, v in checkpoint["counters"].get(name, {}).items()})
+        checkpoint["num_queries"] = num_queries
+        checkpoint["workload_weight"] = workload_weight
+        checkpoint["workload_info"] = dict(workload_info)
+        checkpoint["counters"] = {name: dict(counter) for name, counter in counters.items()}
+        if last_timestamp is not None:
+            checkpoint["timestamp"] = last_timestamp
+
+    counter_simple = counters[K.SIMPLE].most_common()
+    counter_composite = counters[K.COMPOSITE].most_common()
+    update_target = counters[K.UPDATE].most_common()
+
+    candidate_indices_to_percent_usage, simple_to_composite_index = measure("find_candidates", find_candidates,
+                                                                            counters, workload_weight)
+    count(len(candidate_indices_to_percent_usage), num_queries)
+
+    if verbose:
         print("=" * 120)
         print("\n")
-        print("{: >50}".format("Dump statements..."))
-        print("{: >50}".format(description))
+        print("{:<50}".format("Following indices are recommended before analyzing update queries"))
         print("\n")
         print("-" * 120)
-        print("\t{:<30}{:<100}".format("Type", "Statement"))
-        print("-" * 120)
-        for type, statement in statements:
-            print("\t{:<30}{:<100}".format(type, statement))
+        for candidate_indices in candidate_indices_to_percent_usage:
+            print("{:<50}".format(candidate_indices))
         print("-" * 120)
 
-    def generate_drop_index_statements(candidate_indices):
+    measure("prune_candidates", prune_candidates, candidate_indices_to_percent_usage, simple_to_composite_index,
+            counters, workload_weight)
+    count(len(candidate_indices_to_percent_usage), num_queries)
+
+    phase_info = []
+    if window > 0:
         """
-        Generate drop index build_statements from a list of candidate indices.
-        Candidate indices should be the index name from the current database.
-        @param candidate_indices: a list of current indices
-        @return: a list of drop build_statements
+        Cut the log lines read by this run into phases of similar template mix, and find the candidates
+        of every phase on its own, every query weighing 1.
+        The candidates of every phase are the steady workload, the other ones only matter during some phases.
         """
-        statements = []
-        for index in candidate_indices:
-            statements.append("DROP INDEX IF EXISTS {}".format(index))
-        return statements
+        phases = measure("detect_phases", detect_phases, window_counts)
+        count(len(phases), num_run_queries)
+        phase_candidates = measure("find_phase_candidates", find_phase_candidates, phases, templates, metadata,
+                                   constants, table_columns)
+        count(sum(map(len, phase_candidates)), num_run_queries)
+        steady_candidates = set.intersection(*phase_candidates) if phase_candidates else set()
+        for (first, last, phase_counts), candidates in zip(phases, phase_candidates):
+            phase_info.append({
+                "start": str(pd.Timestamp(first * window, unit="s")),
+                "end": str(pd.Timestamp((last + 1) * window, unit="s")),
+                "queries": int(phase_counts.sum()),
+                "candidates": sorted(candidates),
+                "phase_only": sorted(candidates - steady_candidates),
+            })
+
+    current_indices, (table_rows, column_width), selectivity = measure(
+        "read_catalog", lambda: (get_current_indices(cur), get_table_sizes(cur), get_column_selectivity(cur)))
+    count(len(current_indices), 0)
+    column_order = order_index_columns(candidate_indices_to_percent_usage, counters[K.SIMPLE], counters[K.RANGE],
+                                       selectivity)
 
-    def generate_build_index_statements(candidate_indices):
+    if whatif > 0:
         """
-        Generate build index build_statements from a list of candidate indices.
-        Candidate indices should be in the following format:
+        Evaluate the remaining candidates against the planner.
+        Remove every candidate that does not reduce the estimated cost of the queries using it 
+        by at least the threshold (K.WHATIF_COST_REDUCTION_CUTOFF).
+        """
+        cost_reductions = measure("evaluate_candidates", evaluate_candidates,
+                                  list(candidate_indices_to_percent_usage), templates, metadata, current_indices,
+                                  column_order, whatif, table_columns)
+        count(len(cost_reductions), 0, sum(x is None for x in cost_reductions.values()))
+        for candidate_index, cost_reduction in cost_reductions.items():
+            if cost_reduction is not None and cost_reduction < K.WHATIF_COST_REDUCTION_CUTOFF:
+                del candidate_indices_to_percent_usage[candidate_index]
+                for simple_index in candidate_index.split("+"):
+                    simple_to_composite_index[simple_index].discard(candidate_index)
 
-            Single-column index:
-                table_name.column_name
+    include_columns = choose_include_columns(list(candidate_indices_to_percent_usage), counters[K.PROJECTION],
+                                             counters[K.UPDATE], workload_weight, column_width)
+    partial_predicates = choose_partial_predicates(list(candidate_indices_to_percent_usage),
+                                                   counters[K.COMPOSITE], counters[K.CONSTANTS])
 
-            Multi-column index (note that table_name should be the same):
-                table_name.column_name1+table_name.column_name2
+    """
+    Iterate over the partial candidate indices.
+    Remove the candidate index whose key columns are all compared with a single constant,
+    since nothing would be left of its key once the constant columns move to the predicate.
+    """
+    for candidate_index, predicates in list(partial_predicates.items()):
+        constant_columns = set(column for column, values in predicates if len(values) == 1)
+        if constant_columns.issuperset(candidate_index.split("+")):
+            del candidate_indices_to_percent_usage[candidate_index]
+            del partial_predicates[candidate_index]
+            for simple_index in candidate_index.split("+"):
+                simple_to_composite_index[simple_index].discard(candidate_index)
 
-        @param candidate_indices: a list of candidate indices
-        @return: a list of sql build_statements as strings
+    if disk_budget > 0 or max_indices_per_table > 0:
         """
-        statements = []
-        for candidate_index in candidate_indices:
-            simple_index_list = candidate_index.split("+")
-            table_referenced = None
-            columns_referenced = []
-            # iterate over each column inside of a multi-column index
-            for simple_index in simple_index_list:
-                table, column = simple_index.split(".")
-
-                # cannot build a multi-column index that spans across different tables
-                if table_referenced != table and table_referenced is not None:
-                    print("\t\t\nERROR: TRYING TO BUILD MULTI-COLUMN INDEX ACROSS DIFFERENT TABLES!")
-                    print("\t\tSELECTING ARBITRARILY!\n")
-                    break
-                table_referenced = table
-                columns_referenced.append(column)
-
-            # table has to be specified
-            if table_referenced is None:
-                print("\t\t\nERROR: TABLE IS NOT SPECIFIED, INDEX IS NOT BUILT!\n")
-            else:
-                index_name = "_".join(columns_referenced)
-                index_name = "_".join(("idx", table_referenced, index_name))
-                command = "CREATE INDEX IF NOT EXISTS {} ON {} USING btree ({})".format(index_name, table_referenced,
-                                                                                        ", ".join(columns_referenced))
-                statements.append(("Simple" if len(columns_referenced) == 1 else "Composite", command))
-        return statements
+        Choose the remaining candidates of highest value within the disk budget (given in MB)
+        and the maximum number of indices per table.
+        Remove every candidate that is not chosen.
+        """
+        write_costs = estimate_write_costs(list(candidate_indices_to_percent_usage), counters, workload_weight)
+        benefits = {}
+        for candidate_index, percent_usage in candidate_indices_to_percent_usage.items():
+            cost_reduction = cost_reductions.get(candidate_index) if whatif > 0 else None
+            benefits[candidate_index] = percent_usage * (1 if cost_reduction is None else cost_reduction)
+        chosen_indices, index_estimates = measure("select_indices", select_indices,
+                                                  list(candidate_indices_to_percent_usage), benefits, write_costs,
+                                                  table_rows, column_width, disk_budget * 1024 * 1024,
+                                                  max_indices_per_table, include_columns)
+        count(len(benefits), 0)
+        for candidate_index in list(candidate_indices_to_percent_usage):
+            if candidate_index not in chosen_indices:
+                del candidate_indices_to_percent_usage[candidate_index]
+                for simple_index in candidate_index.split("+"):
+                    simple_to_composite_index[simple_index].discard(candidate_index)
 
-    def generate_actions(workload_csv, verbose):
-        if verbose:
-            start_time = time.time()
+    """
+    Iterate over the plain (neither covering nor partial) candidate indices.
+    If a current index is on the same columns in the same order, keep it rather than building the candidate
+    under another name (the build statement is kept if the index already has that name).
+    """
+    existing_indices = collections.defaultdict(list)
+    for table_dot_column, index, _, _ in current_indices:
+        existing_indices[table_dot_column].append(index)
+    satisfied_indices = {}
+    for candidate_index in candidate_indices_to_percent_usage:
+        if candidate_index in include_columns or candidate_index in partial_predicates:
+            continue
+        indices = existing_indices.get(ordered_index(candidate_index, column_order), [])
+        _, statement = generate_build_index_statements([candidate_index], column_order)[0]
+        if indices and index_and_table(statement)[0] not in indices:
+            satisfied_indices[candidate_index] = indices[0]
 
-        all_queries = filter_csv(workload_csv)
-        num_queries = len(all_queries)
+    build_statements = generate_build_index_statements(
+        [c for c in candidate_indices_to_percent_usage if c not in satisfied_indices], column_order,
+        include_columns, partial_predicates)
+    recommended_indices = set(index_and_table(s)[0] for _, s in build_statements) | set(satisfied_indices.values())
 
-        _, queries_with_predicate = filter_queries(all_queries, K.WHERE)
+    indices_to_remove = []
 
-        counter_simple, counter_composite, _ = find_frequent_cols(queries_with_predicate)
-        candidate_indices_to_percent_usage = {}
-        simple_to_composite_index = collections.defaultdict(set)
+    """
+    Iterate over all current indices.
+    If current index is not part of the multi-column index, remove it.
+    If current index is on the same columns as a recommended index but is not that index
+    (e.g. its columns are in another order, or it includes other columns), remove it.
+    If current index is a covering or partial index generated by a previous run (K.GENERATED_INDEX_PATTERN)
+    that is not recommended anymore, remove it.
+    Note that if the current index is not one of the recommended indices but made up of one of the 
+    recommended indices, we keep it, unless it was never scanned and is larger than the threshold
+    (K.UNUSED_INDEX_SIZE_CUTOFF).
+    Indices on expressions and partial indices are only removed by the latter rule.
+    """
+    for table_dot_column, index, num_scans, size in current_indices:
+        if index in recommended_indices:
+            continue
+        if generated_index_pattern.match(index):
+            indices_to_remove.append(index)
+            continue
+        if table_dot_column is not None:
+            # candidate indices list their columns sorted
+            table_dot_column = "+".join(sorted(table_dot_column.split("+")))
+        if table_dot_column in candidate_indices_to_percent_usage:
+            indices_to_remove.append(index)
+            continue
+        if num_scans == 0 and size >= K.UNUSED_INDEX_SIZE_CUTOFF:
+            indices_to_remove.append(index)
+            continue
+        if table_dot_column is None:
+            continue
+        # if the index is multi-column, check using candidate_indices_to_percent_usage
+        if "+" in table_dot_column:
+            if table_dot_column not in candidate_indices_to_percent_usage:
+                indices_to_remove.append(index)
+        # if the index is single-column, check using simple_to_composite_index
+        else:
+            if table_dot_column not in simple_to_composite_index or len(
+                    simple_to_composite_index[table_dot_column]) == 0:
+                indices_to_remove.append(index)
 
-        """
-        Iterate over all referenced composite columns (can be simple) in the predicates.
-        Add the multi-column index to the candidate_indices_to_percent_usage along with the percent usage 
-        if the composite columns are referenced more than the threshold (K.REFERENCE_CUTOFF_LOW).
-        Add the record to simple_to_composite_index for all simple column index in the multi-column index.
-        """
-        for composite_index, occurance in counter_composite:
-            percent_usage = occurance / num_queries
-            if percent_usage >= K.REFERENCE_CUTOFF_LOW:
-                candidate_indices_to_percent_usage[composite_index] = percent_usage
-                for simple_index in composite_index.split("+"):
-                    simple_to_composite_index[simple_index].add(composite_index)
-            else:
-                break
+    drop_statements = generate_drop_index_statements(indices_to_remove)
 
-        """
-        Iterate over all referenced simple columns in the predicates.
-        Add the simple index to the candidate_indices_to_percent_usage along with the percent usage 
-        if the simple columns are referenced more than the threshold (K.SIMPLE_REFERENCE_CUT_OFF_HIGH) 
-        and if the simple column has not been added as part of the multi-column index.
-        Add the record to simple_to_composite_index.
-        """
-        for simple_index, occurance in counter_simple:
-            percent_usage = occurance / num_queries
-            if percent_usage >= K.SIMPLE_REFERENCE_CUT_OFF_HIGH:
-                if simple_index not in candidate_indices_to_percent_usage:
-                    candidate_indices_to_percent_usage[simple_index] = percent_usage
-                    simple_to_composite_index[simple_index].add(simple_index)
-            else:
-                break
+    if verbose:
+        print("=" * 120)
+        print("\n")
+        print("{:<50}".format("Following indices are recommended after analyzing update queries"))
+        print("\n")
+        print("-" * 120)
+        for candidate_indices in candidate_indices_to_percent_usage:
+            print("{:<50}".format(candidate_indices))
+        print("-" * 120)
 
-        if verbose:
-            print("=" * 120)
+    close_connection(conn, cur)
+
+    if verbose:
+        dump_workload_info(num_queries, len(templates), sum(extraction_paths.values()), workload_info)
+        print("\n")
+        dump_extractor_info(extraction_paths, benchmark_extractor(sorted(metadata)))
+        print("\n")
+        dump_predicate_info(counter_simple, "Select/Update simple candidate indices")
+        print("\n")
+        dump_predicate_info(counter_composite, "Select/Update composite candidate indices")
+        print("\n")
+        dump_predicate_info(counters[K.JOIN].most_common(), "Join candidate indices")
+        print("\n")
+        dump_predicate_info(update_target, "Update target")
+        print("\n")
+        dump_predicate_info(counters[K.INSERT].most_common(), "Insert target")
+        print("\n")
+        dump_predicate_info(counters[K.DELETE].most_common(), "Delete target")
+        print("\n")
+        dump_predicate_info(list(map(lambda x: (x[1], "{} scans, {} bytes".format(x[2], x[3])), current_indices)),
+                            "Current indices")
+        if window > 0:
             print("\n")
-            print("{:<50}".format("Following indices are recommended before analyzing update queries"))
+            dump_phase_info(phase_info)
+        if disk_budget > 0 or max_indices_per_table > 0:
             print("\n")
-            print("-" * 120)
-            for candidate_indices in candidate_indices_to_percent_usage:
-                print("{:<50}".format(candidate_indices))
-            print("-" * 120)
+            dump_selection_info(chosen_indices, index_estimates)
+        if whatif > 0:
+            print("\n")
+            dump_predicate_info(list(map(lambda x: (x[0], "n/a" if x[1] is None else "{:.3f}%".format(x[1] * 100)),
+                                         cost_reductions.items())), "Estimated cost reduction")
+        print("\n")
+        print_statements(build_statements, "build index statements")
+        print("\n")
+        print_statements(list(map(lambda x: ("DROP", x), drop_statements)), "drop index statements")
+        print("\n")
+        print("\t\t--- Program exists properly, total time spent: %s seconds ---" % (time.time() - start_time))
+
+    metrics = {
+        "workload_csv": workload_csv,
+        "num_queries": num_queries,
+        "num_run_queries": num_run_queries,
+        "num_templates": len(templates),
+        "extraction_paths": dict(extraction_paths),
+        "failed_queries": dict(failures),
+        "phases": phase_info,
+        "stages": stages,
+    }
+
+    if checkpoint_path:
+        # actions.sql is only regenerated when the recommendation changes
+        actions = [s for _, s in build_statements] + drop_statements
+        actions_changed = actions != checkpoint["actions"]
+        checkpoint["actions"] = actions
+        save_checkpoint(checkpoint_path, checkpoint)
+        if not actions_changed and os.path.exists("actions.sql"):
+            if verbose:
+                print("\t\t--- Recommended indices did not change, actions.sql is kept ---")
+            return metrics
 
-        _, update_queries = filter_queries(all_queries, K.UPDATE)
-        update_target, _ = find_update_target(update_queries)
+    with open("actions.sql", "w+") as f:
+        for _, s in build_statements:
+            f.write(s)
+            f.write(";")
+            f.write("\n")
 
+        for s in drop_statements:
+            f.write(s)
+            f.write(";")
+            f.write("\n")
+
+    if replay > 0:
         """
-        Iterate over all update columns.
-        Remove all multi-column (single column included) indexes 
-        if one of the single column update happens more than the threshold (K.UPDATE_CUTOFF)
+        Replay a sample of the workload before the statements are applied, see K.REPLAY_QUERIES.
         """
-        for update_column, occurance in update_target:
-            percent_usage = occurance / num_queries
-            if percent_usage >= K.UPDATE_CUTOFF:
-                if update_column in simple_to_composite_index:
-                    for composite_index in simple_to_composite_index[update_column]:
-                        if candidate_indices_to_percent_usage[composite_index] <= K.COMPOSITE_REFERENCE_CUTOFF_HIGH:
-                            del candidate_indices_to_percent_usage[composite_index]
-                            simple_to_composite_index[update_column].remove(composite_index)
-
-        conn, cur = establish_connection()
-        current_indices = get_unique_index(cur)
-        indices_to_remove = []
+        latencies_before, elapsed_before = measure("replay_workload (before)", replay_workload, sample, replay)
+        count(len(latencies_before), len(latencies_before), sum(x is None for _, x in latencies_before))
 
+    if apply > 0 or replay > 0:
         """
-        Iterate over all current indices.
-        If current index is not part of the multi-column index, remove it.
-        Note that if the current index is not one of the recommended indices but made up of one of the 
-        recommended indices, we keep it. 
+        Run the statements on the DB without blocking writes, builds on different tables in parallel.
         """
-        for table_dot_column, index in current_indices:
-            # if the index is multi-column, check using candidate_indices_to_percent_usage
-            if "+" in table_dot_column:
-                if table_dot_column not in candidate_indices_to_percent_usage:
-                    indices_to_remove.append(index)
-            # if the index is single-column, check using simple_to_composite_index
-            else:
-                if table_dot_column not in simple_to_composite_index or len(
-                        simple_to_composite_index[table_dot_column]) == 0:
-                    indices_to_remove.append(index)
+        results = measure("apply_actions", apply_actions, build_statements, drop_statements, max(apply, 1),
+                          maintenance_work_mem)
+        count(len(results), len(results), sum(error is not None for _, error in results))
+        print_statements(list(map(lambda x: ("OK" if x[1] is None else "FAILED", x[0]), results)),
+                         "applied statements")
+        for statement, error in results:
+            if error is not None:
+                print("\t\tERROR: {}\n\t\t{}".format(statement, error))
+        if any(error is not None for _, error in results):
+            print("\t\tDROP INDEX STATEMENTS ARE SKIPPED, SINCE A BUILD FAILED!")
 
-        drop_statements = generate_drop_index_statements(indices_to_remove)
-
-        if verbose:
-            print("=" * 120)
-            print("\n")
-            print("{:<50}".format("Following indices are recommended after analyzing update queries"))
-            print("\n")
-            print("-" * 120)
-            for candidate_indices in candidate_indices_to_percent_usage:
-                print("{:<50}".format(candidate_indices))
-            print("-" * 120)
+    if replay > 0:
+        """
+        Replay the same sample after the statements are applied.
+        Flag the built indices the plans of the templates that got slower use.
+        """
+        latencies_after, elapsed_after = measure("replay_workload (after)", replay_workload, sample, replay)
+        count(len(latencies_after), len(latencies_after), sum(x is None for _, x in latencies_after))
+        summary_before = summarize_replay(latencies_before, elapsed_before)
+        summary_after = summarize_replay(latencies_after, elapsed_after)
+        regressions = find_regressions(latencies_before, latencies_after, build_statements)
+        dump_replay_info(summary_before, summary_after, regressions)
+        with open(K.REPLAY_PATH, "w") as f:
+            json.dump({
+                "clients": replay,
+                "queries": len(sample),
+                "before": summary_before,
+                "after": summary_after,
+                "regressions": regressions,
+            }, f, indent=4)
+    return metrics
 
-        build_statements = generate_build_index_statements(list(candidate_indices_to_percent_usage.keys()))
 
-        close_connection(conn, cur)
+def generate_actions(workload_csv, chunksize, workers, parse_cache, whatif, disk_budget, max_indices_per_table,
+                     online, interval, apply, maintenance_work_mem, replay, half_life, window, profile, verbose):
+    def run(checkpoint_path):
+        """
+        Run tune_indices once, and write its metrics (and profile) next to actions.sql, see K.METRICS_PATH
+        @param checkpoint_path: checkpoint path of the online mode, None otherwise
+        @return: nothing
+        """
+        profiler = cProfile.Profile() if profile > 0 else None
+        if profiler is not None:
+            profiler.enable()
+        start_time, start_cpu = time.perf_counter(), time.process_time()
+        metrics = tune_indices(workload_csv, chunksize, workers, parse_cache, whatif, disk_budget,
+                               max_indices_per_table, checkpoint_path, apply, maintenance_work_mem, replay,
+                               half_life, window, verbose)
+        metrics["seconds"] = time.perf_counter() - start_time
+        metrics["cpu_seconds"] = time.process_time() - start_cpu
+        metrics["peak_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(K.PROFILE_PATH)
+        with open(K.METRICS_PATH, "w") as f:
+            json.dump(metrics, f, indent=4)
 
-        if verbose:
-            dump_workload_info(all_queries)
-            print("\n")
-            dump_predicate_info(counter_simple, "Select/Update simple candidate indices")
-            print("\n")
-            dump_predicate_info(counter_composite, "Select/Update composite candidate indices")
-            print("\n")
-            dump_predicate_info(update_target, "Update target")
-            print("\n")
-            print_statements(build_statements, "build index statements")
-            print("\n")
-            print_statements(list(map(lambda x: ("DROP", x), drop_statements)), "drop index statements")
-            print("\n")
-            print("\t\t--- Program exists properly, total time spent: %s seconds ---" % (time.time() - start_time))
+    if not online:
+        run(None)
+        return
 
-        with open("actions.sql", "w+") as f:
-            for _, s in build_statements:
-                f.write(s)
-                f.write(";")
-                f.write("\n")
+    # keep tailing the query log if an interval is given
+    while True:
+        run(online)
+        if interval <= 0:
+            break
+        time.sleep(interval)
 
-            for s in drop_statements:
-                f.write(s)
-                f.write(";")
-                f.write("\n")
 
+def task_project1():
     return {
         # A list of actions. This can be bash or Python callables.
         "actions": [
@@ -475,6 +2996,115 @@ def task_project1():
                 'default': '1m'
             },
 
+            {
+                'name': 'chunksize',
+                'long': 'chunksize',
+                'short': 'c',
+                'type': int,
+                'default': K.CSV_CHUNKSIZE
+            },
+
+            {
+                'name': 'workers',
+                'long': 'workers',
+                'short': 'j',
+                'type': int,
+                'default': 1
+            },
+
+            {
+                'name': 'parse_cache',
+                'long': 'parse_cache',
+                'short': 'p',
+                'default': K.PARSE_CACHE_PATH
+            },
+
+            {
+                'name': 'whatif',
+                'long': 'whatif',
+                'short': 'e',
+                'type': int,
+                'default': 0
+            },
+
+            {
+                'name': 'disk_budget',
+                'long': 'disk_budget',
+                'short': 'b',
+                'type': int,
+                'default': 0
+            },
+
+            {
+                'name': 'max_indices_per_table',
+                'long': 'max_indices_per_table',
+                'short': 'm',
+                'type': int,
+                'default': 0
+            },
+
+            {
+                'name': 'online',
+                'long': 'online',
+                'short': 'o',
+                'default': ''
+            },
+
+            {
+                'name': 'interval',
+                'long': 'interval',
+                'short': 'i',
+                'type': int,
+                'default': 0
+            },
+
+            {
+                'name': 'apply',
+                'long': 'apply',
+                'short': 'a',
+                'type': int,
+                'default': 0
+            },
+
+            {
+                'name': 'maintenance_work_mem',
+                'long': 'maintenance_work_mem',
+                'short': 'k',
+                'default': K.APPLY_MAINTENANCE_WORK_MEM
+            },
+
+            {
+                'name': 'replay',
+                'long': 'replay',
+                'short': 'r',
+                'type': int,
+                'default': 0
+            },
+
+            {
+                'name': 'half_life',
+                'long': 'half_life',
+                'short': 'l',
+                'type': int,
+                'default': 0
+            },
+
+            {
+                'name': 'window',
+                'long': 'window',
+                'short': 'n',
+                'type': int,
+                'default': 0
+            },
+
+            {
+                'name': 'profile',
+                'long': 'profile',
+                'short': 'f',
+                'type': int,
+                'default': 0
+            },
+
             {
                 'name': 'verbose',
                 'long': 'verbose',
@@ -487,3 +3117,70 @@ def task_project1():
         "uptodate": [False],
         'verbosity': 2,
     }
+
+
+def task_project1_benchmark():
+    return {
+        # A list of actions. This can be bash or Python callables.
+        "actions": [
+            run_benchmark
+        ],
+        'params': [
+            {
+                'name': 'lines',
+                'long': 'lines',
+                'short': 'n',
+                'default': K.BENCHMARK_LINES
+            },
+
+            {
+                'name': 'skew',
+                'long': 'skew',
+                'short': 's',
+                'type': float,
+                'default': K.BENCHMARK_SKEW
+            },
+
+            {
+                'name': 'update_ratio',
+                'long': 'update_ratio',
+                'short': 'u',
+                'type': float,
+                'default': K.BENCHMARK_UPDATE_RATIO
+            },
+
+            {
+                'name': 'chunksize',
+                'long': 'chunksize',
+                'short': 'c',
+                'type': int,
+                'default': K.CSV_CHUNKSIZE
+            },
+
+            {
+                'name': 'workers',
+                'long': 'workers',
+                'short': 'j',
+                'type': int,
+                'default': 1
+            },
+
+            {
+                'name': 'output',
+                'long': 'output',
+                'short': 'o',
+                'default': K.BENCHMARK_PATH
+            },
+
+            {
+                'name': 'directory',
+                'long': 'directory',
+                'short': 'd',
+                'default': K.BENCHMARK_DIRECTORY
+            }
+
+        ],
+        # Always rerun this task.
+        "uptodate": [False],
+        'verbosity': 2,
+    }
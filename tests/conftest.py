@@ -0,0 +1,84 @@
+import os
+import sys
+
+import pytest
+
+# dodo.py and constants.py live at the root of the repository, next to this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dodo  # noqa: E402
+
+
+class FakeCursor:
+    """
+    Cursor answering every statement with the rows of the first catalog entry found in it, none otherwise
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.rows = []
+        self.statements = []
+
+    def execute(self, query, *args):
+        self.statements.append(query)
+        self.rows = next((rows for key, rows in self.catalog.items() if key in query), [])
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def fetchall(self):
+        return list(self.rows)
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self.autocommit = False
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_db(monkeypatch, tmp_path):
+    """
+    Run in a temporary directory against a fake DB, see FakeCursor.
+    The catalog dictionary (k: part of a statement, v: rows) can be filled by the test.
+    """
+    monkeypatch.chdir(tmp_path)
+    catalog = {}
+    cursor = FakeCursor(catalog)
+    monkeypatch.setattr(dodo, "establish_connection", lambda *args, **kwargs: (FakeConnection(cursor), cursor))
+    return catalog
+
+
+def append_log(path, queries, start=0, seconds=1):
+    """
+    Append queries to a query log in the csvlog layout filter_csv expects, one log line every seconds
+    """
+    with open(path, "a") as f:
+        for i, query in enumerate(queries, start):
+            timestamp = "2022-02-01 {:02d}:{:02d}:{:02d}.000 EST".format(
+                10 + i * seconds // 3600, i * seconds // 60 % 60, i * seconds % 60)
+            f.write('{0},u,d,1,[local],s,{1},idle,{0},3/{1},0,LOG,00000,"statement: {2}",,,,,,,,,\n'.format(
+                timestamp, i, query.replace('"', '""')))
+
+
+@pytest.fixture
+def write_log():
+    return append_log
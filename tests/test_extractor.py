@@ -0,0 +1,130 @@
+import pytest
+
+import constants as K
+import dodo
+
+"""
+Shapes the fast extractor handles, it must extract exactly what sql_metadata does
+"""
+FAST_QUERIES = [
+    # plain
+    "SELECT * FROM useracct WHERE u_id = 1",
+    "SELECT * FROM useracct",
+    "SELECT DISTINCT name FROM useracct WHERE u_id = 1",
+    # aliases
+    "SELECT name, email FROM useracct AS u WHERE u.u_id = 1",
+    "SELECT u.name FROM useracct u WHERE u.u_id = 1 AND u.email = 'a'",
+    "SELECT useracct.name FROM useracct WHERE useracct.u_id = 1",
+    # quoted names and literals
+    'SELECT "name" FROM "useracct" WHERE "u_id" = 1',
+    "SELECT * FROM useracct WHERE name = 'it''s' AND u_id = 1",
+    # IN / BETWEEN
+    "SELECT * FROM item WHERE i_id IN (1, 2, 3)",
+    "SELECT * FROM review WHERE rating BETWEEN 1 AND 5 AND i_id = 2",
+    "SELECT * FROM review WHERE i_id NOT IN (1, 2) AND rating >= 3",
+    # ORDER BY / GROUP BY / LIMIT
+    "SELECT * FROM review WHERE i_id = 1 ORDER BY rating DESC LIMIT 10",
+    "SELECT u_id, count(*) FROM review WHERE i_id = 1 GROUP BY u_id",
+    "SELECT * FROM review WHERE i_id = 1 ORDER BY rating, creation_date LIMIT 10 OFFSET 20",
+    # FOR UPDATE
+    "SELECT * FROM useracct WHERE u_id = 1 FOR UPDATE",
+    # OR / NOT
+    "SELECT * FROM review WHERE rating > 3 OR i_id = 1",
+    "SELECT * FROM review WHERE NOT (rating > 3)",
+    # writes
+    "UPDATE useracct SET name = 'x', email = 'y' WHERE u_id = 1",
+    "UPDATE item SET title = 'x' WHERE i_id = 1 AND title = 'y'",
+    "DELETE FROM review WHERE a_id = 1",
+    "INSERT INTO trust (source_u_id, target_u_id) VALUES (1, 2)",
+    "INSERT INTO trust VALUES (1, 2)",
+]
+
+"""
+Shapes left to sql_metadata
+"""
+FALLBACK_QUERIES = [
+    # joins
+    "SELECT * FROM review r, useracct u WHERE r.u_id = u.u_id AND u.u_id = 1",
+    "SELECT avg(rating) FROM review r JOIN useracct u ON r.u_id = u.u_id WHERE u.name = 'a'",
+    # subqueries
+    "SELECT * FROM review WHERE i_id IN (SELECT i_id FROM item WHERE title = 'a')",
+    # functions and casts in the predicate
+    "SELECT * FROM review WHERE lower(title) = 'a'",
+    "SELECT * FROM review WHERE creation_date > DATE '2022-01-01'",
+    # column of another table
+    "SELECT * FROM review WHERE item.i_id = 1",
+    # INSERT ... SELECT
+    "INSERT INTO trust SELECT * FROM trust WHERE source_u_id = 1",
+]
+
+
+@pytest.mark.parametrize("query", FAST_QUERIES)
+def test_fast_extractor_agrees_with_parser(query):
+    fast = dodo.fast_extract_metadata(query)
+    assert fast is not None
+    assert fast == dodo.parser_extract_metadata(query)
+
+
+@pytest.mark.parametrize("query", FALLBACK_QUERIES)
+def test_fast_extractor_falls_back(query):
+    assert dodo.fast_extract_metadata(query) is None
+    metadata, path = dodo.extract_metadata(query)
+    assert path == K.PARSER_PATH
+    assert metadata is not None
+
+
+@pytest.mark.parametrize("query, where, update, projection", [
+    ("SELECT name, email FROM useracct AS u WHERE u.u_id = 1", ["useracct.u_id"], None, ["name", "email"]),
+    ('SELECT "name" FROM "useracct" WHERE "u_id" = 1', ["u_id"], None, ["name"]),
+    ("SELECT * FROM review WHERE i_id = 1 ORDER BY rating DESC LIMIT 10", ["i_id"], None, ["*", "rating"]),
+    ("SELECT u_id, count(*) FROM review WHERE i_id = 1 GROUP BY u_id", ["i_id"], None, ["u_id"]),
+    ("UPDATE useracct SET name = 'x', email = 'y' WHERE u_id = 1", ["u_id"], ["name", "email"], None),
+    ("INSERT INTO trust (source_u_id, target_u_id) VALUES (1, 2)", None, None, None),
+])
+def test_fast_extractor(query, where, update, projection):
+    metadata = dodo.fast_extract_metadata(query)
+    assert metadata[K.WHERE] == where
+    assert metadata[K.UPDATE] == update
+    assert metadata[K.PROJECTION] == projection
+    assert metadata[K.JOIN] is None
+
+
+@pytest.mark.parametrize("query, where, join", [
+    # a join-only WHERE has no filtered column, but still a WHERE entry
+    ("SELECT * FROM review r, useracct u WHERE r.u_id = u.u_id", [], ["review.u_id", "useracct.u_id"]),
+    # the join column is filtered on as well
+    ("SELECT * FROM review r, useracct u WHERE r.u_id = u.u_id AND r.u_id = 5", ["review.u_id"],
+     ["review.u_id", "useracct.u_id"]),
+    ("SELECT * FROM review r JOIN useracct u ON r.u_id = u.u_id WHERE u.name = 'a'", ["useracct.name"],
+     ["review.u_id", "useracct.u_id"]),
+])
+def test_parser_join_predicates(query, where, join):
+    metadata = dodo.parser_extract_metadata(query)
+    assert metadata[K.WHERE] == where
+    assert metadata[K.JOIN] == join
+
+
+@pytest.mark.parametrize("query, range_columns", [
+    ("SELECT * FROM review WHERE rating BETWEEN 1 AND 5 AND i_id = 2", ["rating"]),
+    ("SELECT * FROM review WHERE rating >= 3 AND i_id = 2", ["rating"]),
+    ("SELECT * FROM review WHERE i_id = 2", []),
+])
+def test_range_predicates(query, range_columns):
+    metadata, path = dodo.extract_metadata(query)
+    assert path == K.FAST_PATH
+    assert metadata[K.RANGE] == range_columns
+
+
+def test_tokenize_query():
+    assert dodo.tokenize_query('SELECT "a" FROM t WHERE b = \'x\';') == [
+        ("name", "SELECT"), ("quoted", "a"), ("name", "FROM"), ("name", "t"), ("name", "WHERE"), ("name", "b"),
+        ("symbol", "="), ("literal", "'x'")]
+
+
+def test_parallel_extract_metadata():
+    queries = FAST_QUERIES + FALLBACK_QUERIES
+    pool = dodo.create_worker_pool(2)
+    try:
+        assert dodo.parallel_extract_metadata(pool, 2, queries) == dodo.extract_all_metadata(queries)
+    finally:
+        pool.shutdown()
@@ -0,0 +1,79 @@
+import os
+
+import constants as K
+import dodo
+
+
+def read_tail(path, checkpoint, chunksize=K.CSV_CHUNKSIZE):
+    return [q for chunk in dodo.tail_csv(path, checkpoint, chunksize=chunksize) for q in chunk[K.QUERY]]
+
+
+def test_tail_csv(tmp_path, write_log):
+    path = str(tmp_path / "workload.csv")
+    write_log(path, ["SELECT 1", "SELECT 2", "SELECT 3"])
+    checkpoint = dodo.load_checkpoint(str(tmp_path / "checkpoint.json"), path)
+    assert read_tail(path, checkpoint, chunksize=2) == ["SELECT 1", "SELECT 2", "SELECT 3"]
+    assert checkpoint["offset"] == os.path.getsize(path)
+
+    # only the appended lines are read
+    write_log(path, ["SELECT 4"], start=3)
+    assert read_tail(path, checkpoint) == ["SELECT 4"]
+    assert read_tail(path, checkpoint) == []
+
+
+def test_tail_csv_incomplete_record(tmp_path, write_log):
+    path = str(tmp_path / "workload.csv")
+    write_log(path, ["SELECT 1"])
+    size = os.path.getsize(path)
+    # a record still being written, without its trailing newline
+    with open(path, "a") as f:
+        f.write("2022-02-01 10:00:01.000 EST,u,d,1,[local],s,1,idle,")
+    checkpoint = dodo.load_checkpoint(str(tmp_path / "checkpoint.json"), path)
+    assert read_tail(path, checkpoint) == ["SELECT 1"]
+    assert checkpoint["offset"] == size
+
+    # a record whose quoted query spans several lines, the last one of which is not written yet
+    with open(path, "a") as f:
+        f.write('2022-02-01 10:00:01.000 EST,3/1,0,LOG,00000,"statement: SELECT *\nFROM item\n')
+    assert read_tail(path, checkpoint) == []
+    assert checkpoint["offset"] == size
+    with open(path, "a") as f:
+        f.write('WHERE i_id = 1",,,,,,,,,\n')
+    assert read_tail(path, checkpoint) == ["SELECT *\nFROM item\nWHERE i_id = 1"]
+    assert checkpoint["offset"] == os.path.getsize(path)
+
+
+def test_checkpoint(tmp_path, write_log):
+    path = str(tmp_path / "workload.csv")
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    write_log(path, ["SELECT 1", "SELECT 2"])
+    checkpoint = dodo.load_checkpoint(checkpoint_path, path)
+    assert checkpoint["offset"] == 0
+    read_tail(path, checkpoint)
+    checkpoint["num_queries"] = 2
+    dodo.save_checkpoint(checkpoint_path, checkpoint)
+    assert dodo.load_checkpoint(checkpoint_path, path) == checkpoint
+    assert not os.path.exists(checkpoint_path + ".tmp")
+
+    # another log starts over
+    other_path = str(tmp_path / "other.csv")
+    write_log(other_path, ["SELECT 1", "SELECT 2"])
+    assert dodo.load_checkpoint(checkpoint_path, other_path)["offset"] == 0
+
+    # so does a rotated log, shorter than the offset already read
+    os.remove(path)
+    write_log(path, ["SELECT 1"])
+    checkpoint = dodo.load_checkpoint(checkpoint_path, path)
+    assert checkpoint["offset"] == 0
+    assert checkpoint["num_queries"] == 0
+
+
+def test_tail_csv_without_statements(tmp_path, write_log):
+    path = str(tmp_path / "workload.csv")
+    with open(path, "w") as f:
+        f.write("2022-02-01 10:00:00.000 EST,u,d,1,[local],s,0,idle,2022-02-01 10:00:00.000 EST,3/0,0,LOG,00000,"
+                "connection authorized: user=u database=d,,,,,,,,,\n")
+    checkpoint = dodo.load_checkpoint(str(tmp_path / "checkpoint.json"), path)
+    assert read_tail(path, checkpoint) == []
+    write_log(path, ["SELECT 1"], start=1)
+    assert read_tail(path, checkpoint) == ["SELECT 1"]
@@ -0,0 +1,67 @@
+import itertools
+
+import pandas as pd
+
+import constants as K
+import dodo
+
+
+def test_parse_cache_disabled():
+    cache = dodo.open_parse_cache("")
+    assert cache is None
+    dodo.store_parse_cache(cache, {"SELECT 1": None})
+    assert dodo.load_parse_cache(cache, ["SELECT 1"]) == {}
+
+
+def test_parse_cache_round_trip(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    template = "SELECT * FROM review WHERE i_id = 0"
+    metadata = {template: dodo.extract_metadata(template)[0], "SELECT * FROM": None}
+    cache = dodo.open_parse_cache(path)
+    dodo.store_parse_cache(cache, metadata)
+    cache.close()
+
+    cache = dodo.open_parse_cache(path)
+    assert dodo.load_parse_cache(cache, list(metadata) + ["SELECT 1"]) == metadata
+    cache.close()
+
+
+def test_parse_cache_version(tmp_path, monkeypatch):
+    path = str(tmp_path / "cache.sqlite")
+    cache = dodo.open_parse_cache(path)
+    dodo.store_parse_cache(cache, {"SELECT 1": None})
+    cache.close()
+
+    # entries of another sql_metadata version or cache format are discarded
+    monkeypatch.setattr(dodo, "parse_cache_version", "other")
+    cache = dodo.open_parse_cache(path)
+    assert dodo.load_parse_cache(cache, ["SELECT 1"]) == {}
+    cache.close()
+
+
+def test_parse_cache_eviction(tmp_path, monkeypatch):
+    clock = itertools.count()
+    monkeypatch.setattr(dodo.time, "time", lambda: next(clock))
+    cache = dodo.open_parse_cache(str(tmp_path / "cache.sqlite"))
+    dodo.store_parse_cache(cache, {"a": None}, size=2)
+    dodo.store_parse_cache(cache, {"b": None}, size=2)
+    # a is used again, so b is the least recently used one
+    assert dodo.load_parse_cache(cache, ["a"]) == {"a": None}
+    dodo.store_parse_cache(cache, {"c": None}, size=2)
+    assert dodo.load_parse_cache(cache, ["a", "b", "c"]) == {"a": None, "c": None}
+    cache.close()
+
+
+def test_parse_templates_cached(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    all_queries = dodo.classify_queries(pd.Series(["statement: SELECT * FROM review WHERE i_id = 1",
+                                                   "statement: SELECT * FROM item"]))
+    templates = dodo.fingerprint_queries(all_queries)
+    metadata, extraction_paths = dodo.parse_templates(templates, path, 1)
+    # a select without predicate is not parsed
+    assert list(metadata) == ["SELECT * FROM review WHERE i_id = 0"]
+    assert extraction_paths == {K.FAST_PATH: 1}
+
+    cached_metadata, extraction_paths = dodo.parse_templates(templates, path, 1)
+    assert cached_metadata == metadata
+    assert extraction_paths == {}
@@ -0,0 +1,85 @@
+import pandas as pd
+import pytest
+
+import constants as K
+import dodo
+
+
+def classify(queries, seconds):
+    timestamps = pd.Series([str(pd.Timestamp("2022-02-01 10:00:00") + pd.Timedelta(seconds=s)) + " EST"
+                            for s in seconds])
+    return dodo.classify_queries(pd.Series(["statement: " + q for q in queries]), timestamps)
+
+
+def test_read_workload_half_life():
+    queries = ["SELECT * FROM t WHERE a = 1", "SELECT * FROM t WHERE a = 2",
+               "SELECT * FROM t WHERE b = 1", "SELECT * FROM t WHERE b = 2"]
+    seconds = [0, 0, 60, 60]
+    _, _, templates, _, _, _, last_timestamp = dodo.read_workload([classify(queries, seconds)], half_life=60)
+    weights = dict(zip(templates[K.QUERY], templates[K.WEIGHT]))
+    # the queries a half-life older than the last one weigh half
+    assert weights == {"SELECT * FROM t WHERE a = 0": pytest.approx(1), "SELECT * FROM t WHERE b = 0": pytest.approx(2)}
+    assert templates[K.COUNT].tolist() == [2, 2]
+    assert last_timestamp == (pd.Timestamp("2022-02-01 10:01:00") - pd.Timestamp(0)).total_seconds()
+
+    # the weights of the previous chunks are aged as later chunks are read
+    _, _, chunked_templates, _, _, _, _ = dodo.read_workload(
+        [classify(queries[:2], seconds[:2]), classify(queries[2:], seconds[2:])], half_life=60)
+    pd.testing.assert_frame_equal(chunked_templates, templates)
+
+
+def test_read_workload_half_life_constants():
+    queries = ["SELECT * FROM t WHERE s = 'old' AND a = 1", "SELECT * FROM t WHERE s = 'new' AND a = 2"]
+    chunks = [classify(queries[:1], [0]), classify(queries[1:], [120])]
+    _, _, _, constants, _, _, _ = dodo.read_workload(chunks, half_life=60)
+    assert constants[("SELECT * FROM t WHERE s = '?' AND a = 0", "s")] == {"'old'": pytest.approx(0.25),
+                                                                           "'new'": pytest.approx(1)}
+
+
+def test_read_workload_without_half_life():
+    queries = ["SELECT * FROM t WHERE a = 1", "SELECT * FROM t WHERE a = 2"]
+    _, _, templates, _, _, window_counts, _ = dodo.read_workload([classify(queries, [0, 3600])])
+    assert templates[K.WEIGHT].tolist() == [2]
+    assert window_counts is None
+
+
+def test_read_workload_windows():
+    queries = ["SELECT * FROM t WHERE a = 1", "SELECT * FROM t WHERE a = 2", "SELECT * FROM t WHERE b = 1"]
+    _, _, _, _, _, window_counts, _ = dodo.read_workload([classify(queries, [0, 30, 90])], window=60)
+    counts = window_counts.unstack(fill_value=0)
+    assert counts.to_numpy().sum() == 3
+    assert counts.max(axis=1).tolist() == [2, 1]
+
+
+def window_counts(windows):
+    return pd.Series({(window, template): count for window, template_counts in enumerate(windows)
+                      for template, count in template_counts.items()}).rename_axis(["window", K.QUERY])
+
+
+def test_detect_phases():
+    n = K.PHASE_MIN_QUERIES
+    phases = dodo.detect_phases(window_counts([
+        {"a": n, "b": n // 10}, {"a": n}, {"b": n}, {"b": n, "a": n // 10},
+        # too few queries to start a phase
+        {"a": n // 10}]))
+    assert [(first, last) for first, last, _ in phases] == [(0, 1), (2, 4)]
+    assert phases[0][2].to_dict() == {"a": 2 * n, "b": n // 10}
+    assert phases[1][2].to_dict() == {"a": 2 * (n // 10), "b": 2 * n}
+
+
+def test_detect_phases_steady():
+    n = K.PHASE_MIN_QUERIES
+    phases = dodo.detect_phases(window_counts([{"a": n, "b": n}, {"a": n, "b": n // 2}]))
+    assert [(first, last) for first, last, _ in phases] == [(0, 1)]
+    assert dodo.detect_phases(None) == []
+
+
+def test_find_phase_candidates():
+    n = K.PHASE_MIN_QUERIES
+    queries = ["SELECT * FROM t WHERE a = 1", "SELECT * FROM t WHERE b = 1"]
+    all_queries = classify(queries, [0, 0])
+    templates = dodo.fingerprint_queries(all_queries)
+    metadata, _ = dodo.extract_all_metadata(templates[K.QUERY].tolist())
+    a, b = templates[K.QUERY]
+    phases = dodo.detect_phases(window_counts([{a: n}, {b: n}]))
+    assert dodo.find_phase_candidates(phases, templates, metadata, {}) == [{"t.a"}, {"t.b"}]
@@ -0,0 +1,94 @@
+import collections
+
+import pytest
+
+import constants as K
+import dodo
+
+
+def write_counters(inserts=0, deletes=0, update_sets=None):
+    return {
+        K.INSERT: collections.Counter({"t": inserts}),
+        K.DELETE: collections.Counter({"t": deletes}),
+        K.UPDATE_SETS: collections.Counter(update_sets or {}),
+    }
+
+
+def test_estimate_write_costs():
+    # updates of t.c are HOT, updates of t.a are not and maintain both indices
+    counters = write_counters(inserts=4, deletes=10, update_sets={"t.c": 5, "t.a": 2})
+    write_costs = dodo.estimate_write_costs(["t.a", "t.b"], counters, 100)
+    inserts_and_deletes = K.INSERT_COST_WEIGHT * 4 + K.DELETE_COST_WEIGHT * 10
+    # without t.a, the updates of t.a would be HOT, so t.a is charged for maintaining t.b as well
+    assert write_costs["t.a"] == pytest.approx((inserts_and_deletes + K.UPDATE_COST_WEIGHT * (2 + 2)) / 100)
+    assert write_costs["t.b"] == pytest.approx((inserts_and_deletes + K.UPDATE_COST_WEIGHT * 2) / 100)
+
+
+def test_estimate_write_costs_shared_column():
+    # t.a is in both candidates, dropping either does not make the updates of t.a HOT
+    counters = write_counters(update_sets={"t.a": 10})
+    write_costs = dodo.estimate_write_costs(["t.a", "t.a+t.b"], counters, 100)
+    assert write_costs == {"t.a": pytest.approx(0.1), "t.a+t.b": pytest.approx(0.1)}
+
+
+def test_prune_candidates():
+    candidate_indices_to_percent_usage = {"t.a": 0.05, "t.b": 0.5}
+    simple_to_composite_index = {"t.a": {"t.a"}, "t.b": {"t.b"}}
+    counters = write_counters(inserts=4, deletes=10, update_sets={"t.a": 2})
+    dodo.prune_candidates(candidate_indices_to_percent_usage, simple_to_composite_index, counters, 100)
+    assert candidate_indices_to_percent_usage == {"t.b": 0.5}
+    assert simple_to_composite_index == {"t.a": set(), "t.b": {"t.b"}}
+
+
+def test_prune_candidates_write_only():
+    candidate_indices_to_percent_usage = {"t.a": 0.01}
+    simple_to_composite_index = {"t.a": {"t.a"}}
+    dodo.prune_candidates(candidate_indices_to_percent_usage, simple_to_composite_index,
+                          write_counters(inserts=100), 100)
+    assert candidate_indices_to_percent_usage == {}
+
+
+TABLE_ROWS = {"t": 1000, "u": 1000}
+COLUMN_WIDTH = {"t.a": 4, "t.b": 4, "t.c": 100, "u.a": 4}
+
+
+def index_size(*columns):
+    return 1000 * (sum(COLUMN_WIDTH[column] for column in columns) + K.INDEX_TUPLE_OVERHEAD) / K.INDEX_FILL_FACTOR
+
+
+def select(benefits, disk_budget=0, max_indices_per_table=0, write_costs=None, include_columns=None):
+    candidates = list(benefits)
+    write_costs = write_costs or dict.fromkeys(candidates, 0)
+    return dodo.select_indices(candidates, benefits, write_costs, TABLE_ROWS, COLUMN_WIDTH, disk_budget,
+                               max_indices_per_table, include_columns)
+
+
+def test_select_indices_estimates():
+    _, estimates = select({"t.a+t.b": 0.5}, include_columns={"t.a+t.b": ["t.c"]}, write_costs={"t.a+t.b": 0.1})
+    assert estimates == {"t.a+t.b": (pytest.approx(index_size("t.a", "t.b", "t.c")), 0.5, 0.1)}
+
+
+def test_select_indices_disk_budget():
+    # the smaller candidates are worth more per byte
+    chosen, _ = select({"t.a": 0.3, "t.b": 0.2, "t.c": 0.5}, disk_budget=index_size("t.a") * 2 + 1)
+    assert chosen == ["t.a", "t.b"]
+    # no budget
+    chosen, _ = select({"t.a": 0.3, "t.b": 0.2, "t.c": 0.5})
+    assert sorted(chosen) == ["t.a", "t.b", "t.c"]
+
+
+def test_select_indices_best_single():
+    # the greedy choice (t.a) leaves no room for t.c, which is worth more on its own
+    chosen, _ = select({"t.a": 0.1, "t.c": 0.5}, disk_budget=index_size("t.c") + index_size("t.a") / 2)
+    assert chosen == ["t.c"]
+
+
+def test_select_indices_per_table():
+    chosen, _ = select({"t.a": 0.3, "t.b": 0.2, "u.a": 0.1}, max_indices_per_table=1)
+    assert sorted(chosen) == ["t.a", "u.a"]
+
+
+def test_select_indices_write_costs():
+    # the write cost of t.b exceeds its benefit
+    chosen, _ = select({"t.a": 0.3, "t.b": 0.2}, write_costs={"t.a": 0.1, "t.b": 0.3})
+    assert chosen == ["t.a"]
@@ -0,0 +1,174 @@
+import json
+
+import pytest
+
+import constants as K
+import dodo
+
+
+def tune(workload_csv, checkpoint_path=None, half_life=0, window=0, **kwargs):
+    params = dict(chunksize=K.CSV_CHUNKSIZE, workers=1, parse_cache="", whatif=0, disk_budget=0,
+                  max_indices_per_table=0, apply=0, maintenance_work_mem=K.APPLY_MAINTENANCE_WORK_MEM, replay=0,
+                  verbose=False)
+    params.update(kwargs)
+    return dodo.tune_indices(workload_csv, checkpoint_path=checkpoint_path, half_life=half_life, window=window,
+                             **params)
+
+
+def read_actions():
+    with open("actions.sql") as f:
+        return f.read().splitlines()
+
+
+def test_no_template_to_parse(fake_db, write_log):
+    # a select without predicate is never parsed
+    write_log("workload.csv", ["SELECT * FROM item"] * 3)
+    metrics = tune("workload.csv")
+    parse_stage = next(stage for stage in metrics["stages"] if stage["stage"] == "parse_templates")
+    assert parse_stage["rows"] == 0
+    assert parse_stage["failures"] == 0
+    assert read_actions() == []
+
+
+def test_online_idle_run(fake_db, write_log):
+    queries = ["SELECT * FROM review WHERE i_id = {}".format(i) for i in range(10)]
+    write_log("workload.csv", queries)
+    tune("workload.csv", "checkpoint.json")
+    actions = read_actions()
+    assert actions == ["CREATE INDEX IF NOT EXISTS idx_review_i_id ON review USING btree (i_id);"]
+
+    # no new log line
+    metrics = tune("workload.csv", "checkpoint.json")
+    assert metrics["num_run_queries"] == 0
+    assert metrics["num_queries"] == len(queries)
+    assert read_actions() == actions
+    with open("checkpoint.json") as f:
+        assert json.load(f)["num_queries"] == len(queries)
+
+
+@pytest.mark.parametrize("half_life", [0, 3])
+def test_online_runs_match_batch(fake_db, write_log, half_life):
+    queries = ["SELECT * FROM review WHERE i_id = {} AND rating > 3".format(i) for i in range(6)] + \
+              ["UPDATE review SET rating = {} WHERE a_id = 1".format(i) for i in range(3)]
+    write_log("workload.csv", queries[:4])
+    tune("workload.csv", "checkpoint.json", half_life)
+    write_log("workload.csv", queries[4:], start=4)
+    online = tune("workload.csv", "checkpoint.json", half_life)
+    online_actions = read_actions()
+    with open("checkpoint.json") as f:
+        online_weight = json.load(f)["workload_weight"]
+
+    batch = tune("workload.csv", half_life=half_life)
+    assert online["num_queries"] == batch["num_queries"] == len(queries)
+    assert online["num_run_queries"] == len(queries) - 4
+    assert online_actions == read_actions()
+    # the queries of the first run are aged by the same half-life
+    assert online_weight == pytest.approx(sum(2 ** ((i - len(queries) + 1) / half_life) for i in range(len(queries)))
+                                          if half_life else len(queries))
+
+
+def test_empty_log(fake_db, write_log):
+    write_log("workload.csv", ["BEGIN", "COMMIT"])
+    metrics = tune("workload.csv", half_life=60, window=60)
+    assert metrics["num_queries"] == 0
+    assert metrics["phases"] == []
+    assert read_actions() == []
+
+
+def current_index(table, index, columns, num_scans=10, size=8192):
+    return table, index, columns, False, num_scans, size
+
+
+def review_log(write_log):
+    write_log("workload.csv", ["SELECT * FROM review WHERE u_id = {} AND rating > 3".format(i) for i in range(10)])
+
+
+def composite_actions():
+    return [action for action in read_actions() if "u_id_rating" in action or "rating_u_id" in action]
+
+
+def test_existing_index_in_another_order(fake_db, write_log):
+    review_log(write_log)
+    fake_db["pg_index x"] = [current_index("review", "idx_review_rating_u_id", ["rating", "u_id"])]
+    tune("workload.csv")
+    assert composite_actions() == [
+        "CREATE INDEX IF NOT EXISTS idx_review_u_id_rating ON review USING btree (u_id, rating);",
+        "DROP INDEX IF EXISTS idx_review_rating_u_id;"]
+
+
+@pytest.mark.parametrize("index", ["review_u_id_rating_key", "idx_review_u_id_rating"])
+def test_existing_index_in_the_same_order(fake_db, write_log, index):
+    review_log(write_log)
+    fake_db["pg_index x"] = [current_index("review", index, ["u_id", "rating"]),
+                             current_index("review", "idx_review_rating_u_id", ["rating", "u_id"])]
+    tune("workload.csv")
+    # the build statement of an index that already exists under its name is a no-op
+    build = ["CREATE INDEX IF NOT EXISTS idx_review_u_id_rating ON review USING btree (u_id, rating);"]
+    assert composite_actions() == (build if index == "idx_review_u_id_rating" else []) + [
+        "DROP INDEX IF EXISTS idx_review_rating_u_id;"]
+
+
+def test_evaluate_existing_candidates(fake_db, write_log):
+    review_log(write_log)
+    fake_db["EXPLAIN"] = [([{"Plan": {"Total Cost": 10.0}}],)]
+    all_queries = dodo.filter_csv("workload.csv")
+    templates = dodo.fingerprint_queries(all_queries)
+    metadata, _ = dodo.extract_all_metadata(templates[K.QUERY].tolist())
+    candidates = ["review.rating+review.u_id"]
+    column_order = {"review.u_id": (False, 0.1, "review.u_id"), "review.rating": (True, 0.5, "review.rating")}
+
+    # built as (u_id, rating), an index on (rating, u_id) is not the same
+    current_indices = [("review.rating+review.u_id", "idx_review_rating_u_id", 10, 8192)]
+    assert list(dodo.evaluate_candidates(candidates, templates, metadata, current_indices, column_order, 1)) == \
+        candidates
+    current_indices = [("review.u_id+review.rating", "idx_review_u_id_rating", 10, 8192)]
+    assert dodo.evaluate_candidates(candidates, templates, metadata, current_indices, column_order, 1) == {}
+
+
+@pytest.mark.parametrize("index, generated", [
+    ("idx_review_i_id_include_0123abcd", True),
+    ("idx_review_i_id_where_rating_0123abcd", True),
+    ("idx_review_i_id_where_rating_include_0123abcd", True),
+    ("idx_review_i_id_where_include_0123abcd", True),
+    # named by hand
+    ("idx_review_i_id_include", False),
+    ("idx_review_i_id_where_active", False),
+    ("idx_review_i_id", False),
+])
+def test_generated_index_pattern(index, generated):
+    assert bool(dodo.generated_index_pattern.match(index)) == generated
+
+
+def test_keep_index_named_by_hand(fake_db, write_log):
+    write_log("workload.csv", ["SELECT * FROM review WHERE i_id = {}".format(i) for i in range(10)])
+    # a partial index made by hand, which is scanned
+    fake_db["pg_index x"] = [("review", "idx_review_u_id_where_active", ["u_id"], True, 10, 8192)]
+    tune("workload.csv")
+    assert read_actions() == ["CREATE INDEX IF NOT EXISTS idx_review_i_id ON review USING btree (i_id);"]
+
+
+def test_find_regressions(fake_db):
+    # a bitmap scan on one of the two indices built on the table
+    fake_db["EXPLAIN"] = [([{"Plan": {"Node Type": "Bitmap Heap Scan", "Plans": [
+        {"Node Type": "Bitmap Index Scan", "Index Name": "idx_review_i_id"}]}}],)]
+    build_statements = [("Simple", "CREATE INDEX IF NOT EXISTS idx_review_i_id ON review USING btree (i_id)"),
+                        ("Simple", "CREATE INDEX IF NOT EXISTS idx_review_rating ON review USING btree (rating)")]
+    slower = ["SELECT * FROM review WHERE i_id = {}".format(i) for i in range(3)]
+    faster = ["SELECT * FROM review WHERE rating = {}".format(i) for i in range(3)]
+    before = [(q, 0.001) for q in slower] + [(q, 0.010) for q in faster]
+    after = [(q, 0.010) for q in slower] + [(q, 0.001) for q in faster]
+    regressions = dodo.find_regressions(before, after, build_statements)
+    assert regressions == {"idx_review_i_id": [("SELECT * FROM review WHERE i_id = 0", 1.0, 10.0)]}
+
+    # the plan does not use a built index
+    fake_db["EXPLAIN"] = [([{"Plan": {"Node Type": "Seq Scan"}}],)]
+    assert dodo.find_regressions(before, after, build_statements) == {}
+
+
+def test_max_indices_per_table(fake_db, write_log):
+    write_log("workload.csv", ["SELECT * FROM review WHERE i_id = {}".format(i) for i in range(6)] +
+              ["SELECT * FROM review WHERE rating = {}".format(i) for i in range(4)])
+    tune("workload.csv")
+    assert len(read_actions()) == 2
+    tune("workload.csv", max_indices_per_table=1)
+    assert read_actions() == ["CREATE INDEX IF NOT EXISTS idx_review_i_id ON review USING btree (i_id);"]
@@ -0,0 +1,197 @@
+import collections
+
+import pandas as pd
+import pytest
+
+import constants as K
+import dodo
+
+
+def classify(queries):
+    return dodo.classify_queries(pd.Series(["statement: " + q for q in queries]))
+
+
+@pytest.mark.parametrize("query, template", [
+    ("SELECT * FROM t WHERE a = 42 AND name IN ('a', 'b')", "SELECT * FROM t WHERE a = 0 AND name IN (0)"),
+    ("SELECT * FROM t WHERE a = 7 AND name IN ('c')", "SELECT * FROM t WHERE a = 0 AND name IN (0)"),
+    ("INSERT INTO t VALUES (1, 2), (3, 4)", "INSERT INTO t VALUES (0, 0)"),
+    ("UPDATE t SET b = 'x''y' WHERE a = $1", "UPDATE t SET b = '?' WHERE a = 0"),
+    ("select  *  from t where x = 1.5", "select * from t where x = 0"),
+])
+def test_normalize_queries(query, template):
+    assert dodo.normalize_queries(pd.Series([query])).tolist() == [template]
+
+
+def test_fingerprint_queries():
+    all_queries = classify(["SELECT * FROM t WHERE a = 1", "SELECT * FROM t WHERE a = 2",
+                            "INSERT INTO t VALUES (1, 2)"])
+    templates = dodo.fingerprint_queries(all_queries)
+    assert templates[K.QUERY].tolist() == ["SELECT * FROM t WHERE a = 0", "INSERT INTO t VALUES (0, 0)"]
+    assert templates[K.TYPE].tolist() == [K.SELECT, K.INSERT]
+    assert templates[K.WHERE].tolist() == [True, False]
+    assert templates[K.SAMPLE].tolist() == ["SELECT * FROM t WHERE a = 1", "INSERT INTO t VALUES (1, 2)"]
+    assert templates[K.COUNT].tolist() == [2, 1]
+
+
+@pytest.mark.parametrize("query, conjuncts", [
+    ("SELECT * FROM t", []),
+    ("SELECT * FROM t WHERE a = 1 AND (b = 2 OR c = 3) ORDER BY a", ["a = 1", "(b = 2 OR c = 3)"]),
+    ("SELECT * FROM t WHERE a BETWEEN 1 AND 2 AND b = 'x AND y' LIMIT 1", ["a BETWEEN 1", "2", "b = 'x AND y'"]),
+    ("SELECT * FROM t WHERE (a = 1 AND b = 2) AND c = 3 FOR UPDATE", ["(a = 1 AND b = 2)", "c = 3"]),
+    ("SELECT * FROM t WHERE a IN (SELECT a FROM u WHERE b = 1) AND c = 2", ["a IN (SELECT a FROM u WHERE b = 1)",
+                                                                             "c = 2"]),
+])
+def test_where_conjuncts(query, conjuncts):
+    assert dodo.where_conjuncts(query) == conjuncts
+
+
+def test_find_constant_predicates():
+    # a is compared with too many literals to be a constant
+    values = range(K.PARTIAL_MAX_VALUES + 1)
+    all_queries = classify(["SELECT * FROM t WHERE status = '{}' AND a = {}".format(
+        "done" if i == 0 else "open", i) for i in values] + [
+        # only top-level AND conjuncts count, not the ones under OR / NOT
+        "SELECT * FROM t WHERE (status = 'x' OR a = 1) AND b = true",
+        "SELECT * FROM t WHERE NOT status = 'x' AND b = 1",
+        # a parameter is not a constant
+        "UPDATE t SET a = 1 WHERE b = $1",
+    ])
+    constants = dodo.find_constant_predicates(all_queries, dodo.normalize_queries(all_queries[K.QUERY]))
+    select = "SELECT * FROM t WHERE status = '?' AND a = 0"
+    assert constants[(select, "status")] == {"'open'": K.PARTIAL_MAX_VALUES, "'done'": 1}
+    assert constants[(select, "a")] is None
+    assert constants[("SELECT * FROM t WHERE (status = '?' OR a = 0) AND b = true", "b")] == {"TRUE": 1}
+    assert ("SELECT * FROM t WHERE (status = '?' OR a = 0) AND b = true", "status") not in constants
+    assert ("SELECT * FROM t WHERE NOT status = '?' AND b = 0", "status") not in constants
+    assert constants[("UPDATE t SET a = 0 WHERE b = 0", "b")] is None
+
+
+def test_merge_constant_predicates():
+    constants = {("q", "a"): collections.Counter({"1": 1}), ("q", "b"): None}
+    dodo.merge_constant_predicates(constants, {("q", "a"): collections.Counter({"1": 2}),
+                                               ("q", "b"): collections.Counter({"1": 1}),
+                                               ("q", "c"): None})
+    assert constants == {("q", "a"): {"1": 3}, ("q", "b"): None, ("q", "c"): None}
+
+
+def test_read_workload_chunks():
+    queries = ["SELECT * FROM t WHERE a = {}".format(i) for i in range(10)] + ["DELETE FROM t WHERE b = 1"]
+    num_queries, _, templates, _, _, _, _ = dodo.read_workload([classify(queries[:4]), classify(queries[4:])])
+    _, _, expected, _, _, _, _ = dodo.read_workload([classify(queries)])
+    assert num_queries == len(queries)
+    pd.testing.assert_frame_equal(templates, expected)
+
+
+def count(queries, table_columns=None):
+    all_queries = classify(queries)
+    templates = dodo.fingerprint_queries(all_queries)
+    constants = dodo.find_constant_predicates(all_queries, dodo.normalize_queries(all_queries[K.QUERY]))
+    metadata, _ = dodo.extract_all_metadata(templates[K.QUERY].tolist())
+    return dodo.count_templates(templates, metadata, constants, table_columns)
+
+
+def test_count_templates():
+    counters, failures = count([
+        "SELECT * FROM review WHERE i_id = 1 AND rating > 3",
+        "SELECT * FROM review WHERE i_id = 2 AND rating > 4",
+        "SELECT name FROM useracct WHERE u_id = 1",
+        "UPDATE useracct SET name = 'x' WHERE u_id = 1",
+        "INSERT INTO trust VALUES (1, 2)",
+        "DELETE FROM review WHERE a_id = 1",
+        "SELECT * FROM review r, useracct u WHERE r.u_id = u.u_id",
+    ])
+    assert counters[K.SIMPLE] == {"review.i_id": 2, "review.rating": 2, "useracct.u_id": 2, "review.a_id": 1}
+    assert counters[K.COMPOSITE] == {"review.i_id+review.rating": 2, "useracct.u_id": 2, "review.a_id": 1}
+    assert counters[K.RANGE] == {"review.rating": 2}
+    assert counters[K.JOIN] == {"review.u_id": 1, "useracct.u_id": 1}
+    assert counters[K.UPDATE] == {"useracct.name": 1}
+    assert counters[K.INSERT] == {"trust": 1}
+    assert counters[K.DELETE] == {"review": 1}
+    # a join-only WHERE is not a failure
+    assert sum(failures.values()) == 0
+
+
+def test_count_templates_qualified():
+    table_columns = {"review": ["a_id", "u_id", "i_id", "rating"], "useracct": ["u_id", "name"]}
+    counters, failures = count(["SELECT * FROM review WHERE i_id = 1 AND rating > 3",
+                                "SELECT * FROM review r, useracct u WHERE r.u_id = u.u_id AND u.name = 'a'"],
+                               table_columns)
+    assert counters[K.SIMPLE] == {"review.i_id": 1, "review.rating": 1, "useracct.name": 1}
+    assert counters[K.COMPOSITE] == {"review.i_id+review.rating": 1, "useracct.name": 1}
+    assert sum(failures.values()) == 0
+
+
+def test_find_frequent_cols_failures():
+    queries = pd.Series(["SELECT * FROM t WHERE a = 0", "SELECT * FROM t WHERE b = 0"])
+    weights = {queries[0]: 3, queries[1]: 2}
+    metadata = {queries[0]: dodo.extract_metadata(queries[0])[0], queries[1]: None}
+    counter_simple, counter_composite, num_failed_queries = dodo.find_frequent_cols(queries, weights, metadata)
+    assert counter_simple == {"t.a": 3}
+    assert counter_composite == {"t.a": 3}
+    assert num_failed_queries == 2
+
+
+@pytest.mark.parametrize("candidates, include_columns, partial_predicates, statements", [
+    (["t.a", "t.b+t.a"], None, None, [
+        "CREATE INDEX IF NOT EXISTS idx_t_a ON t USING btree (a)",
+        "CREATE INDEX IF NOT EXISTS idx_t_b_a ON t USING btree (b, a)"]),
+    # covering and partial indices are named after their INCLUDE columns and predicate
+    (["t.a"], {"t.a": ["t.c"]}, None, [
+        "CREATE INDEX IF NOT EXISTS idx_t_a_include_{} ON t USING btree (a) INCLUDE (c)".format(
+            dodo.definition_hash(" INCLUDE (c)"))]),
+    (["t.a+t.b"], None, {"t.a+t.b": [("t.b", ["1"])]}, [
+        "CREATE INDEX IF NOT EXISTS idx_t_a_where_b_{} ON t USING btree (a) WHERE b = 1".format(
+            dodo.definition_hash(" WHERE b = 1"))]),
+    (["t.a"], None, {"t.a": [("t.s", ["'open'", "'new'"])]}, [
+        "CREATE INDEX IF NOT EXISTS idx_t_a_where_s_{} ON t USING btree (a) WHERE s IN ('open', 'new')".format(
+            dodo.definition_hash(" WHERE s IN ('open', 'new')"))]),
+    # candidates on the same key and predicate are merged, their INCLUDE columns too
+    (["t.a+t.s", "t.a"], {"t.a": ["t.c"], "t.a+t.s": ["t.d"]},
+     {"t.a+t.s": [("t.s", ["'open'"])], "t.a": [("t.s", ["'open'"])]}, [
+         "CREATE INDEX IF NOT EXISTS idx_t_a_where_s_include_{} ON t USING btree (a) INCLUDE (d, c) "
+         "WHERE s = 'open'".format(dodo.definition_hash(" INCLUDE (d, c) WHERE s = 'open'"))]),
+    # no index on a key compared with a single constant only
+    (["t.s"], None, {"t.s": [("t.s", ["'open'"])]}, []),
+])
+def test_generate_build_index_statements(candidates, include_columns, partial_predicates, statements):
+    assert [statement for _, statement in dodo.generate_build_index_statements(
+        candidates, include_columns=include_columns, partial_predicates=partial_predicates)] == statements
+
+
+def test_generate_build_index_statements_name_length():
+    column = "a" * 40
+    candidate = "t.{}+t.{}".format(column, "s" * 30)
+    (_, statement), = dodo.generate_build_index_statements(
+        [candidate], partial_predicates={candidate: [("t." + "s" * 30, ["1", "2"])]})
+    index_name = statement.split()[5]
+    assert len(index_name) < K.MAX_IDENTIFIER_LENGTH
+    assert index_name.endswith(dodo.definition_hash("({0}, {1}) WHERE {1} IN (1, 2)".format(column, "s" * 30)))
+    assert dodo.generated_index_pattern.match(index_name)
+
+
+def test_generate_build_index_statements_truncated_names():
+    # the names of both indices are truncated within their first key column
+    candidates = ["t.{}+t.b".format("a" * 60), "t.{}+t.c".format("a" * 60)]
+    partial_predicates = {candidate: [("t.s", ["1", "2"])] for candidate in candidates}
+    statements = dodo.generate_build_index_statements(candidates, partial_predicates=partial_predicates)
+    index_names = [statement.split()[5] for _, statement in statements]
+    assert len(set(index_names)) == 2
+    assert all(len(index_name) < K.MAX_IDENTIFIER_LENGTH for index_name in index_names)
+
+
+@pytest.mark.parametrize("chunks", [
+    [],
+    [classify(["BEGIN", "COMMIT"])],
+    # nothing to parse
+    [classify(["SELECT * FROM item"])],
+])
+def test_empty_workload(chunks):
+    num_queries, _, templates, constants, _, _, _ = dodo.read_workload(chunks)
+    metadata, extraction_paths = dodo.parse_templates(templates, "", 1)
+    assert metadata == {}
+    assert extraction_paths == {}
+    counters, failures = dodo.count_templates(templates, metadata, constants)
+    assert not any(counters.values())
+    assert sum(failures.values()) == 0
+    candidate_indices_to_percent_usage, _ = dodo.find_candidates(counters, max(num_queries, 1))
+    assert candidate_indices_to_percent_usage == {}